@@ -0,0 +1,194 @@
+# analytics.py
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from folder_scanner import iter_tree
+
+TABLE_CACHE_VERSION = 1
+BOX_COUNT_BINS = [0, 1, 2, 3, 4, 5, 10, 20, 50]
+BOX_SIZE_BINS = [0.0, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0]
+ASPECT_BINS = [0.0, 0.25, 0.5, 0.8, 1.25, 2.0, 4.0, np.inf]
+
+class LabelTable:
+    # 1行=1ボックスの列指向テーブル。image列は stems のインデックス
+    def __init__(self, stems, mtimes, sizes, counts, cls, xywh):
+        self.stems, self.mtimes, self.sizes, self.counts = stems, mtimes, sizes, counts
+        self.cls, self.xywh = cls, xywh
+        self.offsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64) if len(counts) else np.zeros(0, np.int64)
+        self.image = np.repeat(np.arange(len(stems), dtype=np.int32), counts)
+
+    def __len__(self): return len(self.cls)
+
+def _empty_table():
+    return LabelTable(np.array([], dtype=str), np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int32), np.zeros((0, 4), np.float32))
+
+def _load_table_cache(cache_path):
+    try:
+        with np.load(cache_path) as data:
+            if int(data["version"]) != TABLE_CACHE_VERSION: return None
+            return LabelTable(data["stems"], data["mtimes"], data["sizes"], data["counts"], data["cls"], data["xywh"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def _save_table_cache(cache_path, table):
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, version=TABLE_CACHE_VERSION, stems=table.stems, mtimes=table.mtimes, sizes=table.sizes, counts=table.counts, cls=table.cls, xywh=table.xywh)
+    os.replace(tmp_path, cache_path)
+
+def _read_text(path):
+    try:
+        with open(path, 'r') as f: return f.read()
+    except OSError: return None
+
+def parse_label_text(text):
+    # 正常なファイルは一括変換、壊れた行を含む場合のみ1行ずつ解析
+    try:
+        values = np.array(text.split(), dtype=np.float64)
+        if values.size % 5 == 0: return values.reshape(-1, 5)
+    except ValueError:
+        pass
+    rows = []
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) != 5: continue
+        try: rows.append([float(p) for p in parts])
+        except ValueError: continue
+    return np.array(rows, dtype=np.float64).reshape(-1, 5)
+
+def build_label_table(labels_dir, cache_path=None, workers=8, recursive=False):
+    # 変更のないファイルはキャッシュの行を再利用し、変更・追加分だけ解析する
+    entries = []
+    if os.path.isdir(labels_dir):
+        for rel, files in iter_tree(labels_dir, recursive):
+            prefix = f"{rel}/" if rel else ""
+            for e in files:
+                if not e.name.endswith(".txt"): continue
+                try: st = e.stat()
+                except OSError: continue
+                entries.append((prefix + e.name[:-4], st.st_mtime_ns, st.st_size))
+    if not entries: return _empty_table(), 0
+
+    cached = _load_table_cache(cache_path) if cache_path else None
+    prev = {}
+    if cached is not None:
+        prev = {stem: i for i, stem in enumerate(cached.stems.tolist())}
+
+    reused_idx, reused_entries, changed_entries = [], [], []
+    for stem, mtime, size in entries:
+        i = prev.get(stem)
+        if i is not None and cached.mtimes[i] == mtime and cached.sizes[i] == size:
+            reused_idx.append(i); reused_entries.append((stem, mtime, size))
+        else:
+            changed_entries.append((stem, mtime, size))
+
+    cls_parts, xywh_parts, counts = [], [], []
+    if reused_idx:
+        idx = np.array(reused_idx, dtype=np.int64)
+        r_counts = cached.counts[idx]
+        # 再利用ファイルの行番号をまとめて生成 (offset + 0..count-1)
+        starts = np.repeat(cached.offsets[idx] - np.concatenate(([0], np.cumsum(r_counts)[:-1])), r_counts)
+        rows = starts + np.arange(int(r_counts.sum()))
+        cls_parts.append(cached.cls[rows]); xywh_parts.append(cached.xywh[rows]); counts.append(r_counts)
+
+    if changed_entries:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            texts = list(pool.map(_read_text, (os.path.join(labels_dir, f"{stem}.txt") for stem, _, _ in changed_entries)))
+        parsed = [parse_label_text(t) if t else np.zeros((0, 5)) for t in texts]
+        c_counts = np.array([len(p) for p in parsed], dtype=np.int64)
+        if c_counts.sum():
+            data = np.concatenate(parsed)
+            cls_parts.append(data[:, 0].astype(np.int32)); xywh_parts.append(data[:, 1:].astype(np.float32))
+        counts.append(c_counts)
+
+    ordered = reused_entries + changed_entries
+    table = LabelTable(np.array([e[0] for e in ordered]), np.array([e[1] for e in ordered], dtype=np.int64), np.array([e[2] for e in ordered], dtype=np.int64),
+                       np.concatenate(counts).astype(np.int64),
+                       np.concatenate(cls_parts) if cls_parts else np.zeros(0, np.int32),
+                       np.concatenate(xywh_parts) if xywh_parts else np.zeros((0, 4), np.float32))
+    if cache_path and (changed_entries or cached is None or len(cached.stems) != len(ordered)):
+        try: _save_table_cache(cache_path, table)
+        except Exception as e: print(f"Label table cache writing error: {e}")
+    return table, len(changed_entries)
+
+def table_from_columns(labels, boxes):
+    # SQLiteラベルストアから読み出した行をそのまま列に変換する (txtの解析は不要)
+    if not labels: return _empty_table()
+    data = np.array(boxes, dtype=np.float64).reshape(-1, 5)
+    return LabelTable(np.array([r[0] for r in labels]), np.array([int(r[3] * 1e9) for r in labels], dtype=np.int64),
+                      np.array([r[2] for r in labels], dtype=np.int64), np.array([r[1] for r in labels], dtype=np.int64),
+                      data[:, 0].astype(np.int32), data[:, 1:].astype(np.float32))
+
+def summarize(table, class_names, image_files, approval_status):
+    start = time.perf_counter()
+    # 対象フォルダの画像に対応するラベルだけを集計する
+    stem_to_status = {os.path.splitext(f)[0]: approval_status.get(f, "未確認") for f in image_files}
+    in_folder = np.fromiter((s in stem_to_status for s in table.stems.tolist()), dtype=bool, count=len(table.stems))
+    row_mask = in_folder[table.image] if len(table) else np.zeros(0, bool)
+    cls, xywh, image = table.cls[row_mask], table.xywh[row_mask], table.image[row_mask]
+    n_classes = max(len(class_names), int(cls.max()) + 1 if len(cls) else 0)
+
+    per_class = np.bincount(cls, minlength=n_classes)
+    pairs = np.unique(image.astype(np.int64) * n_classes + cls) if len(cls) else np.zeros(0, np.int64)
+    images_per_class = np.bincount(pairs % n_classes, minlength=n_classes) if n_classes else np.zeros(0, np.int64)
+
+    box_counts = table.counts[in_folder]
+    unlabeled = len(image_files) - int(in_folder.sum())
+    count_hist = np.histogram(box_counts, bins=BOX_COUNT_BINS + [np.inf])[0]
+    count_hist[0] += unlabeled
+
+    w, h = xywh[:, 2].astype(np.float64), xywh[:, 3].astype(np.float64)
+    size_hist = np.histogram(np.sqrt(np.clip(w * h, 0, None)), bins=BOX_SIZE_BINS)[0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        aspect = np.where(h > 0, w / h, np.inf)
+    aspect_hist = np.histogram(aspect, bins=ASPECT_BINS)[0]
+
+    status_of_file = np.array([stem_to_status.get(s, "") for s in table.stems.tolist()], dtype=object)
+    status_images, status_boxes = {}, {}
+    for status in stem_to_status.values(): status_images[status] = status_images.get(status, 0) + 1
+    for status in set(stem_to_status.values()):
+        file_mask = in_folder & (status_of_file == status)
+        status_boxes[status] = int(table.counts[file_mask].sum())
+
+    return {"images": len(image_files), "labeled": int(in_folder.sum()), "boxes": int(len(cls)),
+            "per_class": per_class, "images_per_class": images_per_class,
+            "count_hist": count_hist, "size_hist": size_hist, "aspect_hist": aspect_hist,
+            "status_images": status_images, "status_boxes": status_boxes,
+            "out_of_range": int(((xywh < 0) | (xywh > 1)).any(axis=1).sum()) if len(xywh) else 0,
+            "elapsed_ms": (time.perf_counter() - start) * 1000}
+
+def _bar(value, max_value, width=30):
+    return "█" * (int(round(value / max_value * width)) if max_value else 0)
+
+def _hist_lines(labels, counts):
+    max_count = max(counts) if len(counts) else 0
+    return [f"  {label:>12}  {int(c):>9}  {_bar(c, max_count)}" for label, c in zip(labels, counts)]
+
+def format_report(summary, class_names):
+    lines = [f"画像: {summary['images']}枚  ラベルあり: {summary['labeled']}枚  ボックス: {summary['boxes']}個  (集計 {summary['elapsed_ms']:.1f} ms)"]
+    if summary["out_of_range"]: lines.append(f"※ 座標が[0,1]の範囲外のボックス: {summary['out_of_range']}個")
+
+    lines += ["", "■ クラス別ボックス数 (ボックス数 / 出現画像数)"]
+    per_class, per_image = summary["per_class"], summary["images_per_class"]
+    max_count = per_class.max() if len(per_class) else 0
+    for class_id in np.argsort(-per_class, kind="stable"):
+        if per_class[class_id] == 0: continue
+        name = class_names[class_id] if class_id < len(class_names) else f"(未定義 {class_id})"
+        lines.append(f"  {class_id:>4}: {name[:16]:<16} {int(per_class[class_id]):>9} / {int(per_image[class_id]):>7}  {_bar(per_class[class_id], max_count)}")
+
+    lines += ["", "■ 画像あたりのボックス数"]
+    edges = BOX_COUNT_BINS + [None]
+    labels = [str(lo) if hi == lo + 1 else (f"{lo}+" if hi is None else f"{lo}-{hi-1}") for lo, hi in zip(edges[:-1], edges[1:])]
+    lines += _hist_lines(labels, summary["count_hist"])
+
+    lines += ["", "■ ボックスサイズ (√(w×h), 画像比)"]
+    lines += _hist_lines([f"{lo:.2f}-{hi:.2f}" for lo, hi in zip(BOX_SIZE_BINS[:-1], BOX_SIZE_BINS[1:])], summary["size_hist"])
+
+    lines += ["", "■ アスペクト比 (w/h)"]
+    lines += _hist_lines([f"{lo:g}-{hi:g}" for lo, hi in zip(ASPECT_BINS[:-1], ASPECT_BINS[1:])], summary["aspect_hist"])
+
+    lines += ["", "■ ステータス別 (画像数 / ボックス数)"]
+    for status, count in sorted(summary["status_images"].items(), key=lambda item: -item[1]):
+        lines.append(f"  {status:>12}  {count:>9} / {summary['status_boxes'].get(status, 0):>9}")
+    return "\n".join(lines)
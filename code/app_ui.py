@@ -2,16 +2,23 @@
 import tkinter
 import customtkinter as ctk
 from PIL import Image, ImageTk
-from ultralytics import YOLO
 import os
 from event_handlers import EventHandlers
 from utils import format_bytes
+from profiler import StageProfiler
+from io_executor import WriteBehindExecutor
+from video_source import VideoFrameCache, open_source_image, split_frame_key
+from box_tracker import BoxPropagator
+from model_pool import ModelPool, model_label
+from class_picker import ClassPicker, MRU_SIZE
 import datetime
 import copy
 import time
 import colorsys
+import threading
 
 MAX_HISTORY = 101
+REFINE_DELAY_MS = 150  # 操作が止まってから高品質な縮小に差し替えるまでの待ち時間
 
 class AnnotationApp(ctk.CTk):
     def __init__(self, model_path):
@@ -21,7 +28,10 @@ class AnnotationApp(ctk.CTk):
 
         self.font_family = "Meiryo UI" 
         
-        self.model = YOLO(model_path); self.events = EventHandlers(self)
+        # 推論モデルは複数を読み込んだまま保持し、オプション設定から切り替える (起動時のモデルは読み込み完了まで待つ)
+        self.model_pool = ModelPool(); self.model_pool.activate(model_path)
+        self.base_model_path, self.model_registry, self.model_menu = model_path, None, None
+        self.events = EventHandlers(self)
         self.mode = 'start'; self.mouse_state = 'idle'
         self.project_dir, self.image_dir, self.labels_dir = "", "", ""
         self.class_names, self.all_image_files, self.image_files = [], [], []
@@ -29,13 +39,19 @@ class AnnotationApp(ctk.CTk):
         self.current_image, self.tk_image = None, None
         self.resized_w, self.resized_h = 0, 0
         self.boxes = {}; self.undo_stack = []; self.redo_stack = []
+        # 表示中の画像のラベルを読み込んだときの状態 (変更が無ければ保存を省略する)。None は未保存・要書き込み
+        self.loaded_label = None
         
         # 承認ステータス用
         self.approval_status = {}
         self.status_file_path = ""
+        self.recursive = False
+        self.scan_dirs = ([], [])
         
         self.selected_box_id, self.selected_handle = None, None
         self.start_x, self.start_y, self.temp_box_id = None, None, None
+        # 領域の再検出: 次のドラッグで囲んだ範囲だけを高解像度で推論する
+        self.roi_mode = False
         
         # クロスヘア用ID
         self.crosshair_v = None
@@ -60,16 +76,56 @@ class AnnotationApp(ctk.CTk):
         self.annotated_count_cache = 0
         self.ignore_input_until = 0
         self.is_dialog_active = False
+        # クラス選択ダイアログ (使い回す) と最近使ったクラス。数字キー 0-9 は先頭から順にこの一覧を指す
+        self.class_picker = None
+        self.class_mru = list(range(MRU_SIZE))
         
         # サイズキャッシュ
         self.total_image_size_cache = 0
         self.total_label_size_cache = 0
+        self.image_sizes, self.label_sizes = {}, {}
+        self.fs_watcher = None
+        self.folder_scanner = None
+        self.scan_cache_path, self.scan_cache_dirty = "", False
 
         self.options_window = None
+        self.analytics_window = None
+        self.analytics_job = None
+        self.grid_window = None
+        self.remap_window = None
+        self.lint_job = None
+        self.coco_job = None
+        self.import_job = None
+        # 作業キューのクエリ用索引 (初回のクエリで作り、以降は保存・ステータス変更のたびに差分で更新する)
+        self.query_index, self.query_job = None, None
+        # リモート (fsspec) の画像フォルダを開いているときの RemoteSource
+        self.remote = None
+        self.work_lease = None
+
+        # 重複画像 (知覚ハッシュ) 用
+        self.duplicate_groups, self.duplicate_of = {}, {}
+        self.dedup_threshold = 6
+        self.dedup_job = None
+        # ラベル保存先 (TxtLabelStore / SqliteLabelStore)
+        self.label_store = None
+        # 動画フレームのデコード済みキャッシュ
+        self.frame_cache = VideoFrameCache()
+        # 連続フレームへのボックス引き継ぎ
+        self.box_propagator = BoxPropagator()
         self.resize_timer = None
+        # 2パス描画: 高速な縮小をすぐ表示し、高品質 (LANCZOS) 版は操作が止まってから差し替える
+        self.refine_timer, self.refine_job, self.refined = None, None, None
         self.log_file_path = None
         self.stats_labels = {} 
 
+        # ステージ別処理時間の計測
+        self.profiler = StageProfiler()
+        # 操作の記録 (input_replay.InputRecorder) と、記録を再生中かどうか
+        self.input_recorder, self.replaying = None, False
+        self.record_input_var = tkinter.BooleanVar(value=False)
+        # ラベル・ステータス・セッション・ログの書き込みはバックグラウンドで行う
+        self.io = WriteBehindExecutor()
+
         self.grid_rowconfigure(0, weight=1); self.grid_columnconfigure(0, weight=1)
         
         self.start_frame = self.create_start_screen()
@@ -78,9 +134,28 @@ class AnnotationApp(ctk.CTk):
         
         self.bind_shortcuts()
         self.bind("<Configure>", self._on_resize)
+        self.protocol("WM_DELETE_WINDOW", self.on_closing)
         self.schedule_auto_save()
         
         self.update_timer()
+        self.events.poll_io_executor()
+
+    def flush_io(self, timeout=30.0):
+        # 未完了の書き込みを待ち、完了通知 (pending の解除やエラー表示) まで処理する
+        if not self.io.flush(timeout): self.log("警告: ファイルの書き込みが完了していません。")
+        for key, callbacks, result, error in self.io.drain_completions(limit=100000):
+            for callback in callbacks: callback(result, error)
+            if error is not None: print(f"Write error ({key}): {error}")
+
+    def on_closing(self):
+        if self.mode != 'start': self.events.save_project_session(silent=True)
+        self.events.stop_input_recording()
+        self.events.stop_folder_watcher()
+        self.events.release_work_lease()
+        self.events.close_remote()
+        self.flush_io()
+        self.io.shutdown()
+        self.destroy()
 
     def schedule_auto_save(self):
         if self.auto_save_interval > 0:
@@ -105,6 +180,9 @@ class AnnotationApp(ctk.CTk):
                 self.time_val_label.configure(text=time_str)
                 self.pace_val_label.configure(text=pace_str)
 
+            if self.profiler.enabled and hasattr(self, 'profiler_label'):
+                self.profiler_label.configure(text=self.profiler.overlay_text())
+
         self.after(1000, self.update_timer)
 
     def log(self, message):
@@ -113,11 +191,7 @@ class AnnotationApp(ctk.CTk):
         full_log_entry = f"[{timestamp}] {message}\n"
 
         if self.log_file_path:
-            try:
-                with open(self.log_file_path, 'a', encoding='utf-8') as f:
-                    f.write(full_log_entry)
-            except Exception as e:
-                print(f"Log file writing error: {e}")
+            self.io.append_text(self.log_file_path, full_log_entry)
 
         if hasattr(self, 'log_textbox') and self.log_textbox.winfo_exists():
             self.log_textbox.configure(state="normal")
@@ -145,6 +219,14 @@ class AnnotationApp(ctk.CTk):
         step2_frame.pack(pady=10, fill="x")
         self.select_image_folder_button = ctk.CTkButton(step2_frame, text="2. 対象画像フォルダを選択", command=self.events.select_image_folder, state="disabled", font=ctk.CTkFont(family=self.font_family))
         self.select_image_folder_button.pack(pady=5, ipady=2)
+        self.open_remote_button = ctk.CTkButton(step2_frame, text="2'. リモートの画像フォルダを開く (URL)", command=self.events.open_remote_folder, state="disabled", font=ctk.CTkFont(family=self.font_family))
+        self.open_remote_button.pack(pady=(0, 5), ipady=2)
+        self.recursive_var = tkinter.BooleanVar(value=False)
+        ctk.CTkCheckBox(step2_frame, text="サブフォルダも含める", variable=self.recursive_var, font=ctk.CTkFont(family=self.font_family)).pack(pady=(0, 5))
+        self.use_sqlite_var = tkinter.BooleanVar(value=False)
+        ctk.CTkCheckBox(step2_frame, text="ラベルをSQLiteに保存", variable=self.use_sqlite_var, font=ctk.CTkFont(family=self.font_family)).pack(pady=(0, 5))
+        self.share_work_var = tkinter.BooleanVar(value=False)
+        ctk.CTkCheckBox(step2_frame, text="複数人で分担 (作業を予約)", variable=self.share_work_var, font=ctk.CTkFont(family=self.font_family)).pack(pady=(0, 5))
         self.image_path_label = ctk.CTkLabel(step2_frame, text="対象フォルダ: 未選択", text_color="gray", font=ctk.CTkFont(family=self.font_family)); self.image_path_label.pack()
 
         stats_frame = ctk.CTkFrame(content_frame, border_width=1, border_color="gray")
@@ -162,6 +244,22 @@ class AnnotationApp(ctk.CTk):
         size_frame.grid(row=3, column=0, columnspan=5, pady=(5, 5))
         self.stats_labels['total_size'] = ctk.CTkLabel(size_frame, text="合計容量 (画像: - / ラベル: -)", font=ctk.CTkFont(family=self.font_family, size=12))
         self.stats_labels['total_size'].pack()
+        tools_frame = ctk.CTkFrame(stats_frame, fg_color="transparent")
+        tools_frame.grid(row=4, column=0, columnspan=5, pady=(0, 10))
+        self.analytics_button = ctk.CTkButton(tools_frame, text="データセット分析", state="disabled", command=self.events.show_dataset_analytics, width=160, font=ctk.CTkFont(family=self.font_family))
+        self.analytics_button.grid(row=0, column=0, padx=5)
+        self.dedup_button = ctk.CTkButton(tools_frame, text="重複画像を検出", state="disabled", command=self.events.detect_duplicates, width=160, font=ctk.CTkFont(family=self.font_family))
+        self.dedup_button.grid(row=0, column=1, padx=5)
+        self.skip_duplicates_var = tkinter.BooleanVar(value=False)
+        ctk.CTkCheckBox(tools_frame, text="重複は代表のみ作業", variable=self.skip_duplicates_var, font=ctk.CTkFont(family=self.font_family)).grid(row=0, column=2, padx=5)
+        self.sync_store_button = ctk.CTkButton(tools_frame, text="txtと同期", state="disabled", command=self.events.sync_label_store, width=100, font=ctk.CTkFont(family=self.font_family))
+        self.sync_store_button.grid(row=0, column=3, padx=5)
+        self.remap_button = ctk.CTkButton(tools_frame, text="クラスの一括変更", state="disabled", command=self.events.open_class_remap, width=160, font=ctk.CTkFont(family=self.font_family))
+        self.remap_button.grid(row=1, column=0, padx=5, pady=(5, 0))
+        self.lint_button = ctk.CTkButton(tools_frame, text="データ検証", state="disabled", command=self.events.validate_dataset, width=160, font=ctk.CTkFont(family=self.font_family))
+        self.lint_button.grid(row=1, column=1, padx=5, pady=(5, 0))
+        self.import_button = ctk.CTkButton(tools_frame, text="ラベルの取り込み", state="disabled", command=self.events.import_external_labels, width=160, font=ctk.CTkFont(family=self.font_family))
+        self.import_button.grid(row=1, column=2, columnspan=2, padx=5, pady=(5, 0))
 
         ctk.CTkLabel(content_frame, text="--- 作業を選択 ---", font=ctk.CTkFont(family=self.font_family)).pack(pady=(10, 5))
         
@@ -171,6 +269,8 @@ class AnnotationApp(ctk.CTk):
         self.start_annotation_button.grid(row=0, column=0, padx=5, pady=5)
         self.start_approval_button = ctk.CTkButton(btn_frame1, text="4. 承認作業 (全件/未承認)", state="disabled", command=self.events.start_approval_mode, width=220, font=ctk.CTkFont(family=self.font_family))
         self.start_approval_button.grid(row=0, column=1, padx=5, pady=5)
+        self.grid_review_button = ctk.CTkButton(btn_frame1, text="4'. グリッドで一括承認", state="disabled", command=self.events.open_grid_review, width=220, font=ctk.CTkFont(family=self.font_family))
+        self.grid_review_button.grid(row=1, column=1, padx=5, pady=(0, 5))
 
         btn_frame2 = ctk.CTkFrame(content_frame, fg_color="transparent")
         btn_frame2.pack(pady=5)
@@ -179,9 +279,20 @@ class AnnotationApp(ctk.CTk):
         self.start_reapproval_button = ctk.CTkButton(btn_frame2, text="6. 再承認作業 (修正分のみ)", state="disabled", command=self.events.start_reapproval_mode, width=220, font=ctk.CTkFont(family=self.font_family))
         self.start_reapproval_button.grid(row=0, column=1, padx=5, pady=5)
 
+        query_frame = ctk.CTkFrame(content_frame, fg_color="transparent")
+        query_frame.pack(pady=5)
+        self.query_entry = ctk.CTkEntry(query_frame, width=450, placeholder_text="クエリ (例: status:rejected class:bicycle / boxes>30 / edited>=monday)", font=ctk.CTkFont(family=self.font_family))
+        self.query_entry.grid(row=0, column=0, columnspan=2, padx=5, pady=(0, 5))
+        self.query_annotation_button = ctk.CTkButton(query_frame, text="クエリ結果をアノテーション", state="disabled", command=lambda: self.events.start_query_mode('annotation'), width=220, font=ctk.CTkFont(family=self.font_family))
+        self.query_annotation_button.grid(row=1, column=0, padx=5)
+        self.query_approval_button = ctk.CTkButton(query_frame, text="クエリ結果を承認", state="disabled", command=lambda: self.events.start_query_mode('approval'), width=220, font=ctk.CTkFont(family=self.font_family))
+        self.query_approval_button.grid(row=1, column=1, padx=5)
+
         ctk.CTkLabel(content_frame, text="--- 完了後 ---", font=ctk.CTkFont(family=self.font_family)).pack(pady=(20, 5))
         self.export_button = ctk.CTkButton(content_frame, text="7. データセットのエクスポート", state="disabled", command=self.events.export_approved_dataset, width=450, fg_color="#E59100", hover_color="#B37100", font=ctk.CTkFont(family=self.font_family))
         self.export_button.pack(pady=5)
+        self.coco_export_button = ctk.CTkButton(content_frame, text="COCO JSONでエクスポート", state="disabled", command=self.events.export_coco_dataset, width=450, fg_color="#E59100", hover_color="#B37100", font=ctk.CTkFont(family=self.font_family))
+        self.coco_export_button.pack(pady=5)
         return frame
 
     def create_main_ui(self):
@@ -248,6 +359,10 @@ class AnnotationApp(ctk.CTk):
         self.total_img_size_label = ctk.CTkLabel(progress_frame, text="画像合計サイズ: -", font=ctk.CTkFont(family=self.font_family)); self.total_img_size_label.pack(anchor="w", padx=10)
         self.label_size_label = ctk.CTkLabel(progress_frame, text="ラベル合計サイズ: -", font=ctk.CTkFont(family=self.font_family)); self.label_size_label.pack(anchor="w", padx=10)
         
+        # 処理時間オーバーレイ (計測有効時のみ表示)
+        self.profiler_label = ctk.CTkLabel(self.left_frame, text="", justify="left", anchor="w", font=ctk.CTkFont(family="Consolas", size=11))
+        if self.profiler.enabled: self.profiler_label.pack(pady=(0, 5), padx=20, fill="x", side="bottom")
+
         self.box_list_frame = ctk.CTkScrollableFrame(self.left_frame, label_text="--- オブジェクト一覧 ---"); self.box_list_frame.pack(pady=10, padx=20, fill="both", expand=True, side="top")
         
         self.right_frame = ctk.CTkFrame(self.main_frame); self.right_frame.grid(row=0, column=1, sticky="nsew", padx=10, pady=10)
@@ -255,6 +370,7 @@ class AnnotationApp(ctk.CTk):
         self.info_frame = ctk.CTkFrame(self.right_frame); self.info_frame.grid(row=0, column=0, sticky="ew", padx=5, pady=(5,0))
         self.image_info_label = ctk.CTkLabel(self.info_frame, text="画像: - / -", anchor="w", font=ctk.CTkFont(family=self.font_family)); self.image_info_label.pack(side="left", padx=10)
         self.status_display_label = ctk.CTkLabel(self.info_frame, text="ステータス: 未選択", anchor="e", font=ctk.CTkFont(family=self.font_family)); self.status_display_label.pack(side="right", padx=10)
+        self.roi_button = ctk.CTkButton(self.info_frame, text="領域を再検出 (R)", width=130, command=self.events.toggle_roi_mode, font=ctk.CTkFont(family=self.font_family)); self.roi_button.pack(side="right", padx=5)
         self.canvas = tkinter.Canvas(self.right_frame, bg="gray", bd=0, highlightthickness=0, cursor="tcross"); self.canvas.grid(row=1, column=0, sticky="nsew")
         self.log_textbox = ctk.CTkTextbox(self.right_frame, state="disabled", font=ctk.CTkFont(family=self.font_family, size=12));
         self.log_textbox.grid(row=2, column=0, sticky="nsew", padx=5, pady=5)
@@ -267,6 +383,7 @@ class AnnotationApp(ctk.CTk):
         self.canvas.bind("<Button-3>", self.events.on_right_click)
 
     def switch_to_main_ui(self, mode):
+        self.flush_io()
         self.mode = mode; self.start_frame.grid_forget()
         self.create_main_ui()
         self.main_frame.grid(row=0, column=0, sticky="nsew")
@@ -288,15 +405,24 @@ class AnnotationApp(ctk.CTk):
         self.update_progress_display()
 
     def switch_to_start_screen(self):
+        self.events.stop_input_recording()
+        self.events.release_work_lease()
+        self.flush_io()
+        self.export_profile()
         self.mode = 'start'; self.main_frame.grid_forget(); self.start_frame.grid(row=0, column=0, sticky="nsew")
         self.title("汎用画像アノテーションツール")
         if self.image_dir: self.events.update_dashboard_stats()
+        # SQLite使用時は作業の区切りで txt に書き出し、学習ツールから常に最新のラベルが読めるようにする
+        if self.label_store and self.label_store.kind == "sqlite":
+            self.approval_status.save()
+            try: self.log(f"ラベルを txt に書き出しました ({self.label_store.export_to_txt()}件)")
+            except OSError as e: self.log(f"エラー: txtへの書き出しに失敗しました。 {e}")
 
     def open_options_window(self):
         if self.options_window is None or not self.options_window.winfo_exists():
             self.options_window = ctk.CTkToplevel(self)
             self.options_window.title("オプション設定")
-            self.options_window.geometry("300x550")
+            self.options_window.geometry("300x860")
             self.options_window.transient(self)
             
             ctk.CTkLabel(self.options_window, text="線の幅 (即時反映)", font=ctk.CTkFont(family=self.font_family)).pack(fill="x", padx=15, pady=(10,0))
@@ -324,6 +450,21 @@ class AnnotationApp(ctk.CTk):
             ctk.CTkRadioButton(self.options_window, text="棒グラフ", variable=style_var, value="bar", font=ctk.CTkFont(family=self.font_family)).pack(anchor="w", padx=20)
             ctk.CTkRadioButton(self.options_window, text="円グラフ", variable=style_var, value="pie", font=ctk.CTkFont(family=self.font_family)).pack(anchor="w", padx=20)
 
+            profile_var = tkinter.BooleanVar(value=self.profiler.enabled)
+            ctk.CTkCheckBox(self.options_window, text="処理時間を計測 (p50/p95表示)", variable=profile_var, font=ctk.CTkFont(family=self.font_family)).pack(anchor="w", padx=15, pady=(10,0))
+            record_var = tkinter.BooleanVar(value=self.record_input_var.get())
+            ctk.CTkCheckBox(self.options_window, text="操作を記録 (input_replay.py で再生・計測)", variable=record_var, font=ctk.CTkFont(family=self.font_family)).pack(anchor="w", padx=15, pady=(10,0))
+
+            propagate_var = tkinter.BooleanVar(value=self.box_propagator.enabled)
+            ctk.CTkCheckBox(self.options_window, text="前の画像のボックスを追跡して引き継ぐ", variable=propagate_var, font=ctk.CTkFont(family=self.font_family)).pack(anchor="w", padx=15, pady=(10,0))
+            ctk.CTkLabel(self.options_window, text="引き継ぎ時の推論間隔 (枚)", font=ctk.CTkFont(family=self.font_family)).pack(fill="x", padx=15, pady=(5,0))
+            interval_entry = ctk.CTkEntry(self.options_window); interval_entry.insert(0, str(self.box_propagator.detect_interval)); interval_entry.pack(fill="x", padx=15, pady=5)
+
+            ctk.CTkLabel(self.options_window, text="推論モデル (読み込み済みなら即時切替)", font=ctk.CTkFont(family=self.font_family)).pack(fill="x", padx=15, pady=(10,0))
+            self.model_menu = ctk.CTkOptionMenu(self.options_window, values=["-"], command=self.events.select_model_by_label, font=ctk.CTkFont(family=self.font_family))
+            self.model_menu.pack(fill="x", padx=15, pady=5); self.update_model_menu()
+            ctk.CTkButton(self.options_window, text="モデルを追加...", command=self.events.add_model, font=ctk.CTkFont(family=self.font_family)).pack(fill="x", padx=15)
+
             def apply_changes():
                 self._update_log_view_height(lines_entry.get())
                 if (t_val := target_entry.get()).isdigit(): 
@@ -343,10 +484,55 @@ class AnnotationApp(ctk.CTk):
                     else: self.pie_canvas.pack(pady=5)
                     self.update_progress_display()
 
+                self.set_profiling(profile_var.get())
+                if record_var.get() != self.record_input_var.get():
+                    self.record_input_var.set(record_var.get())
+                    if record_var.get(): self.events.start_input_recording()
+                    else: self.events.stop_input_recording()
+
+                if (iv := interval_entry.get()).isdigit() and int(iv) > 0: self.box_propagator.detect_interval = int(iv)
+                if propagate_var.get() != self.box_propagator.enabled:
+                    self.box_propagator.enabled = propagate_var.get(); self.box_propagator.reset()
+                    self.log(f"ボックスの引き継ぎを{'有効' if self.box_propagator.enabled else '無効'}にしました (推論間隔: {self.box_propagator.detect_interval}枚)")
+
             ctk.CTkButton(self.options_window, text="設定を適用 (Apply)", command=apply_changes, font=ctk.CTkFont(family=self.font_family)).pack(pady=(20, 5))
+            ctk.CTkButton(self.options_window, text="計測結果を書き出し", command=self.export_profile, font=ctk.CTkFont(family=self.font_family)).pack(pady=5)
             ctk.CTkButton(self.options_window, text="閉じる (Close)", command=self.options_window.destroy, font=ctk.CTkFont(family=self.font_family), fg_color="gray").pack(pady=5)
         else: self.options_window.focus()
 
+    def set_profiling(self, enabled):
+        if enabled == self.profiler.enabled: return
+        self.profiler.enabled = enabled
+        if enabled: self.profiler.reset()
+        if hasattr(self, 'profiler_label'):
+            if enabled: self.profiler_label.pack(pady=(0, 5), padx=20, fill="x", side="bottom")
+            else: self.profiler_label.pack_forget()
+        self.log(f"処理時間の計測を{'開始' if enabled else '停止'}しました。")
+
+    def export_profile(self):
+        # セッションログと同じ場所に Chrome trace (JSON) と CSV サマリを保存
+        if not self.profiler.enabled: return
+        try:
+            paths = self.profiler.export_session(self.log_file_path)
+            if paths: self.log(f"計測結果を書き出しました: {paths[0]} / {paths[1]}")
+        except Exception as e:
+            self.log(f"計測結果の書き出しに失敗しました: {e}")
+
+    def open_analytics_window(self, report_text):
+        if self.analytics_window is None or not self.analytics_window.winfo_exists():
+            self.analytics_window = ctk.CTkToplevel(self)
+            self.analytics_window.title("データセット分析")
+            self.analytics_window.geometry("760x700")
+            self.analytics_window.transient(self)
+            self.analytics_textbox = ctk.CTkTextbox(self.analytics_window, font=ctk.CTkFont(family="Consolas", size=12), wrap="none")
+            self.analytics_textbox.pack(fill="both", expand=True, padx=10, pady=(10, 5))
+            ctk.CTkButton(self.analytics_window, text="再集計", command=self.events.show_dataset_analytics, font=ctk.CTkFont(family=self.font_family)).pack(side="left", padx=10, pady=(0, 10))
+            ctk.CTkButton(self.analytics_window, text="閉じる (Close)", command=self.analytics_window.destroy, font=ctk.CTkFont(family=self.font_family), fg_color="gray").pack(side="right", padx=10, pady=(0, 10))
+        self.analytics_textbox.configure(state="normal")
+        self.analytics_textbox.delete("1.0", "end"); self.analytics_textbox.insert("1.0", report_text)
+        self.analytics_textbox.configure(state="disabled")
+        self.analytics_window.focus()
+
     def _update_line_width(self, value): self.box_line_width = int(value); self.redraw_boxes()
     def _update_font_size(self, value): self.box_font_size = int(value); self.redraw_boxes()
     def _update_log_view_height(self, value):
@@ -372,10 +558,44 @@ class AnnotationApp(ctk.CTk):
         img_w, img_h = self.current_image.size
         scale = min(canvas_width / img_w, canvas_height / img_h) if img_w > 0 and img_h > 0 else 1
         self.resized_w, self.resized_h = int(img_w * scale), int(img_h * scale)
-        self.tk_image = ImageTk.PhotoImage(self.current_image.resize((self.resized_w, self.resized_h), Image.Resampling.LANCZOS))
-        self.canvas.image = self.tk_image
+        size = (self.resized_w, self.resized_h)
+        if self.refined is None or self.refined[0] is not self.current_image or self.refined[1] != size:
+            # 1パス目: reduce() で間引いた縮小版から BILINEAR で補間する (LANCZOS より一桁速い)
+            with self.profiler.span("resize"):
+                self.tk_image = ImageTk.PhotoImage(self.current_image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0))
+            self.canvas.image = self.tk_image
+            self._schedule_refine()
         self.redraw_boxes()
 
+    def _schedule_refine(self):
+        # 連続した切り替え・リサイズでは前の仕上げを取り消し、最後の表示だけを仕上げる
+        if self.refine_timer: self.after_cancel(self.refine_timer)
+        self.refine_job, self.refined = None, None
+        self.refine_timer = self.after(REFINE_DELAY_MS, self._start_refine, self.current_image, (self.resized_w, self.resized_h))
+
+    def _start_refine(self, image, size):
+        self.refine_timer = None
+        job = {"image": image, "size": size, "result": None, "done": False}
+        self.refine_job = job
+
+        def worker():
+            try: job["result"] = image.resize(size, Image.Resampling.LANCZOS)
+            except Exception as e: print(f"Refine error: {e}")
+            finally: job["done"] = True
+
+        threading.Thread(target=worker, name="RefineResize", daemon=True).start()
+        self.after(15, self._poll_refine, job)
+
+    def _poll_refine(self, job):
+        if job is not self.refine_job: return  # 別の画像・サイズへ移った
+        if not job["done"]: self.after(15, self._poll_refine, job); return
+        self.refine_job = None
+        if job["result"] is None or self.current_image is not job["image"] or (self.resized_w, self.resized_h) != job["size"]: return
+        # ボックスは描き直さず、画像アイテムだけを差し替える (ドラッグ中でも割り込まない)
+        self.tk_image = ImageTk.PhotoImage(job["result"]); self.canvas.image = self.tk_image
+        self.canvas.itemconfigure("image", image=self.tk_image)
+        self.refined = (job["image"], job["size"])
+
     def bind_shortcuts(self):
         self.bind("<Right>", lambda e: self.events.next_image() if self.mode != 'start' else None)
         self.bind("<Left>", lambda e: self.events.prev_image() if self.mode != 'start' else None)
@@ -385,6 +605,7 @@ class AnnotationApp(ctk.CTk):
         self.bind("<Escape>", self.reset_state)
         self.bind("<Delete>", self.events.delete_selected_box)
         self.bind("<Return>", self._on_enter_pressed)
+        for key in ("r", "R"): self.bind(key, lambda e: self.events.toggle_roi_mode() if not isinstance(e.widget, tkinter.Entry) else None)
         
         # クラス切り替えショートカット (0-9)
         for i in range(10):
@@ -394,8 +615,8 @@ class AnnotationApp(ctk.CTk):
         if self.mode not in ['annotation', 'correction'] or self.selected_box_id is None: return
         try:
             idx = int(event.keysym)
-            if idx < len(self.class_names):
-                self.events.change_class(self.selected_box_id, idx)
+            if idx < len(self.class_mru) and self.class_mru[idx] < len(self.class_names):
+                self.events.change_class(self.selected_box_id, self.class_mru[idx])
         except: pass
 
     def _on_enter_pressed(self, event=None):
@@ -405,7 +626,8 @@ class AnnotationApp(ctk.CTk):
         self.events.save_and_next()
 
     def reset_state(self, _=None):
-        if self.mouse_state == 'drawing' and self.temp_box_id: self.canvas.delete(self.temp_box_id)
+        if self.mouse_state in ('drawing', 'roi') and self.temp_box_id: self.canvas.delete(self.temp_box_id)
+        if self.roi_mode: self.events.toggle_roi_mode(False)
         self.mouse_state = 'idle'; self.selected_box_id = None; self.selected_handle = None
         self.start_x, self.start_y = None, None
         if self.mode != 'start': self.redraw_boxes()
@@ -416,11 +638,15 @@ class AnnotationApp(ctk.CTk):
         self.events.load_image_from_index()
 
     def display_image_and_boxes(self, image_path):
-        self.current_image = Image.open(image_path)
+        with self.profiler.span("decode"):
+            self.current_image = open_source_image(image_path, self.frame_cache)
+            self.current_image.load()
         self._update_canvas_image()
         self.update_info_labels()
         if hasattr(self, 'current_img_size_label'):
-            self.current_img_size_label.configure(text=f"現在の画像サイズ: {format_bytes(os.path.getsize(image_path))}")
+            frame = split_frame_key(image_path)
+            if frame: self.current_img_size_label.configure(text=f"動画フレーム: {os.path.basename(frame[0])} #{frame[1]}")
+            else: self.current_img_size_label.configure(text=f"現在の画像サイズ: {format_bytes(os.path.getsize(image_path))}")
 
     def add_box(self, dx1, dy1, dx2, dy2, class_id):
         self.record_history()
@@ -432,6 +658,10 @@ class AnnotationApp(ctk.CTk):
         self.redraw_boxes(); self.update_box_list_display()
 
     def redraw_boxes(self):
+        with self.profiler.span("redraw_boxes"):
+            self._redraw_boxes()
+
+    def _redraw_boxes(self):
         self.canvas.delete("all")
         
         # クロスヘアIDをリセット（キャンバスがクリアされたため）
@@ -443,7 +673,7 @@ class AnnotationApp(ctk.CTk):
             box['items'] = {}
 
         if not self.current_image: return
-        self.canvas.create_image(0, 0, anchor="nw", image=self.canvas.image)
+        self.canvas.create_image(0, 0, anchor="nw", image=self.canvas.image, tags="image")
         if self.resized_w == 0: return
         img_w, img_h = self.current_image.size
         sorted_boxes = sorted(self.boxes.items(), key=lambda item: (item[1]['coords'][1], item[1]['coords'][0]))
@@ -475,9 +705,9 @@ class AnnotationApp(ctk.CTk):
         # 2. Text Label
         if 'text' in items:
             self.canvas.coords(items['text'], dx1, dy1 - 5)
-            self.canvas.itemconfig(items['text'], text=self.class_names[box['class_id']], fill=color, font=(self.font_family, self.box_font_size, "bold"))
+            self.canvas.itemconfig(items['text'], text=self.class_label(box['class_id']), fill=color, font=(self.font_family, self.box_font_size, "bold"))
         else:
-            items['text'] = self.canvas.create_text(dx1, dy1 - 5, text=self.class_names[box['class_id']], anchor="sw", fill=color, font=(self.font_family, self.box_font_size, "bold"))
+            items['text'] = self.canvas.create_text(dx1, dy1 - 5, text=self.class_label(box['class_id']), anchor="sw", fill=color, font=(self.font_family, self.box_font_size, "bold"))
 
         # 3. Index Label (Background & Text)
         if index is not None:
@@ -599,6 +829,9 @@ class AnnotationApp(ctk.CTk):
         img_w, img_h = self.current_image.size; items = self.boxes[self.selected_box_id]['items']
         if 'box' not in items or not self.canvas.find_withtag(items['box']): return
         dx1, dy1, dx2, dy2 = self.canvas.coords(items['box'])
+        # 表示上の位置が変わっていなければ (クリックしただけ) 元の座標を保つ。表示倍率での往復で値がずれないように
+        x1, y1, x2, y2 = self.boxes[self.selected_box_id]['coords']
+        if [min(dx1,dx2), min(dy1,dy2), max(dx1,dx2), max(dy1,dy2)] == [round(x1*self.resized_w/img_w), round(y1*self.resized_h/img_h), round(x2*self.resized_w/img_w), round(y2*self.resized_h/img_h)]: return
         ox1=int(round(min(dx1,dx2)*img_w/self.resized_w)); oy1=int(round(min(dy1,dy2)*img_h/self.resized_h))
         ox2=int(round(max(dx1,dx2)*img_w/self.resized_w)); oy2=int(round(max(dy1,dy2)*img_h/self.resized_h))
         self.boxes[self.selected_box_id]['coords'] = [ox1, oy1, ox2, oy2]
@@ -627,7 +860,7 @@ class AnnotationApp(ctk.CTk):
     
     def update_progress_display(self, _=None):
         if not self.image_dir: return
-        annotated_count=sum(1 for f in self.image_files if os.path.exists(os.path.join(self.labels_dir, f"{os.path.splitext(f)[0]}.txt")))
+        annotated_count=sum(1 for f in self.image_files if os.path.splitext(f)[0] in self.label_sizes)
         if self.session_start_count is None: self.session_start_count = annotated_count
         self.annotated_count_cache = annotated_count
         
@@ -715,6 +948,10 @@ class AnnotationApp(ctk.CTk):
         self.pie_canvas.create_text(70, 130, text=f"{ratio * 100:.2f}%", fill="black", font=("Arial", 14, "bold"))
 
     def update_box_list_display(self):
+        with self.profiler.span("box_list"):
+            self._update_box_list_display()
+
+    def _update_box_list_display(self):
         if not hasattr(self, 'box_list_frame') or not self.box_list_frame.winfo_exists(): return
         for widget in self.box_list_frame.winfo_children(): widget.destroy()
         if not self.boxes or not self.class_names: return
@@ -722,7 +959,7 @@ class AnnotationApp(ctk.CTk):
         for i, (box_id, box) in enumerate(sorted_boxes):
             coords, class_id = box['coords'], box['class_id']
             w, h = coords[2] - coords[0], coords[3] - coords[1]
-            text = f"{i+1}: {self.class_names[class_id]} ({w}x{h})"
+            text = f"{i+1}: {self.class_label(class_id)} ({w}x{h})"
             
             is_selected = (box_id == self.selected_box_id)
             
@@ -760,68 +997,36 @@ class AnnotationApp(ctk.CTk):
     def ask_class(self):
         if not self.class_names: return None
         self.is_dialog_active = True
-        result = {'class_id': None}
-
         try:
-            dialog = ctk.CTkToplevel(self)
-            dialog.title("クラス選択")
-            dialog.attributes("-topmost", True)
-            
-            mx, my = self.winfo_pointerx(), self.winfo_pointery()
-            w, h = 200, 300
-            s_w, s_h = self.winfo_screenwidth(), self.winfo_screenheight()
-            x_pos = s_w - w - 10 if mx + w + 10 > s_w else mx + 10
-            y_pos = s_h - h - 10 if my + h + 10 > s_h else my + 10
-            dialog.geometry(f"{w}x{h}+{x_pos}+{y_pos}")
-            
-            val = tkinter.IntVar(value=0)
-            
-            scroll_frame = ctk.CTkScrollableFrame(dialog); scroll_frame.pack(fill="both", expand=True, padx=5, pady=5)
-            radios = []
-            for i, name in enumerate(self.class_names):
-                r = ctk.CTkRadioButton(scroll_frame, text=f"{i}: {name}", variable=val, value=i, font=ctk.CTkFont(family=self.font_family))
-                r.pack(anchor="w", padx=5, pady=2); radios.append(r)
-            
-            def confirm(_=None):
-                result['class_id'] = val.get()
-                self.ignore_input_until = time.time() + 0.5 
-                self.cleanup_bindings()
-                dialog.destroy()
-            
-            def on_close():
-                self.cleanup_bindings()
-                dialog.destroy()
-            
-            def on_scroll(event):
-                if event.delta:
-                    current = val.get()
-                    if event.delta > 0: new_val = max(0, current - 1)
-                    else: new_val = min(len(self.class_names) - 1, current + 1)
-                    val.set(new_val)
-            
-            self.bind_all("<MouseWheel>", on_scroll)
-            self.bind_all("<Button-2>", confirm)
-            self.bind_all("<Return>", confirm)
-            
-            def cleanup_bindings_func():
-                self.unbind_all("<MouseWheel>")
-                self.unbind_all("<Button-2>")
-                self.unbind_all("<Return>")
-                self.bind("<Return>", self._on_enter_pressed)
-            
-            self.cleanup_bindings = cleanup_bindings_func
-            
-            ctk.CTkButton(dialog, text="決定 (Enter/Click)", command=confirm, font=ctk.CTkFont(family=self.font_family)).pack(fill="x", padx=5, pady=5)
-            
-            dialog.focus_force()
-            dialog.protocol("WM_DELETE_WINDOW", on_close)
-            
-            self.wait_window(dialog)
-            return result['class_id']
-            
+            if self.class_picker is None or not self.class_picker.winfo_exists(): self.build_class_picker()
+            class_id = self.class_picker.ask()
+            if class_id is not None: self.ignore_input_until = time.time() + 0.5
+            return class_id
         finally:
             self.is_dialog_active = False
 
+    def build_class_picker(self):
+        # プロジェクト (classes.yaml) ごとに1回だけ作る
+        if self.class_picker is not None and self.class_picker.winfo_exists(): self.class_picker.destroy()
+        self.class_picker = ClassPicker(self, self.class_names, self.class_mru) if self.class_names else None
+
+    @property
+    def model(self):
+        return self.model_pool.get()
+
+    def model_paths(self):
+        paths = [self.base_model_path] + (self.model_registry.models if self.model_registry else [])
+        return list(dict.fromkeys(paths))
+
+    def update_model_menu(self):
+        if self.model_menu is None or not self.model_menu.winfo_exists(): return
+        self.model_menu.configure(values=[model_label(p) for p in self.model_paths()])
+        self.model_menu.set(model_label(self.model_pool.active) if self.model_pool.active else "-")
+
+    def class_label(self, class_id):
+        # classes.yaml に無いIDのラベルも開けるようにする (データ検証の修正キュー)
+        return self.class_names[class_id] if 0 <= class_id < len(self.class_names) else f"(未定義 {class_id})"
+
     def get_color_for_class(self, class_id):
         colors = ["#FF3838", "#00C2FF", "#FF9D97", "#FF701F", "#FFB21D", "#CFD231", "#48F90A", "#92CC17", "#3DDB86", "#1A9334", "#00D4BB",
                   "#2C99A8", "#344593", "#6473FF", "#0018EC", "#8438FF", "#520085", "#CB38FF", "#FF95C8", "#FF37C7"]
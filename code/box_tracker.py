@@ -0,0 +1,78 @@
+# box_tracker.py
+import cv2
+import numpy as np
+
+def iou(a, b):
+    ix1, iy1, ix2, iy2 = max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+class BoxPropagator:
+    # 確定済み (保存した) ボックスを次のフレームへ引き継ぐ簡易トラッカー
+    # 各ボックスを前フレームから切り出したテンプレートとして、周辺領域で正規化相互相関により位置を合わせる
+    # 一定フレームごと、または追跡スコアが下がったときだけ検出器を実行し、IoU で対応付けて補正する
+    def __init__(self, detect_interval=10, min_score=0.6, iou_threshold=0.4, max_side=640):
+        self.enabled = False
+        self.detect_interval, self.min_score, self.iou_threshold, self.max_side = detect_interval, min_score, iou_threshold, max_side
+        self.last = None  # (画像キー, PIL画像, [(coords, class_id), ...])
+        self.frames_since_detection = 0
+
+    def remember(self, key, image, boxes):
+        self.last = (key, image, [(list(coords), class_id) for coords, class_id in boxes])
+
+    def reset(self):
+        self.last = None; self.frames_since_detection = 0
+
+    def _gray(self, image):
+        # 長辺を max_side に縮小したグレースケール (追跡は縮小画像で行い、座標は元の解像度に戻す)
+        scale = min(1.0, self.max_side / max(image.size))
+        gray = image.convert('L')
+        if scale < 1.0: gray = gray.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))))
+        return np.asarray(gray), scale
+
+    def _track_one(self, prev, cur, coords, scale):
+        h, w = cur.shape
+        x1, y1, x2, y2 = (int(round(v * scale)) for v in coords)
+        x1, y1, x2, y2 = max(0, x1), max(0, y1), min(prev.shape[1], x2), min(prev.shape[0], y2)
+        if x2 - x1 < 4 or y2 - y1 < 4: return None, 0.0
+        template = prev[y1:y2, x1:x2]
+        # 探索範囲はボックスサイズの半分 (最低16px) だけ広げた領域
+        mx, my = max(16, (x2 - x1) // 2), max(16, (y2 - y1) // 2)
+        sx1, sy1, sx2, sy2 = max(0, x1 - mx), max(0, y1 - my), min(w, x2 + mx), min(h, y2 + my)
+        region = cur[sy1:sy2, sx1:sx2]
+        if region.shape[0] < template.shape[0] or region.shape[1] < template.shape[1]: return None, 0.0
+        result = cv2.matchTemplate(region, template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (lx, ly) = cv2.minMaxLoc(result)
+        dx, dy = (sx1 + lx - x1) / scale, (sy1 + ly - y1) / scale
+        return [int(round(coords[0] + dx)), int(round(coords[1] + dy)), int(round(coords[2] + dx)), int(round(coords[3] + dy))], float(score)
+
+    def track(self, image):
+        # 返り値: ([(coords, class_id, score), ...], 検出器を実行すべきか)
+        _, prev_image, prev_boxes = self.last
+        prev, scale = self._gray(prev_image)
+        cur, _ = self._gray(image)
+        if prev.shape != cur.shape: return [], True  # 解像度が違う = 連続したフレームではない
+        tracked = []
+        for coords, class_id in prev_boxes:
+            new_coords, score = self._track_one(prev, cur, coords, scale)
+            if new_coords is not None: tracked.append((new_coords, class_id, score))
+        self.frames_since_detection += 1
+        low_confidence = len(tracked) < len(prev_boxes) or any(score < self.min_score for _, _, score in tracked)
+        return tracked, low_confidence or self.frames_since_detection >= self.detect_interval
+
+    def merge(self, tracked, detections):
+        # 追跡ボックスと検出結果を IoU で貪欲に対応付ける
+        # 対応したものは検出の座標 + 追跡側のクラス (作業者が確定したクラス) を採用し、
+        # 対応しない検出は新しい物体として追加、対応しない追跡ボックスはスコアが高いものだけ残す
+        self.frames_since_detection = 0
+        pairs = sorted(((iou(t[0], d[0]), ti, di) for ti, t in enumerate(tracked) for di, d in enumerate(detections)), reverse=True)
+        used_t, used_d, boxes = set(), set(), []
+        for overlap, ti, di in pairs:
+            if overlap < self.iou_threshold: break
+            if ti in used_t or di in used_d: continue
+            used_t.add(ti); used_d.add(di)
+            boxes.append((detections[di][0], tracked[ti][1]))
+        boxes += [(coords, class_id) for ti, (coords, class_id, score) in enumerate(tracked) if ti not in used_t and score >= self.min_score]
+        boxes += [d for di, d in enumerate(detections) if di not in used_d]
+        return boxes
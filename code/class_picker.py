@@ -0,0 +1,105 @@
+# class_picker.py
+import tkinter
+import customtkinter as ctk
+
+MRU_SIZE = 10  # 数字キー 0-9 に割り当てる件数
+
+def touch_mru(mru, class_id, size=MRU_SIZE):
+    # 使ったクラスを先頭へ移動する (最近使った順)
+    if class_id in mru: mru.remove(class_id)
+    mru.insert(0, class_id)
+    del mru[size:]
+
+class ClassPicker(ctk.CTkToplevel):
+    # プロジェクトごとに1回だけ作り、以降は表示/非表示を切り替えて使い回すクラス選択ダイアログ
+    # 一覧は tkinter.Listbox (見えている行だけを描画する) で、数千クラスでも1ウィジェットで済む
+    def __init__(self, app, class_names, mru):
+        super().__init__(app)
+        self.app, self.class_names, self.mru = app, class_names, mru
+        # 絞り込み用の索引: (小文字の名前, クラスID)
+        self.index = [(name.lower(), i) for i, name in enumerate(class_names)]
+        self.visible_ids, self.result = [], None
+        self.done = tkinter.BooleanVar(value=False)
+
+        self.title("クラス選択")
+        self.attributes("-topmost", True)
+        self.transient(app)
+        font = ctk.CTkFont(family=app.font_family)
+        self.query_var = tkinter.StringVar()
+        self.entry = ctk.CTkEntry(self, textvariable=self.query_var, placeholder_text="クラス名で絞り込み", font=font)
+        self.entry.pack(fill="x", padx=5, pady=(5, 0))
+        list_frame = ctk.CTkFrame(self, fg_color="transparent"); list_frame.pack(fill="both", expand=True, padx=5, pady=5)
+        self.listbox = tkinter.Listbox(list_frame, activestyle="none", exportselection=False, font=(app.font_family, 11), bg="#2B2B2B", fg="white", selectbackground="#1F6AA5", highlightthickness=0, borderwidth=0)
+        scrollbar = ctk.CTkScrollbar(list_frame, command=self.listbox.yview); self.listbox.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side="right", fill="y"); self.listbox.pack(side="left", fill="both", expand=True)
+        ctk.CTkLabel(self, text="数字キー: 最近使ったクラス  Esc: 取消", text_color="gray", font=font).pack()
+        ctk.CTkButton(self, text="決定 (Enter/Click)", command=self.confirm, font=font).pack(fill="x", padx=5, pady=5)
+
+        self.query_var.trace_add("write", lambda *_: self.refresh())
+        self.entry.bind("<Up>", lambda e: self.move(-1)); self.entry.bind("<Down>", lambda e: self.move(1))
+        self.entry.bind("<KeyPress>", self.on_key)
+        self.bind("<Return>", self.confirm); self.bind("<Escape>", self.cancel)
+        self.bind("<MouseWheel>", lambda e: self.move(-1 if e.delta > 0 else 1))
+        self.bind("<Button-2>", self.confirm)
+        self.listbox.bind("<Double-Button-1>", self.confirm)
+        self.protocol("WM_DELETE_WINDOW", self.cancel)
+        self.withdraw()
+
+    def refresh(self):
+        # 空欄なら最近使ったクラス → 残りをID順。入力があれば前方一致 → 部分一致の順 (数字ならクラスIDにも一致)
+        query = self.query_var.get().strip().lower()
+        if not query:
+            recent = [i for i in self.mru if i < len(self.class_names)]; recent_set = set(recent)
+            ids = recent + [i for i in range(len(self.class_names)) if i not in recent_set]
+        else:
+            prefix = [i for name, i in self.index if name.startswith(query)]
+            ids = prefix + [i for name, i in self.index if query in name and not name.startswith(query)]
+            if query.isdigit() and int(query) < len(self.class_names) and int(query) not in ids: ids.insert(0, int(query))
+        self.visible_ids = ids
+        slots = {class_id: n for n, class_id in enumerate(self.mru)} if not query else {}
+        self.listbox.delete(0, "end")
+        self.listbox.insert("end", *[f"[{slots[i]}] {i}: {self.class_names[i]}" if i in slots else f"    {i}: {self.class_names[i]}" for i in ids])
+        if ids: self.select(0)
+
+    def select(self, row):
+        self.listbox.selection_clear(0, "end"); self.listbox.selection_set(row); self.listbox.see(row)
+
+    def move(self, step):
+        if not self.visible_ids: return "break"
+        current = self.listbox.curselection()
+        self.select(min(len(self.visible_ids) - 1, max(0, (current[0] if current else 0) + step)))
+        return "break"
+
+    def on_key(self, event):
+        # 絞り込みが空のときの数字キーは、最近使ったクラスの番号として扱う
+        if event.char.isdigit() and len(event.char) == 1 and not self.query_var.get():
+            slot = int(event.char)
+            if slot < len(self.mru): self.finish(self.mru[slot])
+            return "break"
+
+    def confirm(self, _=None):
+        current = self.listbox.curselection()
+        if current: self.finish(self.visible_ids[current[0]])
+        return "break"
+
+    def cancel(self, _=None):
+        self.finish(None)
+
+    def finish(self, class_id):
+        self.result = class_id
+        self.withdraw(); self.done.set(True)
+
+    def ask(self):
+        # マウス位置の近くに表示し、選択されるまで待つ (ウィンドウは破棄しない)
+        mx, my = self.app.winfo_pointerx(), self.app.winfo_pointery()
+        w, h = 260, 380
+        s_w, s_h = self.app.winfo_screenwidth(), self.app.winfo_screenheight()
+        x_pos = s_w - w - 10 if mx + w + 10 > s_w else mx + 10
+        y_pos = s_h - h - 10 if my + h + 10 > s_h else my + 10
+        self.geometry(f"{w}x{h}+{x_pos}+{y_pos}")
+        self.result = None; self.done.set(False)
+        self.query_var.set("")  # trace 経由で一覧を作り直す
+        self.deiconify(); self.lift(); self.entry.focus_force()
+        self.app.wait_variable(self.done)
+        if self.result is not None: touch_mru(self.mru, self.result)
+        return self.result
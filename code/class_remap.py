@@ -0,0 +1,202 @@
+# class_remap.py
+# クラスの統合・削除・番号の振り直しをラベル全体にまとめて適用する
+#   python class_remap.py <プロジェクトフォルダ> "truck -> car" "kite -> -" [--labels-dir DIR] [--apply]
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import yaml
+from utils import load_class_names
+from folder_scanner import iter_tree
+from io_executor import write_text_atomic
+from label_store import SqliteLabelStore, write_label_text
+
+def _class_id(token, class_names):
+    if token in class_names: return class_names.index(token)
+    if token.isdigit() and int(token) < len(class_names): return int(token)
+    return None
+
+def parse_mapping(lines, class_names):
+    # 1行1ルール: "truck -> car" (統合・改名) / "kite -> -" (削除)。左辺は既存クラスの名前かID、右辺は既存または新しいクラス名
+    # 返り値: {旧クラスID: 新クラス名 or None (削除)}
+    mapping = {}
+    for n, line in enumerate(lines, 1):
+        line = line.split('#', 1)[0].strip()
+        if not line: continue
+        if '->' not in line: raise ValueError(f"{n}行目: 「変更前 -> 変更後」の形式で指定してください: {line}")
+        src, dst = (part.strip() for part in line.split('->', 1))
+        src_id = _class_id(src, class_names)
+        if src_id is None: raise ValueError(f"{n}行目: クラス '{src}' は classes.yaml にありません")
+        dst_id = _class_id(dst, class_names)
+        mapping[src_id] = None if dst in ('', '-') else class_names[dst_id] if dst_id is not None else dst
+    return mapping
+
+def build_id_map(class_names, mapping):
+    # 削除・統合で空いた番号は詰めて振り直す (残るクラスの順序は変えない)
+    # 返り値: (新しいクラス名リスト, id_map)。id_map[旧ID] = 新ID、削除は -1
+    new_names, id_map = [], []
+    for i, name in enumerate(class_names):
+        target = mapping.get(i, name)
+        if target is None: id_map.append(-1); continue
+        if target not in new_names: new_names.append(target)
+        id_map.append(new_names.index(target))
+    return new_names, id_map
+
+def remap_text(text, id_map):
+    # クラスIDが変わる行だけを書き換え、座標の文字列はそのまま残す
+    # 返り値: (新しいテキスト, 変更前のクラス別個数, 変更後のクラス別個数)
+    before, after, lines, changed = Counter(), Counter(), [], False
+    for line in text.splitlines():
+        parts = line.split(None, 1)
+        try: old = int(float(parts[0]))
+        except (IndexError, ValueError):
+            lines.append(line); continue
+        new = id_map[old] if 0 <= old < len(id_map) else old
+        before[old] += 1
+        if new == old: lines.append(line); after[new] += 1; continue
+        changed = True
+        if new < 0: continue
+        after[new] += 1
+        lines.append(f"{new} {parts[1]}" if len(parts) > 1 else str(new))
+    if not changed: return text, before, after
+    return "".join(line + "\n" for line in lines), before, after
+
+def _remap_chunk(paths, id_map, dry_run):
+    before, after, changed, errors = Counter(), Counter(), [], []
+    for path in paths:
+        try:
+            with open(path, 'r') as f: text = f.read()
+            new_text, b, a = remap_text(text, id_map)
+            before.update(b); after.update(a)
+            if new_text == text: continue
+            changed.append((path, len(new_text.encode()) if dry_run else write_label_text(path, new_text)))
+        except (OSError, UnicodeDecodeError) as e:
+            errors.append(f"{path}: {e}")
+    return before, after, changed, errors
+
+def remap_label_dir(labels_dir, id_map, recursive=True, dry_run=True, workers=8, chunk_size=512, progress=None):
+    # txt を chunk_size 件ずつスレッドに割り振り、変更のあるファイルだけを一時ファイル経由で置き換える
+    paths = []
+    for rel, files in iter_tree(labels_dir, recursive) if os.path.isdir(labels_dir) else ():
+        paths.extend(e.path for e in files if e.name.endswith(".txt"))
+    report = {"files": len(paths), "before": Counter(), "after": Counter(), "changed": [], "errors": []}
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for chunk, (before, after, changed, errors) in zip(chunks, pool.map(lambda c: _remap_chunk(c, id_map, dry_run), chunks)):
+            report["before"].update(before); report["after"].update(after)
+            report["changed"].extend(changed); report["errors"].extend(errors)
+            done += len(chunk)
+            if progress: progress(done, len(paths))
+    return report
+
+def project_label_dirs(project_dir, labels_dir=None):
+    # プロジェクトで使ったラベルフォルダ (セッション・スキャンキャッシュに記録されたもの) と現在のフォルダ
+    dirs = [os.path.abspath(labels_dir)] if labels_dir else []
+    for path in glob.glob(os.path.join(project_dir, ".*_session.json")) + glob.glob(os.path.join(project_dir, ".*_scan_cache.json")):
+        try:
+            with open(path, 'r', encoding='utf-8') as f: recorded = json.load(f).get("labels_dir")
+        except (OSError, ValueError):
+            continue
+        if recorded and os.path.isdir(recorded) and os.path.abspath(recorded) not in dirs: dirs.append(os.path.abspath(recorded))
+    return dirs
+
+def remap_boxes(boxes, id_map):
+    # セッションに保存された編集中のボックス {id: {'coords', 'class_id', ...}} を付け替える
+    remapped = {}
+    for box_id, box in boxes.items():
+        old = box['class_id']; new = id_map[old] if 0 <= old < len(id_map) else old
+        if new >= 0: remapped[box_id] = dict(box, class_id=new)
+    return remapped
+
+def write_class_names(project_dir, names):
+    # 元の classes.yaml はタイムスタンプ付きで残し、names (と nc) だけを書き換える
+    path = os.path.join(project_dir, "classes.yaml")
+    with open(path, 'r', encoding='utf-8') as f: data = yaml.safe_load(f) or {}
+    shutil.copy2(path, f"{path}.{time.strftime('%Y%m%d_%H%M%S')}.bak")
+    data['names'] = {i: name for i, name in enumerate(names)} if isinstance(data.get('names'), dict) else list(names)
+    if 'nc' in data: data['nc'] = len(names)
+    write_text_atomic(path, yaml.safe_dump(data, allow_unicode=True, sort_keys=False))
+
+def remap_project(project_dir, lines, labels_dirs, recursive=True, dry_run=True, workers=8, progress=None, partial=False):
+    # 返り値: レポート (dict)。dry_run=False のときは txt・SQLite・セッション・classes.yaml を同じマッピングで更新する
+    # partial: labels_dirs がプロジェクトの一部だけのとき。classes.yaml はプロジェクト共通なので、番号が変わる変更は受け付けない
+    class_names = load_class_names(project_dir)
+    if class_names is None: raise ValueError("classes.yaml を読み込めません")
+    new_names, id_map = build_id_map(class_names, parse_mapping(lines, class_names))
+    if partial and any(new != old for old, new in enumerate(id_map)):
+        raise ValueError("削除・統合はクラス番号が変わるため、プロジェクト全体に対して実行してください (一部のフォルダだけ書き換えると、他のフォルダのラベルの意味が変わります)")
+    report = {"class_names": class_names, "new_names": new_names, "id_map": id_map, "dry_run": dry_run,
+              "files": 0, "before": Counter(), "after": Counter(), "changed": [], "errors": [], "databases": []}
+    start = time.perf_counter()
+    for labels_dir in labels_dirs:
+        part = remap_label_dir(labels_dir, id_map, recursive, dry_run, workers, progress=progress)
+        report["files"] += part["files"]
+        for key in ("before", "after"): report[key].update(part[key])
+        report["changed"] += part["changed"]; report["errors"] += part["errors"]
+    for db_path in sorted(glob.glob(os.path.join(project_dir, ".*_labels.sqlite"))):
+        store = SqliteLabelStore(db_path, "")
+        try:
+            counts = store.class_counts()
+            updated = len({stem for stem, class_id in store.conn.execute("SELECT stem, class_id FROM boxes") if 0 <= class_id < len(id_map) and id_map[class_id] != class_id}) if dry_run else store.remap_classes(id_map)
+            report["databases"].append((os.path.basename(db_path), sum(counts.values()), updated))
+        finally:
+            store.close()
+    if not dry_run:
+        for session_path in glob.glob(os.path.join(project_dir, ".*_session.json")):
+            try:
+                with open(session_path, 'r') as f: data = json.load(f)
+                data["boxes"] = remap_boxes(data.get("boxes", {}), id_map)
+                # 取り消し履歴は古いクラス番号のままなので破棄する
+                data["undo_stack"], data["redo_stack"] = [], []
+                write_text_atomic(session_path, json.dumps(data, indent=2))
+            except (OSError, ValueError, KeyError) as e:
+                report["errors"].append(f"{session_path}: {e}")
+        if new_names != class_names: write_class_names(project_dir, new_names)
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+def format_report(report):
+    class_names, new_names, id_map = report["class_names"], report["new_names"], report["id_map"]
+    before, after = report["before"], report["after"]
+    state = "ドライラン (まだ書き換えていません)" if report["dry_run"] else "適用しました"
+    lines = [f"{state}: ラベル {report['files']}件中 {len(report['changed'])}件が対象 ({report['seconds']:.1f}秒)", "", "--- 変更内容 ---"]
+    for old, name in enumerate(class_names):
+        new = id_map[old]
+        if new == old and new_names[new] == name: continue
+        target = f"{new}: {new_names[new]}" if new >= 0 else "(削除)"
+        lines.append(f"{old}: {name} -> {target}  ({before[old]}個)")
+    # 変更後のクラスごとに、同じ名前の変更前クラスと個数を比べる
+    lines += ["", "--- クラス別の個数 ---", f"{'クラス':<28}{'変更前':>9}{'変更後':>9}{'差分':>9}"]
+    for new, name in enumerate(new_names):
+        prev = before[class_names.index(name)] if name in class_names else 0
+        lines.append(f"{f'{new}: {name}':<28}{prev:>9}{after[new]:>9}{after[new] - prev:>+9}")
+    for old, name in enumerate(class_names):
+        if id_map[old] < 0: lines.append(f"{f'-: {name}':<28}{before[old]:>9}{0:>9}{-before[old]:>+9}")
+    unknown = sum(count for class_id, count in before.items() if not 0 <= class_id < len(class_names))
+    if unknown: lines.append(f"classes.yaml に無いクラスID: {unknown}個 (そのまま残します)")
+    if new_names != class_names: lines += ["", f"classes.yaml: {len(class_names)}クラス -> {len(new_names)}クラス"]
+    for name, boxes, stems in report["databases"]: lines.append(f"SQLite {name}: ボックス {boxes}個 / 対象 {stems}件")
+    if report["errors"]: lines += ["", f"読み書きに失敗: {len(report['errors'])}件"] + report["errors"][:20]
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="クラスの一括変更 (統合・削除・番号の振り直し)")
+    parser.add_argument("project_dir"); parser.add_argument("rules", nargs="+", help='"変更前 -> 変更後" (削除は "クラス -> -")')
+    parser.add_argument("--labels-dir", action="append", help="対象のラベルフォルダ (省略時はプロジェクトに記録されたフォルダすべて)")
+    parser.add_argument("--apply", action="store_true", help="実際に書き換える (省略時はドライラン)")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+    labels_dirs = args.labels_dir or project_label_dirs(args.project_dir)
+    try: report = remap_project(args.project_dir, args.rules, labels_dirs, dry_run=not args.apply, workers=args.workers, partial=bool(args.labels_dir))
+    except ValueError as e: print(f"エラー: {e}"); return 1
+    print(format_report(report))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
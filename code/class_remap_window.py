@@ -0,0 +1,78 @@
+# class_remap_window.py
+import threading
+import tkinter.messagebox as msgbox
+import customtkinter as ctk
+from class_remap import remap_project, project_label_dirs, format_report
+
+class ClassRemapWindow(ctk.CTkToplevel):
+    # クラスの一括変更。まずドライランで件数を確認し、同じルールのときだけ適用できる
+    def __init__(self, app):
+        super().__init__(app)
+        self.app, self.job, self.checked_rules = app, None, None
+        self.title("クラスの一括変更")
+        self.geometry("720x680")
+        self.transient(app)
+        font = ctk.CTkFont(family=app.font_family)
+
+        ctk.CTkLabel(self, text="1行に1つ「変更前 -> 変更後」(例: truck -> car)。削除は「kite -> -」。\n削除・統合で空いた番号は詰めて classes.yaml を書き直します。", justify="left", font=font).pack(anchor="w", padx=10, pady=(10, 5))
+        self.rules_box = ctk.CTkTextbox(self, height=120, font=ctk.CTkFont(family="Consolas", size=12)); self.rules_box.pack(fill="x", padx=10)
+        self.scope_var = ctk.StringVar(value="project")
+        scope = ctk.CTkFrame(self, fg_color="transparent"); scope.pack(fill="x", padx=10, pady=5)
+        ctk.CTkRadioButton(scope, text="現在のラベルフォルダ (改名のみ)", variable=self.scope_var, value="folder", font=font).pack(side="left", padx=(0, 10))
+        ctk.CTkRadioButton(scope, text="プロジェクト全体 (記録されたラベルフォルダとSQLiteすべて)", variable=self.scope_var, value="project", font=font).pack(side="left")
+
+        bar = ctk.CTkFrame(self, fg_color="transparent"); bar.pack(fill="x", padx=10, pady=5)
+        self.dry_run_button = ctk.CTkButton(bar, text="ドライラン", width=120, command=lambda: self.run(dry_run=True), font=font); self.dry_run_button.pack(side="left")
+        self.apply_button = ctk.CTkButton(bar, text="適用", width=120, state="disabled", fg_color="#E04040", hover_color="#B03030", command=lambda: self.run(dry_run=False), font=font); self.apply_button.pack(side="left", padx=5)
+        self.progress_label = ctk.CTkLabel(bar, text="", font=font); self.progress_label.pack(side="left", padx=10)
+        ctk.CTkButton(bar, text="閉じる", width=80, fg_color="gray", command=self.destroy, font=font).pack(side="right")
+        self.report_box = ctk.CTkTextbox(self, font=ctk.CTkFont(family="Consolas", size=12), wrap="none", state="disabled"); self.report_box.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+        self.focus()
+
+    def rules(self):
+        return (self.scope_var.get(), self.rules_box.get("1.0", "end").strip())
+
+    def run(self, dry_run):
+        if self.job is not None: return
+        scope, text = self.rules()
+        if not text: return
+        if not dry_run:
+            if self.checked_rules != (scope, text): msgbox.showinfo("案内", "ルールか対象が変わりました。先にドライランで確認してください。", parent=self); return
+            if not msgbox.askyesno("確認", "ラベルファイルと classes.yaml を書き換えます。よろしいですか？", parent=self): return
+            self.app.flush_io()  # 書き込み待ちのラベルを先にファイルへ反映する
+        app = self.app
+        labels_dirs = project_label_dirs(app.project_dir, app.labels_dir) if scope == "project" else [app.labels_dir]
+        recursive = True if scope == "project" else app.recursive
+        job = {"result": None, "progress": (0, 0)}
+
+        def worker():
+            try: job["result"] = remap_project(app.project_dir, text.splitlines(), labels_dirs, recursive, dry_run, progress=lambda done, total: job.__setitem__("progress", (done, total)), partial=scope != "project")
+            except Exception as e: job["result"] = e
+
+        self.job = job
+        self.dry_run_button.configure(state="disabled"); self.apply_button.configure(state="disabled")
+        threading.Thread(target=worker, name="ClassRemap", daemon=True).start()
+        self.app.after(100, self.poll, job, scope, text)
+
+    def poll(self, job, scope, text):
+        # 適用中にウィンドウを閉じても、結果はアプリ側へ反映する
+        alive = self.winfo_exists()
+        if job["result"] is None:
+            done, total = job["progress"]
+            if alive: self.progress_label.configure(text=f"処理中... {done}/{total}" if total else "処理中...")
+            self.app.after(100, self.poll, job, scope, text); return
+        report = job["result"]
+        if not isinstance(report, Exception) and not report["dry_run"]: self.app.events.apply_class_remap(report)
+        if not alive: return
+        self.job = None; self.progress_label.configure(text="")
+        self.dry_run_button.configure(state="normal")
+        if isinstance(report, Exception):
+            self.show(f"エラー: {report}"); return
+        self.show(format_report(report))
+        self.checked_rules = (scope, text) if report["dry_run"] else None
+        if report["dry_run"]: self.apply_button.configure(state="normal")
+
+    def show(self, text):
+        self.report_box.configure(state="normal")
+        self.report_box.delete("1.0", "end"); self.report_box.insert("1.0", text)
+        self.report_box.configure(state="disabled")
@@ -0,0 +1,149 @@
+# coco_export.py
+# 承認済み (または指定したステータス) の画像とラベルを COCO JSON に書き出す
+# images / annotations はメモリに溜めずに1件ずつファイルへ書き、annotations は一時ファイルを経由して連結する
+#   python coco_export.py <プロジェクトフォルダ> <画像フォルダ> <出力.json> [--status approved] [--all-annotated] [--recursive]
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from utils import load_class_names, IMAGE_EXTENSIONS, VIDEO_EXTENSIONS
+from folder_scanner import iter_tree
+from project_shards import ShardedApprovalStatus
+
+SIZE_INDEX_VERSION = 1
+
+class ImageSizeIndex:
+    # 画像の幅・高さの索引。mtime とファイルサイズが変わらない限りヘッダーも読み直さない
+    # 動画フレームは動画ファイル単位で1回だけ調べる
+    def __init__(self, path):
+        self.path, self.entries, self.lock, self.dirty = path, {}, threading.Lock(), False
+        try:
+            with open(path, 'r', encoding='utf-8') as f: data = json.load(f)
+            if data.get("version") == SIZE_INDEX_VERSION: self.entries = data.get("entries", {})
+        except (OSError, ValueError):
+            pass
+
+    def _lookup(self, rel, full_path, probe):
+        st = os.stat(full_path)
+        with self.lock: entry = self.entries.get(rel)
+        if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size: return entry[2], entry[3]
+        w, h = probe(full_path)
+        with self.lock: self.entries[rel] = [st.st_mtime_ns, st.st_size, w, h]; self.dirty = True
+        return w, h
+
+    def sizes(self, image_dir, keys, workers=8):
+        # 返り値: {画像キー: (幅, 高さ)}。読めない画像は含めない
+        def header_size(path):
+            with Image.open(path) as img: return img.size
+
+        def video_size(path):
+            from video_source import probe_frame_size
+            return probe_frame_size(path)
+
+        def one(key):
+            video, _, _ = key.rpartition('/')
+            try:
+                if video.lower().endswith(VIDEO_EXTENSIONS): return key, self._lookup(video, os.path.join(image_dir, video), video_size)
+                return key, self._lookup(key, os.path.join(image_dir, key), header_size)
+            except Exception:
+                return key, None
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return {key: size for key, size in pool.map(one, keys, chunksize=64) if size and size[0] > 0 and size[1] > 0}
+
+    def save(self):
+        with self.lock:
+            if not self.dirty: return
+            data = {"version": SIZE_INDEX_VERSION, "entries": dict(self.entries)}; self.dirty = False
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+def categories(class_names):
+    # COCO のカテゴリIDは1始まり (YOLO のクラスID + 1)
+    return [{"id": i + 1, "name": name, "supercategory": ""} for i, name in enumerate(class_names)]
+
+def export_coco(out_path, keys, sizes, read_rows, class_names, progress=None):
+    # keys: 書き出す画像キー (順番どおりに image_id を振る)、sizes: {キー: (幅, 高さ)}、read_rows(stem) -> YOLO 行 or None
+    # 不正な行・classes.yaml に無いクラスIDのボックスは読み飛ばして数える (中身の検査は dataset_lint で行う)
+    # 返り値: (画像数, ボックス数, 読み飛ばしたボックス数)
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+    tmp_path = out_path + ".tmp"
+    image_count = box_count = skipped = 0
+    class_count = len(class_names)
+    with open(tmp_path, 'w', encoding='utf-8') as out, tempfile.TemporaryFile('w+', encoding='utf-8') as annotations:
+        out.write('{"info":' + dumps({"description": "Annotation Automation Tool export", "date_created": datetime.datetime.now().isoformat(timespec="seconds")}))
+        out.write(',"licenses":[],"categories":' + dumps(categories(class_names)) + ',"images":[')
+        for n, key in enumerate(keys):
+            size = sizes.get(key)
+            rows = read_rows(os.path.splitext(key)[0]) if size else None
+            if rows is None: continue
+            w, h = size; image_count += 1
+            out.write(("," if image_count > 1 else "") + dumps({"id": image_count, "file_name": key, "width": w, "height": h}))
+            # ボックスは件数が多いので、JSONエンコーダーを通さず書式文字列で組み立てる
+            parts = []
+            for class_id, cx, cy, bw, bh in rows:
+                class_id = int(class_id)
+                if not 0 <= class_id < class_count: skipped += 1; continue
+                bw_abs, bh_abs = bw * w, bh * h
+                box_count += 1
+                parts.append(f'{"," if box_count > 1 else ""}{{"id":{box_count},"image_id":{image_count},"category_id":{class_id + 1},'
+                             f'"bbox":[{(cx - bw / 2) * w:.2f},{(cy - bh / 2) * h:.2f},{bw_abs:.2f},{bh_abs:.2f}],"area":{bw_abs * bh_abs:.2f},"iscrowd":0}}')
+            annotations.write("".join(parts))
+            if progress and n % 1000 == 0: progress(n, len(keys))
+        out.write('],"annotations":[')
+        annotations.seek(0); shutil.copyfileobj(annotations, out, 1024 * 1024)
+        out.write(']}')
+    os.replace(tmp_path, out_path)
+    if progress: progress(len(keys), len(keys))
+    return image_count, box_count, skipped
+
+def select_images(all_images, status_map, statuses, labeled=None, excluded=()):
+    # statuses が None なら、ラベルのある画像すべて (labeled: ラベルのあるステム集合)
+    if statuses is None: return [f for f in all_images if os.path.splitext(f)[0] in labeled and f not in excluded]
+    return sorted(f for f, status in status_map.items() if status in statuses and f not in excluded)
+
+def size_index_path(project_dir, image_dir):
+    return os.path.join(project_dir, f".{os.path.basename(os.path.normpath(image_dir))}_image_sizes.json")
+
+def main():
+    parser = argparse.ArgumentParser(description="COCO JSON エクスポート")
+    parser.add_argument("project_dir"); parser.add_argument("image_dir"); parser.add_argument("output")
+    parser.add_argument("--status", action="append", help="書き出すステータス (既定: approved。複数指定可)")
+    parser.add_argument("--all-annotated", action="store_true", help="ステータスに関係なくラベルのある画像をすべて書き出す")
+    parser.add_argument("--recursive", action="store_true")
+    args = parser.parse_args()
+    class_names = load_class_names(args.project_dir)
+    if class_names is None: return 1
+    labels_dir = os.path.join(os.path.dirname(os.path.abspath(args.image_dir)), "labels")
+    image_dir_name = os.path.basename(os.path.normpath(args.image_dir))
+    start = time.perf_counter()
+    from label_store import TxtLabelStore
+    store = TxtLabelStore(labels_dir)
+    if args.all_annotated:
+        images = []
+        for rel, files in iter_tree(args.image_dir, args.recursive):
+            prefix = f"{rel}/" if rel else ""
+            images += [prefix + e.name for e in files if e.name.lower().endswith(IMAGE_EXTENSIONS)]
+        keys = [f for f in sorted(images) if store.exists(os.path.splitext(f)[0])]
+    else:
+        keys = select_images(None, ShardedApprovalStatus(args.project_dir, image_dir_name), set(args.status or ["approved"]))
+    index = ImageSizeIndex(size_index_path(args.project_dir, args.image_dir))
+    sizes = index.sizes(args.image_dir, keys); index.save()
+    sized = time.perf_counter()
+    image_count, box_count, skipped = export_coco(args.output, keys, sizes, lambda stem: store.read(stem, strict=False), class_names)
+    end = time.perf_counter()
+    print(f"{image_count}枚 / {box_count}ボックス -> {args.output}")
+    if skipped: print(f"classes.yaml に無いクラスIDのボックス {skipped}個 を読み飛ばしました")
+    print(f"画像サイズ取得 {sized - start:.2f}秒, 書き出し {end - sized:.2f}秒 ({image_count / max(end - start, 1e-9):.0f} 枚/秒)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
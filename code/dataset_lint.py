@@ -0,0 +1,196 @@
+# dataset_lint.py
+# 画像とラベルの整合性チェック (ワーカープロセスで並列に実行し、結果を JSON で保存する)
+#   python dataset_lint.py <プロジェクトフォルダ> <画像フォルダ> [--recursive] [--output report.json]
+import os
+import sys
+import json
+import argparse
+import datetime
+import sqlite3
+import multiprocessing
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+from utils import load_class_names, IMAGE_EXTENSIONS, VIDEO_EXTENSIONS
+from folder_scanner import iter_tree
+from label_store import format_yolo_rows
+
+LINT_VERSION = 1
+COORD_TOLERANCE = 1e-3  # 小数6桁への丸めなどで 0〜1 をわずかに超えるのは許容する
+ISSUE_NAMES = {
+    "empty_image": "空の画像ファイル", "corrupt_image": "画像を読めない", "unreadable_label": "ラベルを読めない",
+    "malformed_line": "不正な行", "class_out_of_range": "範囲外のクラスID", "out_of_bounds": "画像外のボックス",
+    "zero_area": "面積0のボックス", "duplicate_box": "重複したボックス", "orphan_label": "画像の無いラベル",
+    "ambiguous_label": "同名の画像が複数 (ラベル共有)",
+}
+
+def _issue(code, image=None, label=None, line=None, detail=""):
+    return {"code": code, "image": image, "label": label, "line": line, "detail": detail}
+
+def _check_images(items):
+    # ヘッダーだけを読んで画像サイズを確認する (画素はデコードしない)
+    issues = []
+    for key, path in items:
+        try:
+            if os.path.getsize(path) == 0: issues.append(_issue("empty_image", image=key)); continue
+            with Image.open(path) as img: w, h = img.size
+            if w <= 0 or h <= 0: issues.append(_issue("corrupt_image", image=key, detail=f"size {w}x{h}"))
+        except Exception as e:
+            issues.append(_issue("corrupt_image", image=key, detail=str(e)))
+    return issues
+
+def _check_lines(stem, text):
+    # 1行ずつの検査 (一括変換できなかったファイル用)。行番号付きで返す
+    issues, rows, line_numbers = [], [], []
+    for n, line in enumerate(text.splitlines(), 1):
+        parts = line.split()
+        if not parts: continue
+        try:
+            if len(parts) != 5: raise ValueError(f"{len(parts)} values")
+            rows.append([float(p) for p in parts]); line_numbers.append(n)
+        except ValueError as e:
+            issues.append(_issue("malformed_line", label=stem, line=n, detail=f"{e}: {line.strip()[:80]}"))
+    return issues, np.array(rows, dtype=np.float64).reshape(-1, 5), line_numbers
+
+def _read_label_texts(items, db_path):
+    # SQLite ストアのときは txt を書き出さずに DB の内容を txt と同じ形式にして検査する (別接続なので作業中でも読める)
+    if db_path is None:
+        for stem, path in items:
+            try:
+                with open(path, 'r') as f: yield stem, f.read(), None
+            except (OSError, UnicodeDecodeError) as e:
+                yield stem, None, e
+        return
+    conn = sqlite3.connect(db_path)
+    try:
+        for stem, _ in items:
+            yield stem, format_yolo_rows(conn.execute("SELECT class_id, cx, cy, w, h FROM boxes WHERE stem = ? ORDER BY idx", (stem,))), None
+    finally:
+        conn.close()
+
+def _check_labels(items, num_classes, db_path=None):
+    # チャンク内のラベルをまとめて数値化し、ボックスの検査は配列演算で一度に行う
+    issues, parsed, owners, line_numbers = [], [], [], []
+    for stem, text, error in _read_label_texts(items, db_path):
+        if error is not None: issues.append(_issue("unreadable_label", label=stem, detail=str(error))); continue
+        split_lines = [(n, line.split()) for n, line in enumerate(text.splitlines(), 1)]
+        split_lines = [(n, parts) for n, parts in split_lines if parts]
+        lines = [n for n, _ in split_lines]
+        try:
+            # 全ての行が5項目のときだけ一括変換する (6項目と4項目の行が続くと合計では5の倍数になってしまう)
+            if not all(len(parts) == 5 for _, parts in split_lines): raise ValueError("malformed line")
+            values = np.array([parts for _, parts in split_lines], dtype=np.float64).reshape(-1, 5)
+        except ValueError:
+            line_issues, values, lines = _check_lines(stem, text)
+            issues.extend(line_issues)
+        parsed.append(values); owners += [stem] * len(values); line_numbers += lines
+    if not parsed: return issues
+    data = np.concatenate(parsed)
+    if not len(data): return issues
+    cls, cx, cy, w, h = data.T
+    bad_class = (cls != np.round(cls)) | (cls < 0) | (cls >= num_classes)
+    zero_area = (w <= 0) | (h <= 0)
+    out_of_bounds = ~zero_area & ((cx - w / 2 < -COORD_TOLERANCE) | (cy - h / 2 < -COORD_TOLERANCE) | (cx + w / 2 > 1 + COORD_TOLERANCE) | (cy + h / 2 > 1 + COORD_TOLERANCE))
+    for code, mask, describe in (("class_out_of_range", bad_class, lambda i: f"class {cls[i]:g} (クラス数 {num_classes})"),
+                                 ("zero_area", zero_area, lambda i: f"w={w[i]:g} h={h[i]:g}"),
+                                 ("out_of_bounds", out_of_bounds, lambda i: f"cx={cx[i]:g} cy={cy[i]:g} w={w[i]:g} h={h[i]:g}")):
+        issues += [_issue(code, label=owners[i], line=line_numbers[i], detail=describe(i)) for i in np.flatnonzero(mask)]
+    # 同じファイル内で同じクラス・同じ座標 (小数6桁) のボックス
+    seen = set()
+    for i, row in enumerate(np.round(data, 6).tolist()):
+        key = (owners[i], *row)
+        if key in seen: issues.append(_issue("duplicate_box", label=owners[i], line=line_numbers[i], detail=f"class {row[0]:g}"))
+        seen.add(key)
+    return issues
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def _scan(root, extensions, recursive):
+    found = []
+    for rel, files in iter_tree(root, recursive) if os.path.isdir(root) else ():
+        prefix = f"{rel}/" if rel else ""
+        found += [(prefix + e.name, e.path) for e in files if e.name.lower().endswith(extensions)]
+    return found
+
+def _db_labels(db_path):
+    conn = sqlite3.connect(db_path)
+    try: return [(stem, None) for stem, in conn.execute("SELECT stem FROM labels ORDER BY stem")]
+    finally: conn.close()
+
+def lint_dataset(image_dir, labels_dir, class_names, recursive=False, workers=None, chunk_size=256, progress=None, db_path=None):
+    # db_path: SQLite ストアのDB。指定時はラベルを labels/ の txt ではなくDBから読む
+    images = _scan(image_dir, IMAGE_EXTENSIONS, recursive)
+    videos = {key for key, _ in _scan(image_dir, VIDEO_EXTENSIONS, recursive)}
+    # 動画フレームのラベルは labels/clip.mp4/ の下にあるので、ラベル側は常にサブフォルダまで走査して対象外のものを除く
+    labels = _db_labels(db_path) if db_path else [(key[:-4], path) for key, path in _scan(labels_dir, (".txt",), True)]
+    if not recursive: labels = [(stem, path) for stem, path in labels if '/' not in stem or stem.rpartition('/')[0] in videos]
+    image_chunks, label_chunks = _chunks(images, chunk_size), _chunks(labels, chunk_size)
+    issues, done, total = [], 0, len(image_chunks) + len(label_chunks)
+    # Tk のスレッドから呼ばれても安全なように spawn でワーカーを起動する
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(_check_images, chunk) for chunk in image_chunks] + [pool.submit(_check_labels, chunk, len(class_names), db_path) for chunk in label_chunks]
+        for future in futures:
+            issues += future.result(); done += 1
+            if progress: progress(done, total)
+
+    # ファイル間の検査: 拡張子違いの同名画像、画像の無いラベル
+    by_stem = defaultdict(list)
+    for key, _ in images: by_stem[os.path.splitext(key)[0]].append(key)
+    for stem, keys in by_stem.items():
+        if len(keys) > 1: issues += [_issue("ambiguous_label", image=key, label=stem, detail=", ".join(keys)) for key in keys]
+    for stem, _ in labels:
+        # 動画フレームのラベル (labels/clip.mp4/000123.txt) は動画があれば対応する画像とみなす
+        if stem not in by_stem and stem.rpartition('/')[0] not in videos: issues.append(_issue("orphan_label", label=stem))
+
+    # ラベル側の問題を画像キーに結び付ける (修正キューで開くため)
+    for issue in issues:
+        if issue["image"] is None and issue["label"] is not None:
+            keys = by_stem.get(issue["label"])
+            if keys: issue["image"] = keys[0]
+            elif issue["label"].rpartition('/')[0] in videos: issue["image"] = issue["label"] + ".jpg"  # video_source.frame_key と同じ形式
+    issues.sort(key=lambda i: (i["image"] or "", i["label"] or "", i["line"] or 0, i["code"]))
+    return {"version": LINT_VERSION, "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "image_dir": os.path.abspath(image_dir), "labels_dir": os.path.abspath(labels_dir), "num_classes": len(class_names),
+            "images": len(images), "videos": len(videos), "labels": len(labels),
+            "summary": dict(Counter(i["code"] for i in issues)), "issues": issues}
+
+def flagged_images(report):
+    # エディタで開ける画像のみ (空・壊れた画像はファイルの差し替えが必要なので除く)
+    broken = {i["image"] for i in report["issues"] if i["code"] in ("empty_image", "corrupt_image")}
+    return sorted({i["image"] for i in report["issues"] if i["image"]} - broken)
+
+def format_summary(report):
+    lines = [f"画像 {report['images']}枚 / 動画 {report['videos']}本 / ラベル {report['labels']}件を検査しました。"]
+    if not report["issues"]: return lines[0] + "\n問題は見つかりませんでした。"
+    lines += [f"  {ISSUE_NAMES.get(code, code)}: {count}件" for code, count in sorted(report["summary"].items(), key=lambda kv: -kv[1])]
+    return "\n".join(lines)
+
+def save_report(report, path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(report, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+def report_path(project_dir, image_dir):
+    return os.path.join(project_dir, f".{os.path.basename(os.path.normpath(image_dir))}_lint.json")
+
+def main():
+    parser = argparse.ArgumentParser(description="データセットの検証")
+    parser.add_argument("project_dir"); parser.add_argument("image_dir")
+    parser.add_argument("--labels-dir", help="省略時は画像フォルダと同じ階層の labels")
+    parser.add_argument("--recursive", action="store_true")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", help="JSONレポートの保存先 (省略時はプロジェクトフォルダ)")
+    args = parser.parse_args()
+    class_names = load_class_names(args.project_dir)
+    if class_names is None: return 1
+    labels_dir = args.labels_dir or os.path.join(os.path.dirname(os.path.abspath(args.image_dir)), "labels")
+    report = lint_dataset(args.image_dir, labels_dir, class_names, args.recursive, args.workers)
+    output = args.output or report_path(args.project_dir, args.image_dir)
+    save_report(report, output)
+    print(format_summary(report)); print(f"レポート: {output}")
+    return 1 if report["issues"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+# dedup.py
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from video_source import split_frame_key, VideoFrameCache
+
+PHASH_INDEX_VERSION = 2  # 2: DC成分を除いた63bitハッシュ
+HASH_SIZE = 8
+_DCT_SIZE = 32
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]; i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+def _gray_pixels(img):
+    return np.asarray(img.convert('L').resize((_DCT_SIZE, _DCT_SIZE), Image.Resampling.BILINEAR), dtype=np.float64)
+
+def phash(image_path, frame_cache=None):
+    # 32x32グレースケールのDCT低周波 8x8 から DC成分を除いた63係数を中央値で2値化した63bit値
+    frame = split_frame_key(image_path) if frame_cache else None
+    if frame:
+        pixels = _gray_pixels(frame_cache.get(*frame))
+    else:
+        with Image.open(image_path) as img:
+            img.draft('L', (_DCT_SIZE * 2, _DCT_SIZE * 2))  # JPEGは縮小デコードで高速化
+            pixels = _gray_pixels(img)
+    coeffs = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].flatten()[1:]
+    bits = coeffs > np.median(coeffs)
+    value = 0
+    for bit in bits: value = (value << 1) | int(bit)
+    return value
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+class BKTree:
+    # ハミング距離によるBK木。閾値内の近傍を全件比較せずに探索する
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, key):
+        if self.root is None: self.root = [value, [key], {}]; return
+        node = self.root
+        while True:
+            d = hamming(value, node[0])
+            if d == 0: node[1].append(key); return
+            child = node[2].get(d)
+            if child is None: node[2][d] = [value, [key], {}]; return
+            node = child
+
+    def search(self, value, threshold):
+        if self.root is None: return []
+        found, stack = [], [self.root]
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= threshold: found.extend(node[1])
+            for dist, child in node[2].items():
+                if d - threshold <= dist <= d + threshold: stack.append(child)
+        return found
+
+def cluster_duplicates(hashes, threshold):
+    # hashes: {filename: hash}. 返り値: {代表ファイル: [重複ファイル, ...]} (重複のあるクラスタのみ)
+    names = sorted(hashes)
+    tree = BKTree()
+    for name in names: tree.add(hashes[name], name)
+    parent = {name: name for name in names}
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]; x = parent[x]
+        return x
+
+    for name in names:
+        for other in tree.search(hashes[name], threshold):
+            ra, rb = find(name), find(other)
+            if ra != rb:
+                # 名前順で先頭のファイルを代表にする
+                if rb < ra: ra, rb = rb, ra
+                parent[rb] = ra
+    groups = {}
+    for name in names:
+        root = find(name)
+        if root != name: groups.setdefault(root, []).append(name)
+    return groups
+
+class PHashIndex:
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.entries = {}  # filename -> [mtime_ns, size, hash]
+        self.lock = threading.Lock()
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f: data = json.load(f)
+            if data.get("version") == PHASH_INDEX_VERSION:
+                self.entries = {k: [v[0], v[1], int(v[2], 16)] for k, v in data.get("entries", {}).items()}
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        with self.lock:
+            data = {"version": PHASH_INDEX_VERSION, "entries": {k: [v[0], v[1], f"{v[2]:016x}"] for k, v in self.entries.items()}}
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, self.index_path)
+
+    def update(self, image_dir, filenames, workers=4, cancel_event=None, progress=None):
+        # mtime・サイズが変わっていない画像は再計算しない (動画フレームは動画ファイルの mtime・サイズで判定)
+        stale = []
+        for name in filenames:
+            path = os.path.join(image_dir, name); frame = split_frame_key(path)
+            try: st = os.stat(frame[0] if frame else path)
+            except OSError: continue
+            entry = self.entries.get(name)
+            if entry is None or entry[0] != st.st_mtime_ns or entry[1] != st.st_size: stale.append((name, st.st_mtime_ns, st.st_size))
+
+        # 名前順に処理するので、同じ動画のフレームはほぼ順番に要求される (先読みでまとめてデコード)
+        frame_cache = VideoFrameCache(capacity=128, readahead=workers * 4)
+
+        def compute(item):
+            if cancel_event is not None and cancel_event.is_set(): return None
+            name, mtime, size = item
+            try: return name, mtime, size, phash(os.path.join(image_dir, name), frame_cache)
+            except Exception as e:
+                print(f"pHash error ({name}): {e}"); return None
+
+        done = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for result in pool.map(compute, stale):
+                done += 1
+                if result is not None:
+                    name, mtime, size, value = result
+                    with self.lock: self.entries[name] = [mtime, size, value]
+                if progress and done % 200 == 0: progress(done, len(stale))
+        frame_cache.clear()
+        return len(stale)
+
+    def hashes_for(self, filenames):
+        with self.lock:
+            return {name: self.entries[name][2] for name in filenames if name in self.entries}
@@ -4,12 +4,37 @@ import shutil
 import tkinter
 import tkinter.messagebox as msgbox
 import tkinter.filedialog as filedialog
-from utils import load_class_names, load_approval_status, save_status
+import tkinter.simpledialog as simpledialog
+from utils import load_class_names, format_bytes, IMAGE_EXTENSIONS, VIDEO_EXTENSIONS
+from video_source import is_video, probe_frame_count, expand_video, open_source_image, split_frame_key
+from project_shards import ShardedApprovalStatus, folder_of
+from label_store import TxtLabelStore, SqliteLabelStore, load_label_columns
+from grid_review import GridReviewWindow
+from class_picker import MRU_SIZE
+from class_remap_window import ClassRemapWindow
+from model_pool import ModelRegistry, model_label
+from coco_export import ImageSizeIndex, export_coco, select_images, size_index_path
+from label_import import import_labels, apply_status, format_report as format_import_report
+from remote_source import RemoteSource, RemoteScanner, cache_dir_for
+from query_index import build_query_index, index_paths
+from dataset_lint import lint_dataset, flagged_images, format_summary, save_report, report_path
+from work_lease import WorkLease
+from fs_watcher import FolderWatcher
+from folder_scanner import FolderScanner, load_scan_cache, save_scan_cache
+import analytics
+from dedup import PHashIndex, cluster_duplicates
+from roi_detect import detect_region, merge_detections
+from input_replay import InputRecorder
+import threading
 import json
 import copy
 import datetime
 import time
 
+LEASE_HEARTBEAT_MS = 30000  # WorkLease の ttl (120秒) より十分短くする
+REMOTE_UPLOAD_MS = 5000  # リモートへのラベルの書き戻し間隔 (この間の保存をまとめて送る)
+REMOTE_PREFETCH = 8  # リモートの画像をキューの何枚先まで先読みするか
+
 class EventHandlers:
     def __init__(self, app):
         self.app = app
@@ -17,59 +42,288 @@ class EventHandlers:
     def select_project_folder(self):
         project_dir = filedialog.askdirectory(title="ステップ1: プロジェクトフォルダを選択")
         if not project_dir: return
+        self.open_project(project_dir)
+
+    def open_project(self, project_dir):
         class_names = load_class_names(project_dir)
         if class_names is None: self.app.log("エラー: classes.yamlの読み込みに失敗しました。"); return
         self.app.project_dir = project_dir
         self.app.class_names = class_names
+        self.app.class_mru[:] = range(min(MRU_SIZE, len(class_names)))
+        self.app.build_class_picker()
+        self.app.model_registry = ModelRegistry(project_dir)
+        if self.app.model_registry.active: self.switch_model(self.app.model_registry.active)
         self.app.project_path_label.configure(text=f"プロジェクト: {os.path.basename(project_dir)}")
-        self.app.select_image_folder_button.configure(state="normal")
+        self.app.select_image_folder_button.configure(state="normal"); self.app.open_remote_button.configure(state="normal")
         self.app.log(f"プロジェクトを読込: {project_dir}")
 
     def select_image_folder(self):
         image_dir = filedialog.askdirectory(title="ステップ2: 対象の画像フォルダを選択")
         if not image_dir: return
+        self.open_image_folder(image_dir)
+
+    def open_remote_folder(self):
+        # fsspec の URL (s3://bucket/data/images など) の画像はローカルのキャッシュを通して読み、ラベルはまとめて書き戻す
+        url = simpledialog.askstring("リモートの画像フォルダ", "画像フォルダの URL (例: s3://bucket/dataset/images)\nラベルは同じ階層の labels に読み書きします。", parent=self.app)
+        if not url or not url.strip(): return
+        url = url.strip()
+        try: remote = RemoteSource(url, cache_dir_for(self.app.project_dir, url))
+        except Exception as e: msgbox.showerror("エラー", f"リモートのフォルダを開けません:\n{e}"); return
+        self.open_image_folder(remote.image_dir, remote)
+
+    def close_remote(self):
+        # 書き戻し待ちのラベルを送ってから閉じる
+        remote, self.app.remote = self.app.remote, None
+        if remote is None: return
+        self.upload_remote_labels(remote); self.app.flush_io()
+        remote.close()
+
+    def upload_remote_labels(self, remote):
+        # ラベルの書き込みと同じ I/O スレッドに積むので、それまでに投入したローカルへの書き込みの後に送られる
+        batch = remote.take_dirty()
+        if not batch: return
+        self.app.io.submit(("remote_upload", id(batch)), lambda: remote.upload(batch), lambda result, error: self._remote_uploaded(remote, batch, error))
+
+    def _remote_uploaded(self, remote, batch, error):
+        if error is not None: self.app.log(f"エラー: リモートへのラベルの書き戻しに失敗しました ({len(batch)}件、次回に再送します): {error}")
+
+    def poll_remote_uploads(self, remote):
+        if remote is not self.app.remote: return
+        self.upload_remote_labels(remote)
+        self.app.after(REMOTE_UPLOAD_MS, self.poll_remote_uploads, remote)
+
+    def open_image_folder(self, image_dir, remote=None):
+        self.stop_folder_watcher(); self.cancel_folder_scan(); self.release_work_lease(); self.close_remote(); self.app.flush_io(); self.app.frame_cache.clear(); self.app.box_propagator.reset()
         self.app.image_dir = image_dir
+        self.app.remote = remote
         parent_dir = os.path.dirname(os.path.abspath(image_dir))
         self.app.labels_dir = os.path.join(parent_dir, "labels")
         os.makedirs(self.app.labels_dir, exist_ok=True)
         image_dir_name = os.path.basename(os.path.normpath(image_dir))
         self.app.image_path_label.configure(text=f"対象フォルダ: {image_dir_name}")
+        self.app.recursive = self.app.recursive_var.get()
         
-        self.app.approval_status, self.app.status_file_path = load_approval_status(self.app.project_dir, image_dir_name)
+        # 承認ステータスはフォルダ単位のシャードで保持し、必要な分だけ読み込む
+        self.app.approval_status = ShardedApprovalStatus(self.app.project_dir, image_dir_name)
+        self.app.approval_status.submit = self.app.io.submit
+        self.app.status_file_path = self.app.approval_status.legacy_path
+        self.open_label_store(image_dir_name)
         
-        self.app.all_image_files = sorted([f for f in os.listdir(image_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))])
-        
-        total_size = sum(os.path.getsize(os.path.join(image_dir, f)) for f in self.app.all_image_files)
-        self.app.total_image_size_cache = total_size
-        total_label_size = 0
-        for f in self.app.all_image_files:
-            txt_path = os.path.join(self.app.labels_dir, f"{os.path.splitext(f)[0]}.txt")
-            if os.path.exists(txt_path):
-                total_label_size += os.path.getsize(txt_path)
-        self.app.total_label_size_cache = total_label_size
+        # ファイルごとのサイズを保持し、監視イベントで差分更新できるようにする
+        self.app.all_image_files, self.app.image_sizes, self.app.label_sizes = [], {}, {}
+        self.app.total_image_size_cache, self.app.total_label_size_cache = 0, 0
+        self.app.session_start_count = None
+        self.app.duplicate_groups, self.app.duplicate_of = {}, {}
+        self.app.query_index = None
+        self.set_mode_buttons_state("disabled")
+        self.app.scan_cache_path = os.path.join(self.app.project_dir, f".{image_dir_name}_scan_cache.json")
+
+        self.app.scan_dirs = ([], [])
+        if remote is not None:
+            # リモートはラベルを同期してから一覧を取得する (スキャンキャッシュ・フォルダ監視は使わない)
+            self.app.scan_cache_path = ""
+            self.app.image_path_label.configure(text=f"対象フォルダ: {remote.url} (同期中...)")
+            self.app.folder_scanner = RemoteScanner(remote, recursive=self.app.recursive)
+            self.app.folder_scanner.start()
+            self.app.after(50, self.poll_folder_scan, self.app.folder_scanner)
+            self.app.after(REMOTE_UPLOAD_MS, self.poll_remote_uploads, remote)
+            return
+        cached = load_scan_cache(self.app.scan_cache_path, image_dir, self.app.labels_dir, self.app.recursive)
+        if cached is not None:
+            images, labels, image_dirs, label_dirs = cached
+            self.app.scan_dirs = (list(image_dirs), list(label_dirs))
+            self.app.label_sizes = dict(labels); self.app.total_label_size_cache = sum(labels.values())
+            self.apply_scanned_images(list(images.items()))
+            self.finish_folder_scan(from_cache=True)
+            return
+
+        # 大量の画像でもメインループを止めないよう、走査はバックグラウンドで行う
+        self.app.image_path_label.configure(text=f"対象フォルダ: {image_dir_name} (スキャン中...)")
+        self.app.folder_scanner = FolderScanner(image_dir, self.app.labels_dir, IMAGE_EXTENSIONS + VIDEO_EXTENSIONS, recursive=self.app.recursive)
+        self.app.folder_scanner.start()
+        self.app.after(50, self.poll_folder_scan, self.app.folder_scanner)
+
+    def open_label_store(self, image_dir_name):
+        if self.app.label_store: self.app.label_store.close()
+        # リモートはラベルを txt のまま複製して書き戻すので SQLite は使わない
+        if not self.app.use_sqlite_var.get() or self.app.remote:
+            self.app.label_store = TxtLabelStore(self.app.labels_dir, self.app.io.submit); return
+        self.app.label_store = SqliteLabelStore(os.path.join(self.app.project_dir, f".{image_dir_name}_labels.sqlite"), self.app.labels_dir)
+        # SQLite使用時はステータスもDBで管理する (初回はシャードファイルから移行)
+        shard_status = self.app.approval_status
+        self.app.approval_status = self.app.label_store.status_view()
+        self.app.status_file_path = self.app.label_store.db_path
+        migrated = sum(shard_status.counts().values())
+        if migrated and not any(self.app.approval_status.counts().values()):
+            self.app.approval_status.update(shard_status); self.app.approval_status.save()
+            self.app.log(f"承認ステータスをSQLiteに移行しました ({migrated}件)")
+
+    def sync_label_store(self):
+        # SQLiteの内容をYOLO txt・ステータスファイルへ書き出し、外部で更新された txt を取り込む
+        store = self.app.label_store
+        if not store or store.kind != "sqlite": return
+        exported = store.export_to_txt()
+        imported, skipped = store.import_from_txt(self.app.recursive)
+        shard_status = ShardedApprovalStatus(self.app.project_dir, os.path.basename(os.path.normpath(self.app.image_dir)))
+        for image, status in self.app.approval_status.items():
+            if shard_status.get(image) != status: shard_status[image] = status
+        shard_status.save()
+        self.refresh_label_sizes_from_store()
+        self.app.log(f"ラベルストアを同期しました (txt書き出し: {exported}件 / 取り込み: {imported}件 / 読込失敗: {skipped}件)")
+
+    def start_label_store_import(self):
+        # 初回や外部ツールで追加された txt の取り込みはバックグラウンド (別接続) で行う
+        db_path, labels_dir, recursive = self.app.label_store.db_path, self.app.labels_dir, self.app.recursive
+        job = {"result": None}
+
+        def worker():
+            store = SqliteLabelStore(db_path, labels_dir)
+            try: job["result"] = store.import_from_txt(recursive)
+            except Exception as e: job["result"] = e
+            finally: store.close()
+
+        threading.Thread(target=worker, name="LabelStoreImport", daemon=True).start()
+        self.app.after(200, self._poll_label_store_import, job, self.app.label_store)
+
+    def _poll_label_store_import(self, job, store):
+        if store is not self.app.label_store: return
+        if job["result"] is None: self.app.after(200, self._poll_label_store_import, job, store); return
+        if isinstance(job["result"], Exception): self.app.log(f"エラー: txtの取り込みに失敗しました。 {job['result']}"); return
+        imported, skipped = job["result"]
+        self.refresh_label_sizes_from_store()
+        if imported or skipped: self.app.log(f"txtラベルをSQLiteに取り込みました ({imported}件 / 読込失敗: {skipped}件)")
+
+    def refresh_label_sizes_from_store(self):
+        self.app.label_sizes = self.app.label_store.label_sizes()
+        self.app.total_label_size_cache = sum(self.app.label_sizes.values())
+        self.app.scan_cache_dirty = True
+        if self.app.mode == 'start': self.update_dashboard_stats()
+        else: self.app.update_progress_display()
+
+    def open_class_remap(self):
+        if not self.app.project_dir or not self.app.labels_dir: return
+        if self.app.remap_window is not None and self.app.remap_window.winfo_exists(): self.app.remap_window.focus(); return
+        self.app.remap_window = ClassRemapWindow(self.app)
+
+    def apply_class_remap(self, report):
+        # 一括変更の結果をクラス名・最近使ったクラス・ラベルサイズに反映する (サムネイル・分析のキャッシュは内容と更新時刻で自動的に作り直される)
+        id_map = report["id_map"]
+        self.app.class_names = load_class_names(self.app.project_dir) or report["new_names"]
+        self.app.query_index = None
+        mru = []
+        for old in self.app.class_mru:
+            new = id_map[old] if 0 <= old < len(id_map) else -1
+            if new >= 0 and new not in mru: mru.append(new)
+        self.app.class_mru[:] = mru
+        self.app.build_class_picker()
+        labels_root = os.path.abspath(self.app.labels_dir)
+        for path, size in report["changed"]:
+            rel = os.path.relpath(path, labels_root)
+            if rel.startswith(".."): continue
+            stem = rel[:-4].replace(os.sep, '/')
+            if stem in self.app.label_sizes: self.app.total_label_size_cache += size - self.app.label_sizes[stem]; self.app.label_sizes[stem] = size
+        if self.app.label_store and self.app.label_store.kind == "sqlite": self.refresh_label_sizes_from_store()
+        else: self.app.scan_cache_dirty = True; self.update_dashboard_stats()
+        self.app.log(f"クラスを一括変更しました: ラベル {len(report['changed'])}件を書き換え / {len(report['class_names'])}クラス -> {len(report['new_names'])}クラス")
+
+    def poll_io_executor(self):
+        # バックグラウンド書き込みの完了通知を処理し、失敗はログに残す
+        for key, callbacks, result, error in self.app.io.drain_completions():
+            for callback in callbacks: callback(result, error)
+            if error is None: continue
+            if isinstance(key, tuple): print(f"Log file writing error: {error}")  # ログ追記の失敗はログに書けない
+            else: self.app.log(f"エラー: 書き込みに失敗しました ({key}): {error}")
+        self.app.after(100, self.poll_io_executor)
+
+    def set_mode_buttons_state(self, state):
+        for button in (self.app.start_annotation_button, self.app.start_approval_button, self.app.start_correction_button, self.app.start_reapproval_button):
+            button.configure(state=state)
+        if hasattr(self.app, 'export_button'): self.app.export_button.configure(state=state); self.app.coco_export_button.configure(state=state)
+        self.app.analytics_button.configure(state=state); self.app.dedup_button.configure(state=state)
+        self.app.grid_review_button.configure(state=state); self.app.remap_button.configure(state=state); self.app.lint_button.configure(state=state)
+        self.app.import_button.configure(state=state); self.app.query_annotation_button.configure(state=state); self.app.query_approval_button.configure(state=state)
+        self.app.sync_store_button.configure(state=state if self.app.label_store and self.app.label_store.kind == "sqlite" else "disabled")
+
+    def cancel_folder_scan(self):
+        if self.app.folder_scanner: self.app.folder_scanner.cancel()
+        self.app.folder_scanner = None
+
+    def poll_folder_scan(self, scanner):
+        if scanner is not self.app.folder_scanner or scanner.cancelled: return
+        finished = False
+        for kind, payload in scanner.drain():
+            if kind == "label_names":
+                self.app.label_sizes = dict.fromkeys(payload, 0)
+            elif kind == "images":
+                first_batch = not self.app.image_sizes
+                self.apply_scanned_images(payload)
+                if first_batch: self.set_mode_buttons_state("normal")
+            elif kind == "label_sizes":
+                for stem, size in payload:
+                    self.app.total_label_size_cache += size - self.app.label_sizes.get(stem, 0)
+                    self.app.label_sizes[stem] = size
+            elif kind == "dirs":
+                self.app.scan_dirs = payload
+            elif kind == "error":
+                self.app.log(f"エラー: 画像フォルダの走査に失敗しました。 {payload}"); finished = True
+            elif kind == "done":
+                finished = True
+        if self.app.mode == 'start': self.update_dashboard_stats()
+        else: self.app.update_progress_display()
+        if finished:
+            self.app.folder_scanner = None
+            self.finish_folder_scan(from_cache=False)
+        else:
+            image_dir_name = os.path.basename(os.path.normpath(self.app.image_dir))
+            self.app.image_path_label.configure(text=f"対象フォルダ: {image_dir_name} (スキャン中... {len(self.app.all_image_files)}枚)")
+            self.app.after(100, self.poll_folder_scan, scanner)
+
+    def apply_scanned_images(self, batch):
+        app = self.app; new_names = []
+        for name, size in batch:
+            if name not in app.image_sizes: new_names.append(name)
+            app.total_image_size_cache += size - app.image_sizes.get(name, 0)
+            app.image_sizes[name] = size
+        if not new_names: return
+        # ソート済みリストへの一括マージ (timsortは連結された整列済み区間を線形時間で処理する)
+        app.all_image_files.extend(new_names); app.all_image_files.sort()
+        self.extend_active_queue(sorted(new_names))
 
+    def finish_folder_scan(self, from_cache):
+        image_dir_name = os.path.basename(os.path.normpath(self.app.image_dir))
+        self.app.image_path_label.configure(text=f"対象フォルダ: {self.app.remote.url if self.app.remote else image_dir_name}")
+        self.set_mode_buttons_state("normal")
         self.update_dashboard_stats()
-        self.app.start_annotation_button.configure(state="normal"); self.app.start_approval_button.configure(state="normal")
-        self.app.start_correction_button.configure(state="normal"); self.app.start_reapproval_button.configure(state="normal")
-        if hasattr(self.app, 'export_button'): self.app.export_button.configure(state="normal")
-        self.app.log(f"画像フォルダをロード: {image_dir_name} ({len(self.app.all_image_files)}枚)")
-        self.app.session_start_count = None
+        if from_cache: self.app.scan_cache_dirty = False
+        else: self.app.scan_cache_dirty = True; self.save_scan_cache()
+        if self.app.remote is None: self.start_folder_watcher()
+        self.app.log(f"画像フォルダをロード: {self.app.remote.url if self.app.remote else image_dir_name} ({len(self.app.all_image_files)}枚{', キャッシュ' if from_cache else ''})")
+        if self.app.label_store.kind == "sqlite": self.start_label_store_import()
+
+    def save_scan_cache(self):
+        if not self.app.scan_cache_dirty or not self.app.scan_cache_path or self.app.folder_scanner: return
+        # 監視で見つかった新しいサブフォルダも mtime の検証対象に含める
+        image_dirs = set(self.app.scan_dirs[0]) | {folder_of(f) for f in self.app.image_sizes}
+        label_dirs = set(self.app.scan_dirs[1]) | {folder_of(s) for s in self.app.label_sizes}
+        # サイズ表はコピーを渡し、書き込み (と mtime の取得) は I/O スレッドで行う
+        args = (self.app.scan_cache_path, self.app.image_dir, self.app.labels_dir, dict(self.app.image_sizes), dict(self.app.label_sizes),
+                sorted(image_dirs), sorted(label_dirs), self.app.recursive)
+        self.app.io.submit(self.app.scan_cache_path, lambda: save_scan_cache(*args))
+        self.app.scan_cache_dirty = False
 
     def update_dashboard_stats(self):
-        total = len(self.app.all_image_files); annotated = 0; approved = 0; rejected = 0; fixed = 0
+        total = len(self.app.all_image_files); annotated = 0
+        label_sizes = self.app.label_sizes
         for f in self.app.all_image_files:
-            if os.path.exists(os.path.join(self.app.labels_dir, f"{os.path.splitext(f)[0]}.txt")): annotated += 1
-            
-            status = self.app.approval_status.get(f)
-            if status == "approved": approved += 1
-            elif status == "rejected": rejected += 1
-            elif status == "fixed": fixed += 1
+            if os.path.splitext(f)[0] in label_sizes: annotated += 1
+        # ステータス件数はシャードごとのサマリから集計 (全シャードは読み込まない)
+        counts = self.app.approval_status.counts()
+        approved, rejected, fixed = counts["approved"], counts["rejected"], counts["fixed"]
             
         self.app.stats_labels['total'].configure(text=str(total)); self.app.stats_labels['annotated'].configure(text=str(annotated))
         self.app.stats_labels['approved'].configure(text=str(approved)); self.app.stats_labels['rejected'].configure(text=str(rejected))
         self.app.stats_labels['fixed'].configure(text=str(fixed))
         
-        from utils import format_bytes
         img_size_str = format_bytes(getattr(self.app, 'total_image_size_cache', 0))
         lbl_size_str = format_bytes(getattr(self.app, 'total_label_size_cache', 0))
         if 'total_size' in self.app.stats_labels:
@@ -78,21 +332,353 @@ class EventHandlers:
         self.app.start_correction_button.configure(fg_color="#D90000" if rejected > 0 else "#3B8ED0", hover_color="#8F0000" if rejected > 0 else "#36719F")
         self.app.start_reapproval_button.configure(fg_color="#E59100" if fixed > 0 else "#3B8ED0", hover_color="#B37100" if fixed > 0 else "#36719F")
 
-    def start_mode(self, mode):
+    def start_folder_watcher(self):
+        self.stop_folder_watcher()
+        self.app.fs_watcher = FolderWatcher([("image", self.app.image_dir, IMAGE_EXTENSIONS + VIDEO_EXTENSIONS), ("label", self.app.labels_dir, (".txt",))], recursive=self.app.recursive)
+        self.app.fs_watcher.start()
+        self.app.log(f"フォルダ監視を開始しました ({self.app.fs_watcher.backend})")
+        self.app.after(500, self.poll_folder_watcher, self.app.fs_watcher)
+
+    def stop_folder_watcher(self):
+        if self.app.fs_watcher: self.app.fs_watcher.stop()
+        self.app.fs_watcher = None
+
+    def poll_folder_watcher(self, watcher):
+        # Tkはスレッドセーフではないため、イベントはメインループ側で取り出して反映する
+        if watcher is not self.app.fs_watcher: return
+        events = watcher.drain()
+        if events: self.apply_fs_events(events)
+        self.app.after(500, self.poll_folder_watcher, watcher)
+
+    def _expand_video_events(self, events):
+        # 動画ファイルのイベントをフレーム単位のイベントに置き換える (追加・削除されたフレームだけを通知)
+        for kind, tag, name, size in events:
+            if tag != "image" or not is_video(name):
+                yield kind, tag, name, size; continue
+            video_path = os.path.join(self.app.image_dir, name)
+            self.app.frame_cache.invalidate(video_path)
+            frames = dict(expand_video(name, size, probe_frame_count(video_path))) if kind != "deleted" else {}
+            prefix = name + "/"
+            for key in [k for k in self.app.image_sizes if k.startswith(prefix) and k not in frames]: yield "deleted", tag, key, None
+            for key, frame_size in frames.items(): yield "modified", tag, key, frame_size
+
+    def apply_fs_events(self, events):
+        app = self.app; added_images = []; removed_images = set(); changed = False
+        for kind, tag, name, size in self._expand_video_events(events):
+            if tag == "image":
+                known = name in app.image_sizes
+                if kind == "deleted":
+                    if not known: continue
+                    app.total_image_size_cache -= app.image_sizes.pop(name)
+                    removed_images.add(name)
+                else:
+                    app.total_image_size_cache += size - app.image_sizes.get(name, 0)
+                    app.image_sizes[name] = size
+                    if not known: added_images.append(name)
+                changed = True
+            else:
+                stem = os.path.splitext(name)[0]
+                if app.label_store.kind == "sqlite":
+                    # SQLiteが正。外部で書き換えられた txt だけを取り込む (削除は反映しない)
+                    if kind == "deleted": continue
+                    try: size = app.label_store.import_txt(stem)
+                    except (OSError, ValueError, IndexError): continue
+                    if size is None: continue
+                if kind == "deleted":
+                    if stem not in app.label_sizes: continue
+                    app.total_label_size_cache -= app.label_sizes.pop(stem)
+                else:
+                    app.total_label_size_cache += size - app.label_sizes.get(stem, 0)
+                    app.label_sizes[stem] = size
+                changed = True
+        if not changed: return
+        app.scan_cache_dirty = True
+        # 同じバッチ内で削除→再作成されたもの (上書き保存など) は一覧を変更しない
+        readded = removed_images & app.image_sizes.keys()
+        removed_images -= readded
+        added_images = [f for f in dict.fromkeys(added_images) if f in app.image_sizes and f not in readded]
+        if removed_images:
+            # 動画の削除などで大量に消えることがあるため、一覧からはまとめて取り除く
+            app.all_image_files = [f for f in app.all_image_files if f not in removed_images]
+            self._remove_from_queue(removed_images)
+        if added_images: app.all_image_files.extend(added_images); app.all_image_files.sort()
+
+        # 作業中のモードの条件に合う新規画像はそのまま作業キューの末尾に追加
+        self.extend_active_queue(added_images)
+        if added_images: app.log(f"新しい画像を検出しました: {len(added_images)}枚")
+
+        if app.mode == 'start': self.update_dashboard_stats()
+        else:
+            app.update_progress_display()
+            if app.current_image_index != -1: app.update_info_labels()
+
+    def _remove_from_queue(self, names):
+        app = self.app
+        current = app.image_files[app.current_image_index] if 0 <= app.current_image_index < len(app.image_files) else None
+        if current in names:
+            app.log(f"表示中の画像が削除されました: {current}"); names = names - {current}
+        if app.current_image_index > 0: app.current_image_index -= sum(1 for f in app.image_files[:app.current_image_index] if f in names)
+        app.image_files = [f for f in app.image_files if f not in names]
+
+    def queue_predicate(self, mode):
+        status, labels = self.app.approval_status, self.app.label_sizes
+        if mode == 'approval': predicate = lambda f: os.path.splitext(f)[0] in labels and status.get(f) != "approved"
+        elif mode in ('correction', 'reapproval'):
+            # 対象ステータスを含まないフォルダはサマリで除外し、シャードを読み込まない
+            target = "rejected" if mode == 'correction' else "fixed"
+            folders = status.folders_with(target) if hasattr(status, 'folders_with') else None
+            predicate = lambda f: (folders is None or folder_of(f) in folders) and status.get(f) == target
+        else: predicate = lambda f: True
+        if self.app.skip_duplicates_var.get() and self.app.duplicate_of:
+            # 重複クラスタは代表画像のみをキューに入れる
+            duplicate_of = self.app.duplicate_of
+            return lambda f: f not in duplicate_of and predicate(f)
+        return predicate
+
+    def extend_active_queue(self, names):
+        if not names or self.app.mode == 'start' or self.app.current_image_index == -1: return
+        if self.app.work_lease is not None: return  # 分担中は追加分も予約してから取り込む (claim_more_work)
+        predicate = self.queue_predicate(self.app.mode); queued = set(self.app.image_files)
+        self.app.image_files.extend(f for f in names if f not in queued and predicate(f))
+
+    def show_dataset_analytics(self):
+        # ラベルの読み込みはバックグラウンドで行い、集計結果だけをメインループで表示する
+        if not self.app.image_dir or self.app.analytics_job is not None: return
+        image_dir_name = os.path.basename(os.path.normpath(self.app.image_dir))
+        cache_path = os.path.join(self.app.project_dir, f".{image_dir_name}_label_table.npz")
+        # ステータスはワーカースレッドで読む (Tk のスレッドで全シャードを読み込まない)
+        image_files, read_status = list(self.app.all_image_files), self.app.approval_status.reader()
+        class_names, labels_dir, recursive = list(self.app.class_names), self.app.labels_dir, self.app.recursive
+        db_path = self.app.label_store.db_path if self.app.label_store.kind == "sqlite" else None
+        job = {"result": None}
+
+        def worker():
+            try:
+                if db_path: table, parsed = analytics.table_from_columns(*load_label_columns(db_path)), 0
+                else: table, parsed = analytics.build_label_table(labels_dir, cache_path, recursive=recursive)
+                summary = analytics.summarize(table, class_names, image_files, read_status())
+                job["result"] = (analytics.format_report(summary, class_names), parsed)
+            except Exception as e:
+                job["result"] = (f"集計に失敗しました: {e}", 0)
+
+        self.app.analytics_job = job
+        self.app.analytics_button.configure(text="データセット分析 (集計中...)")
+        threading.Thread(target=worker, name="DatasetAnalytics", daemon=True).start()
+        self.app.after(100, self._poll_dataset_analytics, job)
+
+    def _poll_dataset_analytics(self, job):
+        if job["result"] is None: self.app.after(100, self._poll_dataset_analytics, job); return
+        self.app.analytics_job = None
+        self.app.analytics_button.configure(text="データセット分析")
+        report, parsed = job["result"]
+        self.app.log(f"データセット分析を更新しました (再解析: {parsed}ファイル)")
+        self.app.open_analytics_window(report)
+
+    def detect_duplicates(self):
+        if not self.app.image_dir or self.app.dedup_job is not None: return
+        image_dir_name = os.path.basename(os.path.normpath(self.app.image_dir))
+        index = PHashIndex(os.path.join(self.app.project_dir, f".{image_dir_name}_phash.json"))
+        image_dir, filenames, threshold = self.app.image_dir, list(self.app.all_image_files), self.app.dedup_threshold
+        job = {"result": None, "progress": (0, 0), "cancel": threading.Event()}
+
+        def worker():
+            try:
+                computed = index.update(image_dir, filenames, cancel_event=job["cancel"], progress=lambda done, total: job.__setitem__("progress", (done, total)))
+                index.save()
+                job["result"] = (cluster_duplicates(index.hashes_for(filenames), threshold), computed)
+            except Exception as e:
+                job["result"] = (None, str(e))
+
+        self.app.dedup_job = job
+        threading.Thread(target=worker, name="DuplicateDetection", daemon=True).start()
+        self.app.after(200, self._poll_duplicate_detection, job)
+
+    def _poll_duplicate_detection(self, job):
+        if job["result"] is None:
+            done, total = job["progress"]
+            self.app.dedup_button.configure(text=f"重複検出中... {done}/{total}" if total else "重複検出中...")
+            self.app.after(200, self._poll_duplicate_detection, job); return
+        self.app.dedup_job = None
+        self.app.dedup_button.configure(text="重複画像を検出")
+        groups, detail = job["result"]
+        if groups is None: self.app.log(f"エラー: 重複検出に失敗しました。 {detail}"); return
+        self.app.duplicate_groups = groups
+        self.app.duplicate_of = {member: rep for rep, members in groups.items() for member in members}
+        self.app.log(f"重複検出完了: {len(groups)}クラスタ / 重複 {len(self.app.duplicate_of)}枚 (ハッシュ計算: {detail}枚)")
+
+    def validate_dataset(self):
+        # 画像ヘッダー・ラベルの検査はワーカープロセスで行い、結果はプロジェクトフォルダに JSON で保存する
+        if not self.app.image_dir or self.app.lint_job is not None: return
+        self.app.flush_io()
+        # SQLite ストアはDBを別接続で直接読む (検証のために txt を書き出さない)
+        db_path = self.app.label_store.db_path if self.app.label_store and self.app.label_store.kind == "sqlite" else None
+        image_dir, labels_dir, class_names, recursive = self.app.image_dir, self.app.labels_dir, list(self.app.class_names), self.app.recursive
+        output = report_path(self.app.project_dir, image_dir)
+        job = {"result": None, "progress": (0, 0)}
+
+        def worker():
+            try:
+                report = lint_dataset(image_dir, labels_dir, class_names, recursive, progress=lambda done, total: job.__setitem__("progress", (done, total)), db_path=db_path)
+                save_report(report, output)
+                job["result"] = report
+            except Exception as e:
+                job["result"] = e
+
+        self.app.lint_job = job
+        threading.Thread(target=worker, name="DatasetLint", daemon=True).start()
+        self.app.after(200, self._poll_validation, job, output)
+
+    def _poll_validation(self, job, output):
+        if job["result"] is None:
+            done, total = job["progress"]
+            self.app.lint_button.configure(text=f"検証中... {done}/{total}" if total else "検証中...")
+            self.app.after(200, self._poll_validation, job, output); return
+        self.app.lint_job = None
+        self.app.lint_button.configure(text="データ検証")
+        report = job["result"]
+        if isinstance(report, Exception): self.app.log(f"エラー: データ検証に失敗しました。 {report}"); return
+        summary = format_summary(report)
+        self.app.log(f"データ検証完了: 問題 {len(report['issues'])}件 (レポート: {output})")
+        known = set(self.app.all_image_files)
+        flagged = [f for f in flagged_images(report) if f in known]
+        if not flagged: msgbox.showinfo("データ検証", f"{summary}\n\nレポート: {output}"); return
+        if msgbox.askyesno("データ検証", f"{summary}\n\nレポート: {output}\n\n問題のある画像 {len(flagged)}枚を修正モードで開きますか？"):
+            self.start_mode('correction', images=flagged)
+
+    def import_external_labels(self):
+        # COCO JSON / Pascal VOC のラベルを labels/ に取り込む (既存のラベルは上書きしない)
+        if not self.app.image_dir or self.app.import_job is not None: return
+        use_coco = msgbox.askyesnocancel("ラベルの取り込み", "COCO JSON を取り込みますか？\n(「いいえ」で Pascal VOC の XML フォルダ)")
+        if use_coco is None: return
+        source = filedialog.askopenfilename(title="COCO JSON を選択", filetypes=[("JSON", "*.json")]) if use_coco else filedialog.askdirectory(title="VOC の XML フォルダを選択")
+        if not source: return
+        add_classes = msgbox.askyesno("確認", "classes.yaml に無いクラスを追加しますか？\n(「いいえ」でそのクラスのボックスは取り込みません)")
+        status = "approved" if msgbox.askyesno("確認", "取り込んだ画像を承認済みにしますか？") else None
+        self.app.flush_io()
+        # SQLite にしか無いラベルを「未作成」と見なして上書きしないよう、先に txt へ書き出しておく
+        if self.app.label_store.kind == "sqlite": self.app.label_store.export_to_txt()
+        project_dir, image_dir, labels_dir, recursive = self.app.project_dir, self.app.image_dir, self.app.labels_dir, self.app.recursive
+        job = {"result": None, "progress": "read"}
+
+        def worker():
+            try: job["result"] = import_labels(project_dir, image_dir, labels_dir, source, "coco" if use_coco else "voc", add_classes=add_classes, recursive=recursive, progress=lambda step: job.__setitem__("progress", step))
+            except Exception as e: job["result"] = e
+
+        self.app.import_job = job
+        threading.Thread(target=worker, name="LabelImport", daemon=True).start()
+        self.app.after(200, self._poll_label_import, job, status)
+
+    def _poll_label_import(self, job, status):
+        if job["result"] is None:
+            self.app.import_button.configure(text={"read": "読み込み中...", "convert": "変換中...", "write": "書き込み中..."}.get(job["progress"], "取り込み中..."))
+            self.app.after(200, self._poll_label_import, job, status); return
+        self.app.import_job = None
+        self.app.import_button.configure(text="ラベルの取り込み")
+        report = job["result"]
+        if isinstance(report, Exception): self.app.log(f"エラー: ラベルの取り込みに失敗しました。 {report}"); return
+        if report["new_names"] != report["class_names"]:
+            self.app.class_names = load_class_names(self.app.project_dir) or report["new_names"]; self.app.build_class_picker()
+        for stem, size in report["written"].items():
+            self.app.total_label_size_cache += size - self.app.label_sizes.get(stem, 0); self.app.label_sizes[stem] = size
+        self.app.query_index = None
+        if status:
+            changed = apply_status(self.app.approval_status, report["images"], status)
+            if changed: self.app.approval_status.save()
+        # SQLite のプロジェクトでは書き出した txt を DB へ取り込む
+        if self.app.label_store.kind == "sqlite": self.start_label_store_import()
+        else: self.app.scan_cache_dirty = True; self.update_dashboard_stats()
+        self.app.log(f"ラベルの取り込み完了: {len(report['written'])}件 ({report['seconds']:.1f}秒)")
+        msgbox.showinfo("ラベルの取り込み", format_import_report(report))
+
+    def note_labels(self, stem, rows):
+        if self.app.query_index is not None: self.app.query_index.update_labels(stem, rows)
+
+    def note_status(self, filename, status):
+        if self.app.query_index is not None: self.app.query_index.set_status(filename, status)
+
+    def start_query_mode(self, mode):
+        # クエリに当てはまる画像だけでセッションを始める (索引が無ければバックグラウンドで作ってから)
+        text = self.app.query_entry.get().strip()
+        if not self.app.image_dir or not text or self.app.query_job is not None: return
+        if self.app.query_index is not None: self._run_query(mode, text); return
+        self.app.flush_io()
+        table_cache, preannotations, saved = index_paths(self.app.project_dir, self.app.image_dir)
+        keys, read_status = list(self.app.all_image_files), self.app.approval_status.reader()
+        labels_dir, recursive = self.app.labels_dir, self.app.recursive
+        db_path = self.app.label_store.db_path if self.app.label_store.kind == "sqlite" else None
+        job = {"result": None}
+
+        def worker():
+            try:
+                start = time.perf_counter()
+                table = analytics.table_from_columns(*load_label_columns(db_path)) if db_path else analytics.build_label_table(labels_dir, table_cache, recursive=recursive)[0]
+                job["result"] = (build_query_index(keys, table, read_status(), preannotations, saved), time.perf_counter() - start)
+            except Exception as e:
+                job["result"] = e
+
+        self.app.query_job = job
+        self.app.query_annotation_button.configure(text="索引を作成中..."); self.app.query_approval_button.configure(text="索引を作成中...")
+        threading.Thread(target=worker, name="QueryIndex", daemon=True).start()
+        self.app.after(100, self._poll_query_index, job, mode, text)
+
+    def _poll_query_index(self, job, mode, text):
+        if job["result"] is None: self.app.after(100, self._poll_query_index, job, mode, text); return
+        self.app.query_job = None
+        self.app.query_annotation_button.configure(text="クエリ結果をアノテーション"); self.app.query_approval_button.configure(text="クエリ結果を承認")
+        if isinstance(job["result"], Exception): self.app.log(f"エラー: クエリ用の索引を作成できませんでした。 {job['result']}"); return
+        self.app.query_index, seconds = job["result"]
+        self.app.log(f"クエリ用の索引を作成しました: {len(self.app.query_index.keys)}枚 ({seconds:.1f}秒)")
+        self._run_query(mode, text)
+
+    def _run_query(self, mode, text):
+        index = self.app.query_index
+        _, preannotations, _ = index_paths(self.app.project_dir, self.app.image_dir)
+        index.load_preannotations(preannotations)  # 前回以降に追記された自動アノテーションの記録
+        exclude = index.exclusion_mask(self.app.duplicate_of) if self.app.skip_duplicates_var.get() and self.app.duplicate_of else None
+        start = time.perf_counter()
+        try: images = index.query(text, self.app.class_names, exclude)
+        except ValueError as e: msgbox.showerror("クエリ", str(e)); return
+        self.app.log(f"クエリ「{text}」: {len(images)}枚 ({(time.perf_counter() - start) * 1000:.0f}ms)")
+        if not images: msgbox.showinfo("クエリ", "条件に当てはまる画像はありません。"); return
+        self.start_mode(mode, images=images)
+
+    def propagate_to_duplicates(self, filename, copy_labels=False, status=None):
+        # 代表画像のみ作業する設定のとき、ラベル・ステータスを同じクラスタの画像へ反映する
+        if not self.app.skip_duplicates_var.get(): return
+        members = self.app.duplicate_groups.get(filename)
+        if not members: return
+        copied = 0
+        for member in members:
+            if copy_labels:
+                stem = os.path.splitext(member)[0]
+                if stem in self.app.label_sizes: continue  # 個別に作成済みのラベルは上書きしない
+                size = self.app.label_store.copy(os.path.splitext(filename)[0], stem)
+                self.app.total_label_size_cache += size; self.app.label_sizes[stem] = size; copied += 1
+                if self.app.remote: self.app.remote.mark_dirty(stem)
+                self.note_labels(stem, self.app.label_store.read(stem, strict=False))
+            if status is not None: self.app.approval_status[member] = status; self.note_status(member, status); copied += 1
+        if copied: self.app.log(f"重複画像 {copied}件 に反映しました。")
+
+    def start_mode(self, mode, start_at=None, images=None):
         if not self.app.image_dir: return
         self.app.start_time = time.time()
         self.app.session_start_count = None 
-        target_images = []
-        if mode == 'annotation': target_images = self.app.all_image_files
-        elif mode == 'approval':
-            target_images = [f for f in self.app.all_image_files if os.path.exists(os.path.join(self.app.labels_dir, f"{os.path.splitext(f)[0]}.txt")) and self.app.approval_status.get(f) != "approved"]
-            if not target_images: msgbox.showinfo("案内", "未承認のアノテーション済み画像はありません。"); return
-        elif mode == 'correction':
-            target_images = [f for f in self.app.all_image_files if self.app.approval_status.get(f) == "rejected"]
-            if not target_images: msgbox.showinfo("案内", "修正が必要な画像(NG)はありません。"); return
-        elif mode == 'reapproval':
-            target_images = [f for f in self.app.all_image_files if self.app.approval_status.get(f) == "fixed"]
-            if not target_images: msgbox.showinfo("案内", "再承認待ち(Fixed)の画像はありません。"); return
+        sharing = self.app.share_work_var.get()
+        # 分担中は他のインスタンスが付けたステータスを取り込んでからキューを作る
+        if sharing and hasattr(self.app.approval_status, 'reload'): self.app.approval_status.reload()
+        predicate = self.shared_queue_predicate(mode) if sharing else self.queue_predicate(mode)
+        # images を渡した場合 (データ検証で見つかった画像など) はステータスに関係なくその画像だけを対象にする
+        if images is not None: known = set(self.app.all_image_files); target_images = [f for f in images if f in known]
+        else: target_images = [f for f in self.app.all_image_files if predicate(f)]
+        if start_at is not None and start_at not in target_images: target_images = sorted(target_images + [start_at])
+        empty_messages = {'approval': "未承認のアノテーション済み画像はありません。", 'correction': "修正が必要な画像(NG)はありません。", 'reapproval': "再承認待ち(Fixed)の画像はありません。"}
+        if not target_images and mode in empty_messages: msgbox.showinfo("案内", empty_messages[mode]); return
+        if sharing:
+            target_images = self.claim_work(([start_at] if start_at is not None else []) + target_images)
+            if not target_images: return
+            # 指定した画像を他のインスタンスが予約中なら、予約できた画像の先頭から始める
+            if start_at is not None and start_at not in target_images:
+                msgbox.showinfo("案内", f"{start_at} は他の作業者が予約中のため開けません。\n予約できた画像の先頭から始めます。"); start_at = None
 
         self.app.image_files = target_images
         image_dir_name = os.path.basename(os.path.normpath(self.app.image_dir))
@@ -100,11 +686,81 @@ class EventHandlers:
         log_filename = f"{timestamp}_{image_dir_name}_{mode}.log"
         self.app.log_file_path = os.path.join(self.app.project_dir, log_filename)
         session_path = os.path.join(self.app.project_dir, f".{image_dir_name}_session.json")
-        if os.path.exists(session_path):
+        if start_at is None and images is None and not sharing and os.path.exists(session_path):
             if msgbox.askyesno("作業再開", "前回のセッションデータがあります。復元しますか？"): self.load_project_session(session_path, mode); return
-        self.app.switch_to_main_ui(mode); self.app.current_image_index = 0
+        self.app.switch_to_main_ui(mode); self.app.current_image_index = target_images.index(start_at) if start_at is not None else 0
         self.app.load_image(); self.app.update_progress_display()
         self.app.log(f"モード開始: {mode} (対象: {len(target_images)}枚)")
+        if self.app.record_input_var.get(): self.start_input_recording()
+
+    def shared_queue_predicate(self, mode):
+        # 分担中のアノテーションモードは、まだラベルの無い画像だけを配る (他の人が済ませた画像を重ねて予約しない)
+        predicate = self.queue_predicate(mode)
+        if mode != 'annotation': return predicate
+        labels = self.app.label_sizes
+        return lambda f: os.path.splitext(f)[0] not in labels and predicate(f)
+
+    def claim_work(self, candidates):
+        # 他のインスタンスが予約していない画像をブロック単位で予約する
+        self.release_work_lease()
+        image_dir_name = os.path.basename(os.path.normpath(self.app.image_dir))
+        lease = WorkLease(self.app.project_dir, image_dir_name)
+        try: claimed = lease.claim(candidates)
+        except Exception as e: msgbox.showerror("エラー", f"作業の予約に失敗しました:\n{e}"); return []
+        if not claimed:
+            others = "\n".join(f"{user}@{host}: {count}枚" for user, host, count in lease.others())
+            msgbox.showinfo("案内", f"対象の画像はすべて他の作業者が予約中です。\n{others}"); return []
+        self.app.work_lease = lease
+        self.app.after(LEASE_HEARTBEAT_MS, self.heartbeat_work_lease, lease)
+        return sorted(claimed)
+
+    def claim_more_work(self):
+        # キューの最後まで進んだら、残りの画像から次のブロックを予約してキューに足す
+        lease = self.app.work_lease
+        if lease is None: return False
+        if hasattr(self.app.approval_status, 'reload'): self.app.approval_status.reload()
+        predicate = self.shared_queue_predicate(self.app.mode); queued = set(self.app.image_files)
+        try: added = lease.claim([f for f in self.app.all_image_files if f not in queued and predicate(f)])
+        except Exception as e: print(f"Work lease error: {e}"); return False
+        if added:
+            self.app.image_files.extend(added); self.app.update_progress_display()
+            self.app.log(f"次の作業ブロックを予約: {len(added)}枚")
+        return bool(added)
+
+    def heartbeat_work_lease(self, lease):
+        # 予約の期限を延長する。ファイル操作はI/Oスレッドで行う
+        if lease is not self.app.work_lease: return
+        self.app.io.submit(lease.path + "#" + lease.owner, lease.heartbeat, self._work_lease_error)
+        self.app.after(LEASE_HEARTBEAT_MS, self.heartbeat_work_lease, lease)
+
+    def release_work_lease(self):
+        lease, self.app.work_lease = self.app.work_lease, None
+        if lease is not None: self.app.io.submit(lease.path + "#" + lease.owner, lease.release, self._work_lease_error)
+
+    def _work_lease_error(self, result, error):
+        if error is not None: print(f"Work lease error: {error}")
+
+    def open_grid_review(self):
+        if not self.app.image_dir: return
+        if self.app.grid_window is not None and self.app.grid_window.winfo_exists(): self.app.grid_window.focus(); return
+        predicate = self.queue_predicate('approval')
+        target_images = [f for f in self.app.all_image_files if predicate(f)]
+        if not target_images: msgbox.showinfo("案内", "未承認のアノテーション済み画像はありません。"); return
+        self.app.grid_window = GridReviewWindow(self.app, target_images)
+        self.app.log(f"グリッドレビューを開始: {len(target_images)}枚")
+
+    def open_in_editor(self, filename):
+        # グリッドから1枚を選んで承認モードのエディタで開く
+        self.start_mode('approval', start_at=filename)
+
+    def set_statuses(self, filenames, status):
+        for filename in filenames:
+            self.app.approval_status[filename] = status; self.note_status(filename, status)
+            self.propagate_to_duplicates(filename, status=status)
+        with self.app.profiler.span("status_write"): self.app.approval_status.save()
+        labels = {"approved": "承認", "rejected": "却下"}
+        self.app.log(f"{len(filenames)}枚を{labels.get(status, status)}にしました")
+        if self.app.mode == 'start': self.update_dashboard_stats()
 
     def start_annotation_mode(self): self.start_mode('annotation')
     def start_approval_mode(self): self.start_mode('approval')
@@ -115,33 +771,48 @@ class EventHandlers:
         if self.app.current_image_index == -1: return
         img_w, img_h = self.app.current_image.size
         base_name = os.path.splitext(self.app.image_files[self.app.current_image_index])[0]
-        txt_path = os.path.join(self.app.labels_dir, f"{base_name}.txt")
+        filename = self.app.image_files[self.app.current_image_index]
+        sorted_boxes = sorted(self.app.boxes.values(), key=lambda b: (b['coords'][1], b['coords'][0]))
+        loaded, keys = self.app.loaded_label, [(*box['coords'], box['class_id']) for box in sorted_boxes]
+        if loaded is not None and sorted(keys) == loaded["keys"]:
+            # 読み込んだときから変わっていなければラベルは書き込まない (更新時刻もそのまま)
+            if self.app.box_propagator.enabled:
+                self.app.box_propagator.remember(filename, self.app.current_image, [(b['coords'], b['class_id']) for b in sorted_boxes])
+            # 修正モードで「このままで正しい」と確認した NG 画像は、変更が無くても修正済みにする
+            if self.app.mode == 'correction': self.mark_fixed(filename)
+            return
         
-        old_size = 0
-        if os.path.exists(txt_path):
-            old_size = os.path.getsize(txt_path)
-            
-        with open(txt_path, "w") as f:
-            sorted_boxes = sorted(self.app.boxes.values(), key=lambda b: (b['coords'][1], b['coords'][0]))
-            for box in sorted_boxes:
-                x1, y1, x2, y2, class_id = box['coords'] + [box['class_id']]
-                dw, dh = 1. / img_w, 1. / img_h
-                x_center, y_center = (x1 + x2) / 2.0, (y1 + y2) / 2.0
-                width, height = x2 - x1, y2 - y1
-                f.write(f"{class_id} {x_center*dw:.6f} {y_center*dh:.6f} {width*dw:.6f} {height*dh:.6f}\n")
+        rows = []
+        for x1, y1, x2, y2, class_id in keys:
+            # 動かしていないボックスは読み込んだ行をそのまま書き戻す (画素座標への丸めで値が変わらないように)
+            original = loaded["rows"].get((x1, y1, x2, y2, class_id)) if loaded is not None else None
+            if original is not None: rows.append(original); continue
+            dw, dh = 1. / img_w, 1. / img_h
+            x_center, y_center = (x1 + x2) / 2.0, (y1 + y2) / 2.0
+            width, height = x2 - x1, y2 - y1
+            rows.append((class_id, x_center*dw, y_center*dh, width*dw, height*dh))
+        with self.app.profiler.span("label_write"): new_size = self.app.label_store.write(base_name, rows)
         
-        new_size = os.path.getsize(txt_path)
-        if hasattr(self.app, 'total_label_size_cache'):
-            self.app.total_label_size_cache = self.app.total_label_size_cache - old_size + new_size
+        self.app.total_label_size_cache += new_size - self.app.label_sizes.get(base_name, 0)
+        self.app.label_sizes[base_name] = new_size
+        self.app.scan_cache_dirty = True
+        if self.app.remote: self.app.remote.mark_dirty(base_name)
+        self.note_labels(base_name, rows)
 
-        self.app.log(f"アノテーション保存: {txt_path}")
-        filename = self.app.image_files[self.app.current_image_index]
-        if self.app.approval_status.get(filename) == "rejected":
-             self.app.approval_status[filename] = "fixed"
-             save_status(self.app.status_file_path, self.app.approval_status)
-             self.app.update_info_labels()
+        self.app.log(f"アノテーション保存: {self.app.label_store.path(base_name)}")
+        self.app.loaded_label = {"rows": dict(zip(keys, rows)), "keys": sorted(keys)}
+        self.propagate_to_duplicates(filename, copy_labels=True)
+        if self.app.box_propagator.enabled:
+            self.app.box_propagator.remember(filename, self.app.current_image, [(b['coords'], b['class_id']) for b in sorted_boxes])
+        self.mark_fixed(filename)
         self.app.update_progress_display()
 
+    def mark_fixed(self, filename):
+        if self.app.approval_status.get(filename) != "rejected": return
+        self.app.approval_status[filename] = "fixed"; self.note_status(filename, "fixed")
+        with self.app.profiler.span("status_write"): self.app.approval_status.save()
+        self.app.update_info_labels(); self.app.update_progress_display()
+
     def save_and_next(self, _=None):
         if self.app.mode in ['annotation', 'correction']: self.save_annotations(); self.next_image()
     
@@ -149,8 +820,11 @@ class EventHandlers:
         if not self.app.project_dir or not self.app.image_dir: return
         image_dir_name = os.path.basename(os.path.normpath(self.app.image_dir))
         session_path = os.path.join(self.app.project_dir, f".{image_dir_name}_session.json")
-        session_data = { "project_dir": self.app.project_dir, "image_dir": self.app.image_dir, "labels_dir": self.app.labels_dir, "current_image_index": self.app.current_image_index, "boxes": self.app.boxes, "undo_stack": self.app.undo_stack, "redo_stack": self.app.redo_stack, "approval_status": self.app.approval_status, "options": { "line_width": self.app.box_line_width, "font_size": self.app.box_font_size, "log_lines": self.app.log_visible_lines, "target_count": self.app.target_count, "progress_style": self.app.progress_style } }
-        with open(session_path, 'w') as f: json.dump(session_data, f, indent=2)
+        # 承認ステータスはシャードファイルが正なので、セッションには作業位置と編集状態だけを保存する
+        current_image = self.app.image_files[self.app.current_image_index] if 0 <= self.app.current_image_index < len(self.app.image_files) else None
+        session_data = { "project_dir": self.app.project_dir, "image_dir": self.app.image_dir, "labels_dir": self.app.labels_dir, "recursive": self.app.recursive, "current_image_index": self.app.current_image_index, "current_image": current_image, "boxes": self.app.boxes, "undo_stack": self.app.undo_stack, "redo_stack": self.app.redo_stack, "options": { "line_width": self.app.box_line_width, "font_size": self.app.box_font_size, "log_lines": self.app.log_visible_lines, "target_count": self.app.target_count, "progress_style": self.app.progress_style, "class_mru": self.app.class_mru } }
+        with self.app.profiler.span("session_write"): self.app.io.write_text(session_path, json.dumps(session_data, indent=2))
+        self.save_scan_cache()
         if not silent: self.app.log(f"プロジェクトを途中保存しました: {session_path}")
 
     def load_project_session(self, session_path, mode):
@@ -159,22 +833,30 @@ class EventHandlers:
         self.app.current_image_index = data["current_image_index"]
         self.app.boxes = {int(k): v for k, v in data["boxes"].items()}
         self.app.undo_stack = data["undo_stack"]; self.app.redo_stack = data["redo_stack"]
-        self.app.approval_status = data.get("approval_status", data.get("annotation_status", {}))
+        legacy_status = data.get("approval_status", data.get("annotation_status"))
+        if legacy_status and not any(self.app.approval_status.counts().values()):
+            # 旧形式のセッション (ステータスを内包) からの移行
+            self.app.approval_status.update(legacy_status); self.app.approval_status.save()
         options = data.get("options", {})
         self.app.box_line_width = options.get("line_width", 2); self.app.box_font_size = options.get("font_size", 12)
         self.app.log_visible_lines = options.get("log_lines", 4); self.app.target_count = options.get("target_count", 0)
         self.app.progress_style = options.get("progress_style", "bar")
+        if "class_mru" in options: self.app.class_mru[:] = [i for i in options["class_mru"] if i < len(self.app.class_names)][:MRU_SIZE]
         self.app.switch_to_main_ui(mode)
+        # 複数フォルダのキューでは順序が変わりうるため、画像名で位置を復元する
+        if data.get("current_image") in self.app.image_files: self.app.current_image_index = self.app.image_files.index(data["current_image"])
         if self.app.current_image_index >= len(self.app.image_files): self.app.current_image_index = 0
         if mode in ['approval', 'reapproval'] and self.app.current_image_index == len(self.app.image_files) - 1: self.app.current_image_index = 0
         self.app.load_image(); self.app.update_progress_display()
         self.app.log(f"前回の作業状態を復元しました ({mode}): {session_path}")
+        if self.app.record_input_var.get(): self.start_input_recording()
 
     def prev_image(self):
         if self.app.current_image_index > 0: self.app.current_image_index -= 1; self.app.load_image()
 
     def next_image(self):
         if self.app.current_image_index < len(self.app.image_files) - 1: self.app.current_image_index += 1; self.app.load_image()
+        elif self.claim_more_work(): self.app.current_image_index += 1; self.app.load_image()
         else: msgbox.showinfo("案内", "これが最後の画像です。")
     
     def approve_annotation(self): self.update_status("approved"); self.save_project_session(silent=True); self.next_image()
@@ -183,32 +865,103 @@ class EventHandlers:
     def update_status(self, status):
         if self.app.current_image_index == -1: return
         filename = self.app.image_files[self.app.current_image_index]
-        self.app.approval_status[filename] = status
-        save_status(self.app.status_file_path, self.app.approval_status)
+        self.app.approval_status[filename] = status; self.note_status(filename, status)
+        self.propagate_to_duplicates(filename, status=status)
+        with self.app.profiler.span("status_write"): self.app.approval_status.save()
         self.app.update_info_labels()
 
     def export_approved_dataset(self):
         if not self.app.project_dir or not self.app.image_dir: msgbox.showerror("エラー", "プロジェクトと画像フォルダが選択されていません。"); return
         target_image_dir = self.app.image_dir; status_map = self.app.approval_status
-        if not status_map: msgbox.showwarning("警告", "ステータス情報が見つかりません。"); return
+        if not any(status_map.counts().values()): msgbox.showwarning("警告", "ステータス情報が見つかりません。"); return
         export_root = filedialog.askdirectory(title="エクスポート先のフォルダを作成・選択してください")
         if not export_root: return
+        excluded = set()
+        if self.app.duplicate_of and msgbox.askyesno("確認", f"重複画像 {len(self.app.duplicate_of)}枚 をエクスポートから除外しますか？"):
+            excluded = set(self.app.duplicate_of)
         dest_images_dir = os.path.join(export_root, "images"); dest_labels_dir = os.path.join(export_root, "labels")
         os.makedirs(dest_images_dir, exist_ok=True); os.makedirs(dest_labels_dir, exist_ok=True)
-        copy_count = 0; parent_dir = os.path.dirname(os.path.abspath(target_image_dir)); source_labels_dir = os.path.join(parent_dir, "labels") 
-        for filename, status in status_map.items():
-            if status == "approved":
-                src_img = os.path.join(target_image_dir, filename); dst_img = os.path.join(dest_images_dir, filename)
-                label_name = os.path.splitext(filename)[0] + ".txt"
-                src_label = os.path.join(source_labels_dir, label_name); dst_label = os.path.join(dest_labels_dir, label_name)
-                if os.path.exists(src_img) and os.path.exists(src_label):
-                    try: shutil.copy2(src_img, dst_img); shutil.copy2(src_label, dst_label); copy_count += 1
-                    except Exception as e: print(f"Error copying {filename}: {e}")
+        copy_count = 0; store = self.app.label_store
+        with self.app.profiler.span("export"):
+            # 名前順に処理し、同じ動画のフレームはシークせず順に読み進める
+            for filename in status_map.keys_with("approved"):
+                if filename not in excluded:
+                    src_img = os.path.join(target_image_dir, filename); dst_img = os.path.join(dest_images_dir, filename)
+                    stem = os.path.splitext(filename)[0]
+                    dst_label = os.path.join(dest_labels_dir, stem + ".txt")
+                    is_frame = split_frame_key(src_img) is not None
+                    if self.app.remote and store.exists(stem):
+                        try: self.app.remote.ensure(filename)
+                        except Exception as e: print(f"Error fetching {filename}: {e}")
+                    if (is_frame or os.path.exists(src_img)) and store.exists(stem):
+                        try:
+                            if '/' in filename:
+                                os.makedirs(os.path.dirname(dst_img), exist_ok=True); os.makedirs(os.path.dirname(dst_label), exist_ok=True)
+                            # 動画は承認済みのフレームだけを JPEG として書き出す
+                            if is_frame: open_source_image(src_img, self.app.frame_cache).save(dst_img, quality=95)
+                            else: shutil.copy2(src_img, dst_img)
+                            store.export_txt(stem, dst_label); copy_count += 1
+                        except Exception as e: print(f"Error copying {filename}: {e}")
         msgbox.showinfo("完了", f"エクスポートが完了しました。\n\n承認済み: {copy_count}件\n保存先: {export_root}")
         self.app.log(f"データセットのエクスポート完了: {copy_count}件 -> {export_root}")
     
+    def export_coco_dataset(self):
+        # 画像のコピーはせず、アノテーションだけを COCO JSON 1ファイルに書き出す (画像サイズは索引を使い回す)
+        if not self.app.project_dir or not self.app.image_dir or self.app.coco_job is not None: return
+        out_path = filedialog.asksaveasfilename(title="COCO JSON の保存先", defaultextension=".json", filetypes=[("JSON", "*.json")])
+        if not out_path: return
+        approved_only = msgbox.askyesno("確認", "承認済みの画像だけを書き出しますか？\n(「いいえ」でラベルのある画像すべて)")
+        excluded = set()
+        if self.app.duplicate_of and msgbox.askyesno("確認", f"重複画像 {len(self.app.duplicate_of)}枚 をエクスポートから除外しますか？"):
+            excluded = set(self.app.duplicate_of)
+        self.app.flush_io()
+        if self.app.label_store.kind == "sqlite": self.app.label_store.export_to_txt()
+        keys = select_images(self.app.all_image_files, self.app.approval_status, {"approved"} if approved_only else None, set(self.app.label_sizes), excluded)
+        image_dir, labels_dir, class_names, remote = self.app.image_dir, self.app.labels_dir, list(self.app.class_names), self.app.remote
+        index_path = size_index_path(self.app.project_dir, image_dir)
+        job = {"result": None, "progress": (0, 0)}
+
+        def worker():
+            try:
+                start = time.perf_counter()
+                index = ImageSizeIndex(index_path)
+                if remote is None: sizes = index.sizes(image_dir, keys)
+                else:
+                    # リモートは少しずつ取得してサイズを調べる (キャッシュの上限を超えて古いものが消されても索引は残る)
+                    sizes = {}
+                    for i in range(0, len(keys), 256):
+                        remote.fetch_many(keys[i:i + 256]); sizes.update(index.sizes(image_dir, keys[i:i + 256]))
+                index.save()
+                counts = export_coco(out_path, keys, sizes, lambda stem, store=TxtLabelStore(labels_dir): store.read(stem, strict=False), class_names, progress=lambda done, total: job.__setitem__("progress", (done, total)))
+                job["result"] = (*counts, time.perf_counter() - start)
+            except Exception as e:
+                job["result"] = e
+
+        self.app.coco_job = job
+        threading.Thread(target=worker, name="CocoExport", daemon=True).start()
+        self.app.after(200, self._poll_coco_export, job, out_path)
+
+    def _poll_coco_export(self, job, out_path):
+        if job["result"] is None:
+            done, total = job["progress"]
+            self.app.coco_export_button.configure(text=f"書き出し中... {done}/{total}" if total else "画像サイズを取得中...")
+            self.app.after(200, self._poll_coco_export, job, out_path); return
+        self.app.coco_job = None
+        self.app.coco_export_button.configure(text="COCO JSONでエクスポート")
+        if isinstance(job["result"], Exception): self.app.log(f"エラー: COCO エクスポートに失敗しました。 {job['result']}"); return
+        image_count, box_count, skipped, seconds = job["result"]
+        skipped_note = f"\nclasses.yaml に無いクラスIDのため読み飛ばしたボックス: {skipped}個" if skipped else ""
+        msgbox.showinfo("完了", f"COCO JSON を書き出しました。\n\n画像: {image_count}件 / ボックス: {box_count}個{skipped_note}\n保存先: {out_path}")
+        self.app.log(f"COCO エクスポート完了: {image_count}件 / {box_count}ボックス ({seconds:.1f}秒, {image_count / max(seconds, 1e-9):.0f} 枚/秒) -> {out_path}")
+
     def on_mouse_press(self, event):
         if self.app.mode in ['approval', 'reapproval']: return
+        if self.app.roi_mode:
+            # 再検出する領域のドラッグ開始 (既存ボックスの上からでも囲めるように選択判定より先に処理する)
+            self.app.mouse_state = 'roi'
+            self.app.start_x, self.app.start_y = event.x, event.y
+            self.app.temp_box_id = self.app.canvas.create_rectangle(event.x, event.y, event.x, event.y, outline="cyan", width=2, dash=(4, 2))
+            return
         
         # 既存ボックスの選択判定
         self.app.selected_box_id, self.app.selected_handle = self.app.find_selection(event.x, event.y)
@@ -285,6 +1038,9 @@ class EventHandlers:
         self.app.update_crosshair(event.x, event.y)
 
         if self.app.mode in ['approval', 'reapproval']: self.app.canvas.config(cursor=""); return
+        if self.app.mouse_state == 'roi':
+            if self.app.temp_box_id: self.app.canvas.coords(self.app.temp_box_id, min(self.app.start_x, event.x), min(self.app.start_y, event.y), max(self.app.start_x, event.x), max(self.app.start_y, event.y))
+            return
         
         # --- 描画中の線更新 ---
         if self.app.mouse_state == 'drawing':
@@ -337,6 +1093,14 @@ class EventHandlers:
             self.app.resize_box(self.app.selected_box_id, self.app.selected_handle, event.x, event.y)
 
     def on_mouse_release(self, event):
+        if self.app.mouse_state == 'roi':
+            if self.app.temp_box_id: self.app.canvas.delete(self.app.temp_box_id)
+            self.app.temp_box_id = None
+            region = (self.app.start_x, self.app.start_y, event.x, event.y)
+            self.app.mouse_state = 'idle'; self.app.start_x, self.app.start_y = None, None
+            self.toggle_roi_mode(False)
+            self.redetect_region(*region)
+            return
         if self.app.mouse_state in ['moving', 'resizing', 'rotating']:
             self.app.update_original_coords()
             self.app.mouse_state = 'idle'
@@ -351,13 +1115,36 @@ class EventHandlers:
         context_menu = tkinter.Menu(self.app.canvas, tearoff=0)
         class_submenu = tkinter.Menu(context_menu, tearoff=0)
         for i, name in enumerate(self.app.class_names):
-            class_submenu.add_command(label=name, command=lambda cid=i: self.change_class(box_id, cid))
+            class_submenu.add_command(label=name, command=lambda cid=i: self.menu_action("change_class", box_id, cid))
         context_menu.add_cascade(label="クラスを変更", menu=class_submenu)
         context_menu.add_separator()
-        context_menu.add_command(label="削除", command=lambda: self.delete_box(box_id))
+        context_menu.add_command(label="削除", command=lambda: self.menu_action("delete_box", box_id))
+        # 再生中はメニューを開かない (選んだ項目は記録から menu_action として流し直す)
+        if self.app.replaying: return
         try: context_menu.tk_popup(event.x_root, event.y_root)
         finally: context_menu.grab_release()
 
+    def menu_action(self, name, *args):
+        # 右クリックメニューの操作はキャンバスのイベントを経由しないので、記録中はここで残す
+        if self.app.input_recorder: self.app.input_recorder.call(name, args)
+        getattr(self, name)(*args)
+
+    def start_input_recording(self):
+        # セッションログと同じ名前の _input.jsonl に、今の画像から先の操作を記録する (再生は input_replay.py)
+        self.stop_input_recording()
+        if self.app.mode == 'start' or not self.app.log_file_path: return
+        path = (self.app.log_file_path[:-4] if self.app.log_file_path.endswith(".log") else self.app.log_file_path) + "_input.jsonl"
+        try: recorder = InputRecorder(path)
+        except OSError as e: self.app.log(f"エラー: 操作の記録を開始できません: {e}"); return
+        self.app.input_recorder = recorder; recorder.start(self.app)
+        self.app.log(f"操作の記録を開始しました: {path}")
+
+    def stop_input_recording(self):
+        recorder, self.app.input_recorder = self.app.input_recorder, None
+        if recorder is None: return
+        recorder.stop()
+        self.app.log(f"操作の記録を終了しました ({recorder.count}件): {recorder.path}")
+
     def change_class(self, box_id, new_class_id):
         self.app.record_history()
         self.app.boxes[box_id]['class_id'] = new_class_id
@@ -391,40 +1178,157 @@ class EventHandlers:
         self.app.log("やり直しました (Ctrl+Y)。")
 
     def load_image_from_index(self):
+        with self.app.profiler.span("load_image"): self._load_image_from_index()
+
+    def _load_image_from_index(self):
         if not (0 <= self.app.current_image_index < len(self.app.image_files)): return
         image_path = os.path.join(self.app.image_dir, self.app.image_files[self.app.current_image_index])
         base_name = os.path.splitext(self.app.image_files[self.app.current_image_index])[0]
-        txt_path = os.path.join(self.app.labels_dir, f"{base_name}.txt")
         self.app.log(f"表示中: {image_path}")
-        self.app.undo_stack.clear(); self.app.redo_stack.clear(); self.app.boxes = {}
-        if os.path.exists(txt_path): self.load_yolo_annotations(txt_path)
+        if self.app.remote:
+            # リモートの画像はキャッシュに取得してから開き、キューの先の数枚を並列に先読みする
+            idx = self.app.current_image_index
+            try:
+                with self.app.profiler.span("remote_fetch"): self.app.remote.ensure(self.app.image_files[idx])
+            except Exception as e: self.app.log(f"エラー: リモートの画像を取得できません: {e}"); return
+            self.app.remote.prefetch(self.app.image_files[idx:idx + REMOTE_PREFETCH])
+        self.app.undo_stack.clear(); self.app.redo_stack.clear(); self.app.boxes = {}; self.app.loaded_label = None
+        with self.app.profiler.span("label_parse"):
+            try: rows, clean = self.app.label_store.read(base_name), True
+            except (ValueError, IndexError):
+                rows, clean = self.app.label_store.read(base_name, strict=False), False
+                self.app.log("警告: ラベルに読めない行があります。読めた行だけを表示します (保存すると読めない行は削除されます)。")
+        if rows is not None:
+            self.load_yolo_annotations(rows, image_path)
+            # 読めない行があったファイルは、変更が無くても保存時に書き直す
+            if not clean: self.app.loaded_label = None
         else:
-            if self.app.mode == 'annotation': self.run_auto_annotation(image_path)
+            if self.app.mode == 'annotation' and not self.propagate_boxes(image_path):
+                with self.app.profiler.span("inference"): self.run_auto_annotation(image_path)
         self.app.undo_stack.append(copy.deepcopy(self.app.boxes))
         self.app.display_image_and_boxes(image_path); self.app.update_box_list_display()
 
-    def run_auto_annotation(self, image_path):
-        results = self.app.model(image_path, verbose=False)
+    def detect_boxes(self, image_path, confidences=None):
+        # 動画フレームはデコード済みの画像をそのまま推論に渡す。confidences (リスト) を渡すと各ボックスの確信度を追加する
+        source = open_source_image(image_path, self.app.frame_cache) if split_frame_key(image_path) else image_path
+        results = self.app.model(source, verbose=False)
+        detections = []
         for result in results:
             for box in result.boxes:
                 x1, y1, x2, y2 = map(int, box.xyxy[0]); class_id = int(box.cls[0])
                 if class_id < len(self.app.class_names):
-                    new_id = max(self.app.boxes.keys()) + 1 if self.app.boxes else 0
-                    self.app.boxes[new_id] = {'coords': [x1, y1, x2, y2], 'class_id': class_id, 'items': {}}
+                    detections.append(([x1, y1, x2, y2], class_id))
+                    if confidences is not None: confidences.append(round(float(box.conf[0]), 4))
+        return detections
+
+    def toggle_roi_mode(self, enabled=None):
+        # ボタン・キャンバスはメイン画面を作るまで存在しない (スタート画面での R キー)
+        if self.app.mode == 'start' or not hasattr(self.app, 'roi_button'): self.app.roi_mode = False; return
+        if self.app.mode not in ['annotation', 'correction'] or self.app.current_image is None: enabled = False
+        self.app.roi_mode = (not self.app.roi_mode) if enabled is None else enabled
+        self.app.roi_button.configure(text="領域をドラッグ (Esc)" if self.app.roi_mode else "領域を再検出 (R)")
+        self.app.canvas.config(cursor="crosshair" if self.app.roi_mode else "tcross")
+        if self.app.roi_mode: self.app.log("再検出する領域をドラッグで囲んでください (Esc で取り消し)。")
+
+    def redetect_region(self, dx1, dy1, dx2, dy2):
+        # 表示座標の領域を元画像の座標に直し、その範囲だけを推論して重複しない検出を追加する
+        model = self.app.model
+        if model is None: self.app.log("エラー: 推論モデルが読み込まれていません。"); return
+        img_w, img_h = self.app.current_image.size
+        sx, sy = img_w / self.app.resized_w, img_h / self.app.resized_h
+        region = (min(dx1, dx2) * sx, min(dy1, dy2) * sy, max(dx1, dx2) * sx, max(dy1, dy2) * sy)
+        with self.app.profiler.span("roi_inference"): detections = detect_region(model, self.app.current_image, region, len(self.app.class_names))
+        added = merge_detections([(box['coords'], box['class_id']) for box in self.app.boxes.values()], detections)
+        if added:
+            self.app.record_history()
+            new_id = max(self.app.boxes.keys()) + 1 if self.app.boxes else 0
+            for i, (coords, class_id, _) in enumerate(added):
+                self.app.boxes[new_id + i] = {'coords': coords, 'class_id': class_id, 'items': {}}
+            self.app.redraw_boxes(); self.app.update_box_list_display()
+        self.app.log(f"領域の再検出: 検出 {len(detections)}件 / 追加 {len(added)}件 ({int(region[2] - region[0])}x{int(region[3] - region[1])}px)")
+
+    def run_auto_annotation(self, image_path):
+        confidences = []
+        detections = self.detect_boxes(image_path, confidences)
+        for i, (coords, class_id) in enumerate(detections):
+            self.app.boxes[i] = {'coords': coords, 'class_id': class_id, 'items': {}}
+        self.record_preannotation(image_path, confidences)
+
+    def record_preannotation(self, image_path, confidences):
+        # どのモデルで自動アノテーションしたかを画像ごとに追記する (.<フォルダ名>_preannotations.jsonl)
+        image_dir_name = os.path.basename(os.path.normpath(self.app.image_dir))
+        key = os.path.relpath(image_path, self.app.image_dir).replace(os.sep, '/')
+        record = {"image": key, "model": self.app.model_pool.active, "boxes": len(confidences), "conf": confidences, "time": datetime.datetime.now().isoformat(timespec="seconds")}
+        if self.app.query_index is not None: self.app.query_index.record_preannotation(key, record["model"], confidences)
+        self.app.io.append_text(os.path.join(self.app.project_dir, f".{image_dir_name}_preannotations.jsonl"), json.dumps(record, ensure_ascii=False) + "\n")
+
+    def select_model_by_label(self, label):
+        for path in self.app.model_paths():
+            if model_label(path) == label: self.switch_model(path); return
+
+    def add_model(self):
+        path = filedialog.askopenfilename(title="推論モデル (.pt) を選択", filetypes=[("PyTorch weights", "*.pt"), ("All files", "*.*")])
+        if not path or self.app.model_registry is None: return
+        self.switch_model(self.app.model_registry.add(path))
+
+    def switch_model(self, path):
+        # 読み込み済みなら即座に切り替え、未読み込みならバックグラウンドで読み込む (その間は今のモデルで推論を続ける)
+        pool = self.app.model_pool
+        if pool.is_loaded(path): self._activate_model(path); return
+        self.app.log(f"モデルを読み込み中: {model_label(path)} (完了までは {model_label(pool.active)} で推論します)")
+        pool.warm(path)
+        self.app.after(200, self._poll_model_warmup, path)
+
+    def _poll_model_warmup(self, path):
+        pool = self.app.model_pool
+        if pool.is_loaded(path): self._activate_model(path); return
+        if path in pool.loading: self.app.after(200, self._poll_model_warmup, path); return
+        self.app.log(f"エラー: モデルを読み込めませんでした: {path} ({pool.errors.get(path)})")
+        self.app.update_model_menu()
+
+    def _activate_model(self, path):
+        pool = self.app.model_pool
+        try: pool.activate(path)
+        except Exception as e: self.app.log(f"エラー: モデルを切り替えられませんでした: {e}"); return
+        registry = self.app.model_registry
+        if registry is not None:
+            registry.active = path if path in registry.models else None
+            self.app.io.write_text(registry.path, registry.to_json())
+        loaded = ", ".join(f"{model_label(p)} ({format_bytes(size)})" for p, size in pool.loaded())
+        self.app.log(f"推論モデルを切り替えました: {model_label(path)} / 読み込み済み: {loaded}")
+        self.app.update_model_menu()
+
+    def propagate_boxes(self, image_path):
+        # 直前の画像 (キュー上で1つ前) を保存済みなら、そのボックスを追跡して引き継ぐ
+        tracker = self.app.box_propagator
+        index = self.app.current_image_index
+        if not tracker.enabled or tracker.last is None or index == 0 or self.app.image_files[index - 1] != tracker.last[0]: return False
+        image = open_source_image(image_path, self.app.frame_cache)
+        with self.app.profiler.span("tracking"): tracked, need_detection = tracker.track(image)
+        if need_detection:
+            confidences = []
+            with self.app.profiler.span("inference"): detections = self.detect_boxes(image_path, confidences)
+            boxes = tracker.merge(tracked, detections)
+            self.record_preannotation(image_path, confidences)
+        else:
+            boxes = [(coords, class_id) for coords, class_id, _ in tracked]
+        for i, (coords, class_id) in enumerate(boxes):
+            self.app.boxes[i] = {'coords': coords, 'class_id': class_id, 'items': {}}
+        self.app.log(f"前の画像から {len(tracked)}個 のボックスを引き継ぎました{' (推論で補正)' if need_detection else ''}")
+        return True
     
-    def load_yolo_annotations(self, txt_path):
-        from PIL import Image
-        try:
-            image_filename = os.path.basename(txt_path).replace('.txt', '')
-            img_path = next(p for ext in ['.jpg', '.png', '.jpeg'] if os.path.exists(p := os.path.join(self.app.image_dir, f"{image_filename}{ext}")))
-            img_w, img_h = Image.open(img_path).size
-        except StopIteration: return
-        with open(txt_path, 'r') as f:
-            for i, line in enumerate(f):
-                parts = line.strip().split(); class_id = int(parts[0])
-                x_center, y_center, width, height = map(float, parts[1:])
-                x_center_abs, width_abs = x_center * img_w, width * img_w
-                y_center_abs, height_abs = y_center * img_h, height * img_h
-                x1 = int(x_center_abs - width_abs / 2); y1 = int(y_center_abs - height_abs / 2)
-                x2 = int(x_center_abs + width_abs / 2); y2 = int(y_center_abs + height_abs / 2)
-                self.app.boxes[i] = {'coords': [x1, y1, x2, y2], 'class_id': class_id, 'items': {}}
\ No newline at end of file
+    def load_yolo_annotations(self, rows, img_path):
+        # rows: ラベルストアから読んだ [(class_id, x_center, y_center, width, height), ...] (正規化座標)
+        # 読み込んだ時点のボックス (画素座標とクラス) と元の行を覚えておき、保存時に変更の有無を判定する
+        img_w, img_h = open_source_image(img_path, self.app.frame_cache).size
+        loaded = {}
+        for i, row in enumerate(rows):
+            class_id, x_center, y_center, width, height = row
+            x_center_abs, width_abs = x_center * img_w, width * img_w
+            y_center_abs, height_abs = y_center * img_h, height * img_h
+            # 切り捨てだと読み込み・保存のたびに左上へずれるので、最も近い画素に丸める
+            x1 = round(x_center_abs - width_abs / 2); y1 = round(y_center_abs - height_abs / 2)
+            x2 = round(x_center_abs + width_abs / 2); y2 = round(y_center_abs + height_abs / 2)
+            self.app.boxes[i] = {'coords': [x1, y1, x2, y2], 'class_id': class_id, 'items': {}}
+            loaded[(x1, y1, x2, y2, class_id)] = tuple(row)
+        self.app.loaded_label = {"rows": loaded, "keys": sorted((*box['coords'], box['class_id']) for box in self.app.boxes.values())}
\ No newline at end of file
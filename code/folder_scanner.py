@@ -0,0 +1,129 @@
+# folder_scanner.py
+import os
+import json
+import queue
+import threading
+from video_source import is_video, probe_frame_count, expand_video
+
+SCAN_CACHE_VERSION = 2
+
+def _dir_mtime(path):
+    try: return os.stat(path).st_mtime_ns
+    except OSError: return None
+
+def _dirs_unchanged(root, dir_mtimes):
+    # 記録した全ディレクトリの mtime が一致すること (サブフォルダの追加は親の mtime が変わるので検出できる)
+    if not dir_mtimes: return False
+    return all(_dir_mtime(os.path.join(root, rel) if rel else root) == mtime for rel, mtime in dir_mtimes.items())
+
+def load_scan_cache(cache_path, image_dir, labels_dir, recursive=False):
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f: data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("version") != SCAN_CACHE_VERSION or data.get("recursive", False) != recursive: return None
+    if data.get("image_dir") != os.path.abspath(image_dir) or data.get("labels_dir") != os.path.abspath(labels_dir): return None
+    if not _dirs_unchanged(image_dir, data.get("image_dirs")) or not _dirs_unchanged(labels_dir, data.get("label_dirs")): return None
+    return data.get("images", {}), data.get("labels", {}), data.get("image_dirs", {}), data.get("label_dirs", {})
+
+def save_scan_cache(cache_path, image_dir, labels_dir, image_sizes, label_sizes, image_dirs, label_dirs, recursive=False):
+    # 保存時点の mtime を記録し直す (作業中の変更は監視・保存処理でメモリ上に反映済み)
+    data = {"version": SCAN_CACHE_VERSION, "recursive": recursive, "image_dir": os.path.abspath(image_dir), "labels_dir": os.path.abspath(labels_dir),
+            "image_dirs": {rel: _dir_mtime(os.path.join(image_dir, rel) if rel else image_dir) for rel in image_dirs},
+            "label_dirs": {rel: _dir_mtime(os.path.join(labels_dir, rel) if rel else labels_dir) for rel in label_dirs},
+            "images": image_sizes, "labels": label_sizes}
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp_path, cache_path)
+
+def iter_tree(root, recursive, cancel_event=None):
+    # (相対ディレクトリ, DirEntryのリスト) を返す。相対パスの区切りは常に '/'
+    stack = [""]
+    while stack:
+        if cancel_event is not None and cancel_event.is_set(): return
+        rel = stack.pop()
+        try:
+            with os.scandir(os.path.join(root, rel) if rel else root) as it: entries = list(it)
+        except OSError:
+            continue
+        files = []
+        for entry in entries:
+            if entry.name.startswith('.'): continue
+            if entry.is_dir(follow_symlinks=False):
+                if recursive: stack.append(f"{rel}/{entry.name}" if rel else entry.name)
+            else:
+                files.append(entry)
+        yield rel, files
+
+class FolderScanner:
+    # メッセージ: ("label_names", [stem, ...]) / ("images", [(name, size), ...]) / ("label_sizes", [(stem, size), ...])
+    #            ("dirs", (image_dirs, label_dirs)) / ("done", None) / ("error", msg)
+    # name / stem はルートからの相対パス ("sub/a.jpg", "sub/a")。動画はフレームごとのキー ("sub/clip.mp4/000000.jpg") に展開する
+    def __init__(self, image_dir, labels_dir, image_extensions, recursive=False, batch_size=2000):
+        self.image_dir, self.labels_dir = image_dir, labels_dir
+        self.image_extensions = image_extensions
+        self.recursive = recursive
+        self.batch_size = batch_size
+        self.messages = queue.Queue()
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="FolderScanner", daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def drain(self, limit=100):
+        items = []
+        try:
+            while len(items) < limit: items.append(self.messages.get_nowait())
+        except queue.Empty:
+            pass
+        return items
+
+    def _run(self):
+        try:
+            # 1) ラベル: 名前だけ先に取得 (stat不要なので高速) → アノテーション済み判定に使う
+            label_entries, label_dirs = [], []
+            if os.path.isdir(self.labels_dir):
+                for rel, files in iter_tree(self.labels_dir, self.recursive, self._cancel):
+                    label_dirs.append(rel)
+                    prefix = f"{rel}/" if rel else ""
+                    label_entries.extend((prefix + e.name[:-4], e) for e in files if e.name.endswith(".txt"))
+            self.messages.put(("label_names", [stem for stem, _ in label_entries]))
+
+            # 2) 画像: 各ディレクトリ1回の scandir で名前とサイズをバッチ送信
+            batch, image_dirs = [], []
+            for rel, files in iter_tree(self.image_dir, self.recursive, self._cancel):
+                image_dirs.append(rel)
+                prefix = f"{rel}/" if rel else ""
+                for entry in files:
+                    if self._cancel.is_set(): return
+                    if not entry.name.lower().endswith(self.image_extensions): continue
+                    try:
+                        if is_video(entry.name): batch.extend(expand_video(prefix + entry.name, entry.stat().st_size, probe_frame_count(entry.path)))
+                        else: batch.append((prefix + entry.name, entry.stat().st_size))
+                    except OSError: continue
+                    if len(batch) >= self.batch_size:
+                        self.messages.put(("images", batch)); batch = []
+            if batch: self.messages.put(("images", batch))
+
+            # 3) ラベルサイズ: 1) の DirEntry を再利用
+            batch = []
+            for stem, entry in label_entries:
+                if self._cancel.is_set(): return
+                try: batch.append((stem, entry.stat().st_size))
+                except OSError: continue
+                if len(batch) >= self.batch_size:
+                    self.messages.put(("label_sizes", batch)); batch = []
+            if batch: self.messages.put(("label_sizes", batch))
+            self.messages.put(("dirs", (image_dirs, label_dirs)))
+            self.messages.put(("done", None))
+        except Exception as e:
+            self.messages.put(("error", str(e)))
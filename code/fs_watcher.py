@@ -0,0 +1,162 @@
+# fs_watcher.py
+import os
+import sys
+import queue
+import struct
+import select
+import threading
+import ctypes
+import ctypes.util
+from folder_scanner import iter_tree
+
+# inotify 定数 (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CREATE = 0x00000100
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct("iIII")
+
+# 監視イベント: (kind, tag, name, size)  kind は "modified" / "deleted"
+# name はルートからの相対パス ('/' 区切り)。追加か変更かは受け取り側が既知のファイル一覧と突き合わせて判断する
+
+def _load_libc():
+    if not sys.platform.startswith("linux"): return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1; libc.inotify_add_watch
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+class FolderWatcher:
+    def __init__(self, targets, poll_interval=2.0, force_polling=False, recursive=False):
+        # targets: [(tag, ディレクトリ, 対象拡張子のタプル), ...]
+        self.targets = [(tag, os.path.abspath(path), tuple(s.lower() for s in suffixes)) for tag, path, suffixes in targets if path and os.path.isdir(path)]
+        self.recursive = recursive
+        self.poll_interval = poll_interval
+        self.events = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self._libc = None if force_polling else _load_libc()
+        self._known = {}  # inotify: tag -> 通知済みのファイル名 (キューあふれ時に削除を検出するため)
+        self.backend = "inotify" if self._libc else "polling"
+
+    def start(self):
+        if self._thread or not self.targets: return
+        target = self._run_inotify if self._libc else self._run_polling
+        self._thread = threading.Thread(target=target, name="FolderWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread: self._thread.join(timeout=2.0)
+        self._thread = None
+
+    def drain(self, limit=5000):
+        items = []
+        try:
+            while len(items) < limit: items.append(self.events.get_nowait())
+        except queue.Empty:
+            pass
+        return items
+
+    def _matches(self, name, suffixes):
+        return not name.startswith('.') and name.lower().endswith(suffixes)
+
+    def _put(self, kind, tag, name, size):
+        known = self._known.get(tag)
+        if known is not None:
+            if kind == "deleted": known.discard(name)
+            else: known.add(name)
+        self.events.put((kind, tag, name, size))
+
+    def _emit_current(self, tag, root, rel):
+        try: self._put("modified", tag, rel, os.stat(os.path.join(root, rel)).st_size)
+        except FileNotFoundError: self._put("deleted", tag, rel, None)
+        except OSError: pass
+
+    def _snapshot(self, root, suffixes, start=""):
+        result = {}
+        for rel_dir, files in iter_tree(os.path.join(root, start) if start else root, self.recursive):
+            rel_dir = "/".join(p for p in (start, rel_dir) if p)
+            prefix = f"{rel_dir}/" if rel_dir else ""
+            for entry in files:
+                if not self._matches(entry.name, suffixes): continue
+                try:
+                    st = entry.stat()
+                    result[prefix + entry.name] = (st.st_mtime_ns, st.st_size)
+                except OSError: pass
+        return result
+
+    def _run_polling(self):
+        snapshots = {tag: self._snapshot(path, suffixes) for tag, path, suffixes in self.targets}
+        while not self._stop.wait(self.poll_interval):
+            for tag, path, suffixes in self.targets:
+                before, after = snapshots[tag], self._snapshot(path, suffixes)
+                for name, sig in after.items():
+                    if before.get(name) != sig: self.events.put(("modified", tag, name, sig[1]))
+                for name in before.keys() - after.keys():
+                    self.events.put(("deleted", tag, name, None))
+                snapshots[tag] = after
+
+    def _run_inotify(self):
+        libc = self._libc
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            self.backend = "polling"; self._run_polling(); return
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_DELETE_SELF | (IN_CREATE if self.recursive else 0)
+        watches = {}
+
+        def add_watches(tag, root, suffixes, start=""):
+            # inotify はディレクトリ単位なので、再帰モードではサブフォルダごとに登録する
+            for rel_dir, _ in iter_tree(os.path.join(root, start) if start else root, self.recursive):
+                rel_dir = "/".join(p for p in (start, rel_dir) if p)
+                wd = libc.inotify_add_watch(fd, os.fsencode(os.path.join(root, rel_dir) if rel_dir else root), mask)
+                if wd >= 0: watches[wd] = (tag, root, rel_dir, suffixes)
+
+        for tag, path, suffixes in self.targets:
+            add_watches(tag, path, suffixes); self._known[tag] = set(self._snapshot(path, suffixes))
+        if not watches:
+            os.close(fd); self.backend = "polling"; self._run_polling(); return
+        try:
+            while not self._stop.is_set():
+                ready, _, _ = select.select([fd], [], [], 0.5)
+                if not ready: continue
+                try: data = os.read(fd, 64 * 1024)
+                except BlockingIOError: continue
+                offset = 0
+                while offset + _EVENT_HEADER.size <= len(data):
+                    wd, ev_mask, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+                    offset += _EVENT_HEADER.size
+                    name = os.fsdecode(data[offset:offset + name_len].rstrip(b"\0"))
+                    offset += name_len
+                    if ev_mask & IN_Q_OVERFLOW:
+                        # キューあふれ時は全件を再確認し、取りこぼした削除は既知の一覧との差分で通知する
+                        for tag, path, suffixes in self.targets:
+                            current = self._snapshot(path, suffixes)
+                            for n in self._known[tag] - current.keys(): self._put("deleted", tag, n, None)
+                            for n, sig in current.items(): self._put("modified", tag, n, sig[1])
+                        continue
+                    if ev_mask & IN_IGNORED: watches.pop(wd, None); continue
+                    if wd not in watches or not name: continue
+                    tag, root, rel_dir, suffixes = watches[wd]
+                    rel = f"{rel_dir}/{name}" if rel_dir else name
+                    if ev_mask & IN_ISDIR:
+                        # 新しいサブフォルダは監視に加え、すでに入っているファイルも通知する
+                        if self.recursive and ev_mask & (IN_CREATE | IN_MOVED_TO) and not name.startswith('.'):
+                            add_watches(tag, root, suffixes, rel)
+                            for n, sig in self._snapshot(root, suffixes, rel).items(): self._put("modified", tag, n, sig[1])
+                        continue
+                    if ev_mask & IN_CREATE or not self._matches(name, suffixes): continue
+                    if ev_mask & (IN_DELETE | IN_MOVED_FROM): self._put("deleted", tag, rel, None)
+                    else: self._emit_current(tag, root, rel)
+        finally:
+            os.close(fd)
@@ -0,0 +1,150 @@
+# grid_review.py
+import os
+import queue
+import threading
+import tkinter
+import customtkinter as ctk
+from PIL import Image, ImageTk
+from thumbnail_cache import ThumbnailCache
+
+STATUS_COLORS = {"approved": "#2FA572", "rejected": "#E04040", "fixed": "#E5A000"}
+
+class GridReviewWindow(ctk.CTkToplevel):
+    # サムネイルを cols x rows のページで並べ、複数選択してまとめて承認・却下する
+    def __init__(self, app, filenames, cols=6, rows=4):
+        super().__init__(app)
+        self.app, self.filenames, self.cols, self.rows = app, filenames, cols, rows
+        self.page, self.selected = 0, set()
+        image_dir_name = os.path.basename(os.path.normpath(app.image_dir))
+        self.cache = ThumbnailCache(os.path.join(app.project_dir, f".{image_dir_name}_thumbs"))
+        self.cell_w, self.cell_h = self.cache.size[0] + 12, self.cache.size[1] + 30
+        self.photos, self.ready = {}, queue.Queue()
+        self.job_cancel = threading.Event()
+
+        self.title("グリッドレビュー")
+        self.geometry(f"{self.cols * self.cell_w + 20}x{self.rows * self.cell_h + 110}")
+        self.transient(app)
+        font = ctk.CTkFont(family=app.font_family)
+
+        bar = ctk.CTkFrame(self, fg_color="transparent"); bar.pack(fill="x", padx=10, pady=(10, 5))
+        ctk.CTkButton(bar, text="<< 前[←]", width=80, command=lambda: self.show_page(self.page - 1), font=font).pack(side="left")
+        self.page_label = ctk.CTkLabel(bar, text="", width=160, font=font); self.page_label.pack(side="left", padx=5)
+        ctk.CTkButton(bar, text="次[→] >>", width=80, command=lambda: self.show_page(self.page + 1), font=font).pack(side="left")
+        ctk.CTkButton(bar, text="閉じる", width=80, fg_color="gray", command=self.close, font=font).pack(side="right")
+        ctk.CTkButton(bar, text="未判定を承認して次へ[Enter]", command=self.approve_rest_and_next, fg_color="#2FA572", hover_color="#23845A", font=font).pack(side="right", padx=5)
+        ctk.CTkButton(bar, text="選択を却下[R]", width=110, command=lambda: self.set_selected("rejected"), fg_color="#E04040", hover_color="#B03030", font=font).pack(side="right", padx=5)
+        ctk.CTkButton(bar, text="選択を承認[A]", width=110, command=lambda: self.set_selected("approved"), font=font).pack(side="right", padx=5)
+
+        self.canvas = tkinter.Canvas(self, width=self.cols * self.cell_w, height=self.rows * self.cell_h, bg="#2B2B2B", highlightthickness=0)
+        self.canvas.pack(padx=10, pady=5)
+        ctk.CTkLabel(self, text="クリック: 選択/解除  Ctrl+A: 全選択  ダブルクリック: エディタで開く", text_color="gray", font=font).pack(pady=(0, 5))
+
+        self.canvas.bind("<Button-1>", self.on_click)
+        self.canvas.bind("<Double-Button-1>", self.on_double_click)
+        self.bind("<Left>", lambda e: self.show_page(self.page - 1)); self.bind("<Right>", lambda e: self.show_page(self.page + 1))
+        self.bind("<Control-a>", lambda e: self.select_all())
+        self.bind("<a>", lambda e: self.set_selected("approved")); self.bind("<r>", lambda e: self.set_selected("rejected"))
+        self.bind("<Return>", lambda e: self.approve_rest_and_next()); self.bind("<Escape>", lambda e: self.close())
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.show_page(0)
+        self.after(50, self.poll_thumbnails)
+        self.focus()
+
+    @property
+    def page_count(self):
+        return max(1, -(-len(self.filenames) // (self.cols * self.rows)))
+
+    def page_items(self, page):
+        per_page = self.cols * self.rows
+        return self.filenames[page * per_page:(page + 1) * per_page]
+
+    def show_page(self, page):
+        if not 0 <= page < self.page_count: return
+        self.page, self.selected = page, set()
+        self.photos.clear()
+        self.page_label.configure(text=f"{page + 1} / {self.page_count} ページ ({len(self.filenames)}枚)")
+        self.redraw()
+        # 表示中のページと次のページをバックグラウンドで生成 (キャッシュ済みなら読み込むだけ)
+        self.job_cancel.set(); self.job_cancel = threading.Event()
+        jobs = self._jobs(self.page_items(page)) + self._jobs(self.page_items(page + 1))
+        cancel, cache, frame_cache, colors = self.job_cancel, self.cache, self.app.frame_cache, self.app.get_color_for_class
+
+        def worker():
+            cache.generate(jobs, frame_cache, colors, cancel_event=cancel, on_ready=lambda key, path: self.ready.put((key, path)))
+            try: cache.save()
+            except OSError as e: print(f"Thumbnail index writing error: {e}")
+
+        threading.Thread(target=worker, name="ThumbnailGenerator", daemon=True).start()
+
+    def _jobs(self, filenames):
+        # ラベルの読み出しはメインスレッドで行う (SQLiteの接続・書き込み待ちの内容を参照するため)
+        store = self.app.label_store
+        return [(f, os.path.join(self.app.image_dir, f), store.read(os.path.splitext(f)[0])) for f in filenames]
+
+    def poll_thumbnails(self):
+        if not self.winfo_exists(): return
+        visible = set(self.page_items(self.page)); updated = False
+        try:
+            while True:
+                key, path = self.ready.get_nowait()
+                if key in visible and path:
+                    with Image.open(path) as img: self.photos[key] = ImageTk.PhotoImage(img)
+                    updated = True
+        except queue.Empty:
+            pass
+        if updated: self.redraw()
+        self.after(50, self.poll_thumbnails)
+
+    def redraw(self):
+        self.canvas.delete("all")
+        status = self.app.approval_status
+        for i, filename in enumerate(self.page_items(self.page)):
+            x, y = (i % self.cols) * self.cell_w, (i // self.cols) * self.cell_h
+            cx, cy = x + self.cell_w // 2, y + 6 + self.cache.size[1] // 2
+            if filename in self.photos: self.canvas.create_image(cx, cy, image=self.photos[filename])
+            else: self.canvas.create_text(cx, cy, text="読み込み中...", fill="gray")
+            state = status.get(filename)
+            outline = "#3B8ED0" if filename in self.selected else STATUS_COLORS.get(state, "#444444")
+            self.canvas.create_rectangle(x + 3, y + 3, x + self.cell_w - 3, y + self.cell_h - 3, outline=outline, width=4 if filename in self.selected or state else 1)
+            label = os.path.basename(filename) if len(os.path.basename(filename)) <= 28 else "…" + os.path.basename(filename)[-27:]
+            self.canvas.create_text(x + self.cell_w // 2, y + self.cell_h - 14, text=label, fill=STATUS_COLORS.get(state, "white"))
+
+    def _hit(self, event):
+        col, row = event.x // self.cell_w, event.y // self.cell_h
+        if col >= self.cols or row >= self.rows: return None
+        items = self.page_items(self.page); i = row * self.cols + col
+        return items[i] if i < len(items) else None
+
+    def on_click(self, event):
+        filename = self._hit(event)
+        if filename is None: return
+        self.selected ^= {filename}; self.redraw()
+
+    def on_double_click(self, event):
+        filename = self._hit(event)
+        if filename is None: return
+        self.close(); self.app.events.open_in_editor(filename)
+
+    def select_all(self):
+        items = set(self.page_items(self.page))
+        self.selected = set() if self.selected >= items else items
+        self.redraw()
+
+    def set_selected(self, status):
+        if not self.selected: return
+        self.app.events.set_statuses(sorted(self.selected), status)
+        self.selected = set(); self.redraw()
+
+    def approve_rest_and_next(self):
+        # 却下したもの以外 (未判定) をまとめて承認し、次のページへ
+        status = self.app.approval_status
+        rest = [f for f in self.page_items(self.page) if status.get(f) not in ("approved", "rejected")]
+        if rest: self.app.events.set_statuses(rest, "approved")
+        if self.page + 1 < self.page_count: self.show_page(self.page + 1)
+        else: self.redraw()
+
+    def close(self):
+        self.job_cancel.set()
+        self.app.grid_window = None
+        self.destroy()
@@ -0,0 +1,258 @@
+# input_replay.py
+# 作業中のキャンバス・キーボード操作を記録し、同じハンドラーへ流し直して1操作ごとの処理時間を計測する
+# 記録: オプション設定の「操作を記録」を有効にすると、モード開始時からセッションログと同じ名前の _input.jsonl に書き出す
+# 再生: python input_replay.py <記録.jsonl> [--realtime] [--csv timing.csv] [--trace trace.json] [--model best.pt]
+#   画面が無い環境 (CI など) では Xvfb があれば仮想ディスプレイを起動して実行する (xvfb-run から起動してもよい)
+#   ラベル・ステータスは一時フォルダに複製して再生するので、元のプロジェクトは書き換えない
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from collections import deque
+
+RECORD_VERSION = 1
+MOUSE_SEQUENCES = ("<ButtonPress-1>", "<Motion>", "<ButtonRelease-1>", "<Button-3>")
+BUTTON1_MASK = 0x100
+
+class InputRecorder:
+    # キャンバスのマウス操作とショートカットキー、クラス選択ダイアログの回答、右クリックメニューの操作を時刻付きで記録する
+    # 既存のバインドには add="+" で後ろに足すだけなので、元の処理の順番・内容は変わらない
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w', encoding='utf-8', buffering=1024 * 1024)
+        self.origin = time.perf_counter()
+        self.count = 0
+        self.seen = set()  # ラベルを記録済みの画像
+        self.app, self.bindings = None, []
+
+    def write(self, record):
+        record["t"] = round(time.perf_counter() - self.origin, 4)
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n"); self.count += 1
+
+    def start(self, app):
+        # 開始時の状態 (表示中の画像・キュー・ボックス・関係する設定) を先頭に書く
+        self.app = app
+        key = app.image_files[app.current_image_index] if 0 <= app.current_image_index < len(app.image_files) else None
+        canvas = (app.canvas.winfo_width(), app.canvas.winfo_height())
+        statuses = {}
+        for f in app.image_files:
+            status = app.approval_status.get(f)
+            if status: statuses[f] = status
+        self.write({"type": "start", "version": RECORD_VERSION, "project_dir": app.project_dir, "image_dir": app.image_dir, "class_names": list(app.class_names),
+                    "model": app.model_pool.active, "mode": app.mode, "queue": list(app.image_files), "current": key, "recursive": app.recursive,
+                    "propagate": [app.box_propagator.enabled, app.box_propagator.detect_interval], "geometry": app.geometry(), "canvas": canvas,
+                    "statuses": statuses, "boxes": [[box['coords'], box['class_id']] for box in app.boxes.values()]})
+        if key is not None: self.note_image(key)
+        # 終了時に元へ戻せるよう、足す前のバインド (Tcl のスクリプト) を控えておく
+        for sequence in MOUSE_SEQUENCES:
+            previous = app.canvas.bind(sequence)
+            self.bindings.append((app.canvas, app.canvas._w, sequence, previous, app.canvas.bind(sequence, lambda e, s=sequence: self.on_mouse(s, e), add="+")))
+        # ショートカットはルートに個別のキーでバインドされているので、別のタグ (all) でまとめて拾う
+        previous = app.bind_all("<KeyPress>")
+        self.bindings.append((app, "all", "<KeyPress>", previous, app.bind_all("<KeyPress>", self.on_key, add="+")))
+        # クラス選択ダイアログ・画像の読み込みはインスタンス属性で差し替える (呼び出し側はどちらも self.app.xxx 経由)
+        original_ask, original_load = app.ask_class, app.events.load_image_from_index
+
+        def ask_class():
+            class_id = original_ask()
+            self.write({"type": "answer", "value": class_id})
+            return class_id
+
+        def load_image_from_index():
+            if 0 <= app.current_image_index < len(app.image_files): self.note_image(app.image_files[app.current_image_index])
+            return original_load()
+
+        app.ask_class, app.events.load_image_from_index = ask_class, load_image_from_index
+
+    def note_image(self, key):
+        # 初めて表示する画像は、その時点のラベルファイルの中身も残す (再生時はこれを一時フォルダに書いてから始める)
+        if key in self.seen: return
+        self.seen.add(key)
+        rows = self.app.label_store.read(os.path.splitext(key)[0], strict=False)
+        self.write({"type": "image", "key": key, "rows": [list(row) for row in rows] if rows is not None else None})
+
+    def on_mouse(self, sequence, event):
+        self.write({"type": "mouse", "seq": sequence, "x": event.x, "y": event.y, "state": event.state})
+
+    def on_key(self, event):
+        # 入力欄への文字入力と、ルート以外のウィンドウ (ダイアログ・別ウィンドウ) のキーは記録しない
+        import tkinter
+        widget = event.widget
+        if not isinstance(widget, tkinter.Misc) or isinstance(widget, (tkinter.Entry, tkinter.Text)) or widget.winfo_toplevel() is not self.app: return
+        record = {"type": "key", "keysym": event.keysym, "state": event.state}
+        # ダイアログを閉じた直後の Enter は無視されている (再生時も無視する)
+        if event.keysym == "Return" and (self.app.is_dialog_active or time.time() < self.app.ignore_input_until): record["ignored"] = True
+        self.write(record)
+
+    def call(self, name, args):
+        self.write({"type": "call", "name": name, "args": list(args)})
+
+    def stop(self):
+        app = self.app
+        if app is not None:
+            # unbind(sequence, funcid) は Python のバージョンによって元のバインドまで消すので、控えたスクリプトを書き戻す
+            for widget, tag, sequence, previous, funcid in self.bindings:
+                try: widget.tk.call("bind", tag, sequence, previous); widget.deletecommand(funcid)
+                except Exception: pass
+            app.__dict__.pop("ask_class", None); app.events.__dict__.pop("load_image_from_index", None)
+        self.bindings, self.app = [], None
+        self.file.close()
+
+def load_recording(path):
+    with open(path, 'r', encoding='utf-8') as f: records = [json.loads(line) for line in f if line.strip()]
+    if not records or records[0].get("type") != "start": raise ValueError(f"記録の先頭に開始状態がありません: {path}")
+    if records[0].get("version") != RECORD_VERSION: raise ValueError(f"記録の形式が違います (version {records[0].get('version')})")
+    return records[0], records[1:]
+
+def prepare_scratch(header, records, scratch_dir):
+    # 一時フォルダにプロジェクト (classes.yaml・ステータス) と、記録時点のラベルを再現する。画像は元のフォルダを参照する
+    import yaml
+    from label_store import TxtLabelStore
+    from project_shards import ShardedApprovalStatus
+    image_dir_name = os.path.basename(os.path.normpath(header["image_dir"]))
+    project_dir, image_dir = os.path.join(scratch_dir, "project"), os.path.join(scratch_dir, "data", image_dir_name)
+    os.makedirs(project_dir); os.makedirs(os.path.dirname(image_dir))
+    with open(os.path.join(project_dir, "classes.yaml"), 'w', encoding='utf-8') as f: yaml.safe_dump({"names": header["class_names"]}, f, allow_unicode=True)
+    shown = [r["key"] for r in records if r["type"] == "image"]
+    try:
+        os.symlink(os.path.abspath(header["image_dir"]), image_dir, target_is_directory=True)
+    except (OSError, NotImplementedError):
+        # シンボリックリンクが使えない環境では、表示した画像 (動画はファイルごと) だけをコピーする
+        from video_source import split_frame_key
+        for key in shown:
+            src = os.path.join(header["image_dir"], key)
+            frame = split_frame_key(src)
+            if frame is not None: src = frame[0]
+            dst = os.path.join(image_dir, os.path.relpath(src, header["image_dir"]))
+            if os.path.exists(dst): continue
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            try: os.link(src, dst)
+            except OSError: shutil.copy2(src, dst)
+    store = TxtLabelStore(os.path.join(scratch_dir, "data", "labels"))
+    os.makedirs(store.labels_dir)
+    for record in records:
+        if record["type"] == "image" and record["rows"] is not None:
+            os.makedirs(os.path.dirname(store.path(os.path.splitext(record["key"])[0])), exist_ok=True)
+            store.write(os.path.splitext(record["key"])[0], [tuple(row) for row in record["rows"]])
+    status = ShardedApprovalStatus(project_dir, image_dir_name)
+    for key, value in header["statuses"].items(): status[key] = value
+    status.save()
+    return project_dir, image_dir
+
+def start_virtual_display(width=1920, height=1080):
+    # DISPLAY が無い Linux で Xvfb があれば起動する。返り値: 起動したプロセス (不要なら None)
+    if os.name != "posix" or sys.platform == "darwin" or os.environ.get("DISPLAY") or not shutil.which("Xvfb"): return None
+    for number in range(99, 140):
+        if os.path.exists(f"/tmp/.X11-unix/X{number}") or os.path.exists(f"/tmp/.X{number}-lock"): continue
+        process = subprocess.Popen(["Xvfb", f":{number}", "-screen", "0", f"{width}x{height}x24", "-nolisten", "tcp"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for _ in range(100):
+            if os.path.exists(f"/tmp/.X11-unix/X{number}"): os.environ["DISPLAY"] = f":{number}"; return process
+            if process.poll() is not None: break
+            time.sleep(0.05)
+        process.terminate()
+    raise RuntimeError("仮想ディスプレイ (Xvfb) を起動できません")
+
+def event_name(record):
+    if record["type"] == "mouse":
+        name = record["seq"].strip("<>")
+        return "Drag" if name == "Motion" and record["state"] & BUTTON1_MASK else name
+    if record["type"] == "key": return f"key:{record['keysym']}"
+    return f"call:{record['name']}"
+
+def pump(app, until=None):
+    # after() の予約 (2パス描画の仕上げ・書き込み完了通知など) を進める
+    while True:
+        app.update()
+        if until is None or until(): return
+        time.sleep(0.01)
+
+def replay(app, header, records, realtime=False, progress=None):
+    # 記録した操作を同じバインド・ハンドラーへ順に流し、ハンドラーの処理時間を "event:<操作>" として profiler に記録する
+    answers = deque(r["value"] for r in records if r["type"] == "answer")
+    app.ask_class = lambda: answers.popleft() if answers else None
+    events = [r for r in records if r["type"] in ("mouse", "key", "call") and not r.get("ignored")]
+    # Tk はキーイベントをフォーカスのあるウィンドウにしか届けないので、先にルートへフォーカスを移す
+    app.focus_force(); app.update()
+    # 届いたキーを数え、フォーカスが無いなどで落ちたキーがあれば報告する
+    delivered = [0]
+    funcid = app.bind_all("<KeyPress>", lambda e: delivered.__setitem__(0, delivered[0] + 1), add="+")
+    start = time.perf_counter(); first = events[0]["t"] if events else 0.0
+    for n, record in enumerate(events):
+        if realtime:
+            # 記録時の間隔を再現する (待ち時間中も after の予約は進める)
+            due = start + record["t"] - first
+            while time.perf_counter() < due: app.update(); time.sleep(min(0.002, max(0.0, due - time.perf_counter())))
+        began = time.perf_counter()
+        if record["type"] == "mouse": app.canvas.event_generate(record["seq"], x=record["x"], y=record["y"], state=record["state"])
+        elif record["type"] == "key":
+            if app.focus_get() is None: app.focus_force(); app.update()
+            app.event_generate("<KeyPress>", keysym=record["keysym"], state=record["state"])
+        else: getattr(app.events, record["name"])(*record["args"])
+        app.profiler.record(f"event:{event_name(record)}", began, time.perf_counter())
+        with app.profiler.span("tk_idle"): app.update_idletasks()
+        app.update()
+        if progress and n % 500 == 0: progress(n, len(events))
+    app.unbind_all("<KeyPress>"); app.deletecommand(funcid)
+    # 返り値: (再生した操作数, 届かなかったキー操作の数)
+    return len(events), sum(r["type"] == "key" for r in events) - delivered[0]
+
+def format_summary(profiler):
+    stats = profiler.percentiles((50, 95, 99))
+    lines = [f"{'event / stage':<28}{'count':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)"]
+    for name, (count, (p50, p95, p99), max_ms) in sorted(stats.items(), key=lambda item: (not item[0].startswith("event:"), -item[1][1][1])):
+        lines.append(f"{name[:28]:<28}{count:>8}{p50:>9.2f}{p95:>9.2f}{p99:>9.2f}{max_ms:>9.2f}")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="操作記録の再生と処理時間の計測")
+    parser.add_argument("recording")
+    parser.add_argument("--realtime", action="store_true", help="記録時の間隔どおりに再生する (既定: 待たずに連続で流す)")
+    parser.add_argument("--model", help="推論モデル (既定: 記録時のモデル)")
+    parser.add_argument("--csv", help="集計を CSV に書き出す"); parser.add_argument("--trace", help="Chrome trace (JSON) に書き出す")
+    parser.add_argument("--keep", action="store_true", help="再生に使った一時フォルダを残す")
+    args = parser.parse_args()
+    header, records = load_recording(args.recording)
+    display = start_virtual_display()
+    scratch_dir = tempfile.mkdtemp(prefix="input_replay_")
+    try:
+        project_dir, image_dir = prepare_scratch(header, records, scratch_dir)
+        from app_ui import AnnotationApp
+        app = AnnotationApp(model_path=args.model or header["model"])
+        app.replaying = True
+        app.geometry(header["geometry"]); pump(app)
+        app.events.open_project(project_dir)
+        app.recursive_var.set(header["recursive"]); app.use_sqlite_var.set(False); app.share_work_var.set(False); app.skip_duplicates_var.set(False)
+        app.events.open_image_folder(image_dir)
+        pump(app, lambda: app.folder_scanner is None)
+        app.box_propagator.enabled, app.box_propagator.detect_interval = header["propagate"]
+        app.events.start_mode(header["mode"], start_at=header["current"], images=header["queue"])
+        # 記録開始時に表示していたボックス (未保存の編集を含む) から始める
+        app.boxes = {i: {'coords': coords, 'class_id': class_id, 'items': {}} for i, (coords, class_id) in enumerate(header["boxes"])}
+        app.undo_stack.clear(); app.redo_stack.clear(); app.record_history(); app.redraw_boxes(); app.update_box_list_display()
+        pump(app)
+        canvas = [app.canvas.winfo_width(), app.canvas.winfo_height()]
+        if canvas != header["canvas"]: print(f"警告: キャンバスの大きさが記録時と違います (記録 {header['canvas']} / 再生 {canvas})。座標がずれる可能性があります。")
+        # 再生した操作すべてを集計できるよう、計測の保持件数を広げる
+        app.profiler.window, app.profiler.max_events = len(records) + 1, max(100000, len(records) * 16)
+        app.set_profiling(True); app.profiler.reset()
+        start = time.perf_counter()
+        count, dropped = replay(app, header, records, args.realtime, progress=lambda n, total: print(f"\r{n}/{total}", end="", flush=True))
+        elapsed = time.perf_counter() - start
+        print(f"\r{count}操作を再生 ({elapsed:.1f}秒{', 実時間' if args.realtime else ''})")
+        if dropped: print(f"警告: キー操作 {dropped}件がハンドラーに届きませんでした (フォーカスを確認してください)。計測結果は不完全です。")
+        print(format_summary(app.profiler))
+        if args.csv: app.profiler.export_csv(args.csv)
+        if args.trace: app.profiler.export_chrome_trace(args.trace)
+        app.flush_io(); app.io.shutdown(); app.destroy()
+    finally:
+        if args.keep: print(f"一時フォルダ: {scratch_dir}")
+        else: shutil.rmtree(scratch_dir, ignore_errors=True)
+        if display is not None: display.terminate()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
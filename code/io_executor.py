@@ -0,0 +1,94 @@
+# io_executor.py
+import os
+import queue
+import threading
+from collections import deque
+
+def write_text_atomic(path, text, encoding='utf-8', newline=None):
+    # 書き込み途中で落ちても元のファイルが壊れないよう、一時ファイルに書いてから置き換える
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding=encoding, newline=newline) as f: f.write(text)
+    os.replace(tmp_path, path)
+
+def append_text(path, text, encoding='utf-8'):
+    with open(path, 'a', encoding=encoding) as f: f.write(text)
+
+class WriteBehindExecutor:
+    # ディスク書き込みを1本のワーカースレッドで順番に実行する
+    # - キー (ファイルパス) ごとに投入順を保ち、未実行の同じキーへの書き込みは最後の内容だけにまとめる
+    # - 追記 (append) は未実行分を連結して1回で書く
+    # - 完了・エラーは completions に積み、メインスレッドが drain_completions() で受け取る
+    def __init__(self):
+        self.pending = {}            # key -> {"fn", "text", "callbacks"}
+        self.order = deque()
+        self.completions = queue.Queue()
+        self.coalesced = 0
+        self._cond = threading.Condition()
+        self._running = None
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="WriteBehindIO", daemon=True)
+        self._thread.start()
+
+    def _submit(self, key, fn, on_done, append=None):
+        with self._cond:
+            task = self.pending.get(key)
+            if task is None:
+                task = self.pending[key] = {"fn": fn, "text": append, "callbacks": []}
+                self.order.append(key)
+            else:
+                self.coalesced += 1
+                if append is not None: task["text"] += append
+                else: task["fn"] = fn
+            if on_done: task["callbacks"].append(on_done)
+            self._cond.notify_all()
+
+    def submit(self, key, fn, on_done=None):
+        # fn は引数なしで呼ばれ、戻り値が on_done(result, error) に渡される
+        self._submit(key, fn, on_done)
+
+    def write_text(self, path, text, on_done=None):
+        self._submit(path, lambda: write_text_atomic(path, text), on_done)
+
+    def append_text(self, path, text):
+        self._submit(("append", path), None, None, append=text)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self.order and not self._stop: self._cond.wait()
+                if not self.order: return
+                key = self.order.popleft()
+                task = self.pending.pop(key); self._running = key
+            result, error = None, None
+            try:
+                if task["text"] is not None: append_text(key[1], task["text"])
+                else: result = task["fn"]()
+            except Exception as e:
+                error = e
+            self.completions.put((key, task["callbacks"], result, error))
+            with self._cond:
+                self._running = None; self._cond.notify_all()
+
+    def busy(self):
+        with self._cond: return bool(self.order) or self._running is not None
+
+    def flush(self, timeout=None):
+        # 投入済みの書き込みがすべて終わるまで待つ。タイムアウトした場合は False
+        with self._cond:
+            return self._cond.wait_for(lambda: not self.order and self._running is None, timeout)
+
+    def drain_completions(self, limit=500):
+        items = []
+        try:
+            while len(items) < limit: items.append(self.completions.get_nowait())
+        except queue.Empty:
+            pass
+        return items
+
+    def shutdown(self, timeout=10.0):
+        done = self.flush(timeout)
+        with self._cond:
+            self._stop = True; self._cond.notify_all()
+        self._thread.join(timeout=1.0)
+        return done
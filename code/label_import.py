@@ -0,0 +1,305 @@
+# label_import.py
+# 他のツールのラベル (COCO JSON / Pascal VOC XML) を YOLO txt に変換して labels/ に書き出す
+# COCO JSON は全体を読み込まずに要素ごとに読み進め、VOC の XML はワーカープロセスで並列に解析する
+#   python label_import.py <プロジェクトフォルダ> <画像フォルダ> (--coco annotations.json | --voc Annotations/) [--map "person -> 人"] [--add-classes] [--overwrite] [--status approved]
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+import xml.etree.ElementTree as ET
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from utils import load_class_names, IMAGE_EXTENSIONS
+from folder_scanner import iter_tree
+from label_store import format_yolo_rows, write_label_text
+from project_shards import ShardedApprovalStatus, STATUS_KEYS
+
+CHUNK_SIZE = 1024 * 1024
+SKIP_NAMES = {
+    "missing_image": "画像フォルダに無い画像", "unknown_image": "画像IDが不明なアノテーション", "unknown_category": "カテゴリIDが不明",
+    "unmapped_class": "対応するクラスが無い", "ignored_class": "取り込まないクラス", "crowd": "群衆 (iscrowd)",
+    "invalid_bbox": "不正なボックス", "no_size": "画像サイズが不明", "existing_label": "既存のラベルあり (上書きしない)",
+    "unreadable_xml": "XMLを読めない",
+}
+
+class _JsonStream:
+    # JSON をチャンクごとに読み、raw_decode で値を1つずつ取り出す
+    _whitespace = re.compile(r"\s*")
+
+    def __init__(self, f):
+        self.f, self.buf, self.pos, self.eof = f, "", 0, False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.f.read(CHUNK_SIZE)
+        if not chunk: self.eof = True; return False
+        self.buf = self.buf[self.pos:] + chunk; self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            self.pos = self._whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf): return self.buf[self.pos]
+            if not self._fill(): return ""
+
+    def take(self, expected):
+        c = self.peek()
+        if c not in expected: raise ValueError(f"JSON の形式が不正です (位置 {self.pos}: {c!r})")
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # 数値がチャンクの境目で切れている可能性があるので、末尾まで使い切ったときは続きを読んでからやり直す
+                if end < len(self.buf) or self.eof or not self._fill():
+                    self.pos = end; return value
+            except json.JSONDecodeError:
+                if not self._fill(): raise
+
+def iter_json_arrays(path, array_keys):
+    # ルートのオブジェクトを先頭から読み、array_keys の配列は要素ごとに (キー, 要素)、それ以外は (キー, 値) を返す
+    with open(path, 'r', encoding='utf-8') as f:
+        stream = _JsonStream(f)
+        stream.take("{")
+        if stream.peek() == "}": return
+        while True:
+            key = stream.value(); stream.take(":")
+            if key in array_keys and stream.peek() == "[":
+                stream.take("[")
+                if stream.peek() == "]": stream.take("]")
+                else:
+                    while True:
+                        yield key, stream.value()
+                        if stream.take(",]") == "]": break
+            else:
+                yield key, stream.value()
+            if stream.take(",}") == "}": break
+
+def read_coco(path, skipped, include_crowd=False):
+    # 返り値: [{"file", "width", "height", "boxes": [(クラス名, x1, y1, x2, y2)]}]
+    images, categories, annotations = {}, {}, []
+    for key, value in iter_json_arrays(path, ("images", "annotations", "categories")):
+        if key == "images": images[value["id"]] = {"file": value["file_name"], "width": value.get("width"), "height": value.get("height"), "boxes": []}
+        elif key == "categories": categories[value["id"]] = value["name"]
+        elif key == "annotations": annotations.append((value.get("image_id"), value.get("category_id"), value.get("bbox"), value.get("iscrowd", 0)))
+    # annotations が images より前に書かれたファイルもあるので、すべて読んでから結び付ける
+    for image_id, category_id, bbox, crowd in annotations:
+        image = images.get(image_id)
+        if image is None: skipped["unknown_image"] += 1; continue
+        if category_id not in categories: skipped["unknown_category"] += 1; continue
+        if crowd and not include_crowd: skipped["crowd"] += 1; continue
+        try: x, y, w, h = map(float, bbox)
+        except (TypeError, ValueError): skipped["invalid_bbox"] += 1; continue
+        image["boxes"].append((categories[category_id], x, y, x + w, y + h))
+    return list(images.values())
+
+def _parse_voc_chunk(items):
+    records, errors = [], []
+    for rel_stem, path in items:
+        try:
+            root = ET.parse(path).getroot()
+            size = root.find("size")
+            width = int(float(size.findtext("width"))) if size is not None else None
+            height = int(float(size.findtext("height"))) if size is not None else None
+            boxes = []
+            for obj in root.iter("object"):
+                bndbox = obj.find("bndbox")
+                # VOC は1始まりの画素座標 (両端を含む) なので、左上だけ1引いて0始まりの座標にする
+                x1, y1, x2, y2 = (float(bndbox.findtext(tag)) for tag in ("xmin", "ymin", "xmax", "ymax"))
+                boxes.append((obj.findtext("name", "").strip(), x1 - 1, y1 - 1, x2, y2))
+            filename = (root.findtext("filename") or "").strip()
+            folder = rel_stem.rpartition('/')[0]
+            records.append({"file": f"{folder}/{filename}" if folder and filename else filename, "stem": rel_stem, "width": width, "height": height, "boxes": boxes})
+        except (OSError, ET.ParseError, AttributeError, TypeError, ValueError) as e:
+            errors.append(f"{path}: {e}")
+    return records, errors
+
+def read_voc(xml_dir, skipped, workers=None, chunk_size=256, errors=None):
+    items = []
+    for rel, files in iter_tree(xml_dir, True):
+        prefix = f"{rel}/" if rel else ""
+        items += [(prefix + e.name[:-4], e.path) for e in files if e.name.lower().endswith(".xml")]
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    records = []
+    # Tk のスレッドから呼ばれても安全なように spawn でワーカーを起動する (dataset_lint と同じ)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        for part, part_errors in pool.map(_parse_voc_chunk, chunks):
+            records += part; skipped["unreadable_xml"] += len(part_errors)
+            if errors is not None: errors += part_errors
+    return records
+
+def build_class_map(source_names, class_names, lines=(), add_new=False):
+    # 取り込み元のクラス名 -> classes.yaml のクラスID。名前が同じもの (大文字小文字・前後の空白は無視) は自動で対応付ける
+    # lines: "取り込み元 -> classes.yaml の名前" (取り込まないクラスは "名前 -> -")
+    # 返り値: ({取り込み元の名前: クラスID or None (取り込まない)}, 新しいクラス名リスト)
+    names = list(class_names)
+    lookup = {name.strip().lower(): i for i, name in reversed(list(enumerate(names)))}
+    overrides = {}
+    for n, line in enumerate(lines, 1):
+        line = line.split('#', 1)[0].strip()
+        if not line: continue
+        if '->' not in line: raise ValueError(f"{n}行目: 「取り込み元 -> クラス名」の形式で指定してください: {line}")
+        src, dst = (part.strip() for part in line.split('->', 1))
+        overrides[src] = dst
+    mapping = {}
+    for source in sorted(source_names):
+        target = overrides.get(source, source)
+        if target in ('', '-'): mapping[source] = None; continue
+        class_id = lookup.get(target.strip().lower())
+        if class_id is None and target.isdigit() and int(target) < len(names): class_id = int(target)
+        if class_id is None and add_new:
+            names.append(target); class_id = lookup[target.strip().lower()] = len(names) - 1
+        if class_id is not None: mapping[source] = class_id
+    return mapping, names
+
+def _image_lookup(image_dir, recursive):
+    # 画像キーの集合と、ファイル名だけ・拡張子なしで引くための索引 (COCO の file_name にフォルダが付いていない場合など)
+    keys, by_name, by_stem = set(), defaultdict(list), defaultdict(list)
+    for rel, files in iter_tree(image_dir, recursive):
+        prefix = f"{rel}/" if rel else ""
+        for e in files:
+            if not e.name.lower().endswith(IMAGE_EXTENSIONS): continue
+            key = prefix + e.name
+            keys.add(key); by_name[e.name].append(key); by_stem[os.path.splitext(key)[0]].append(key)
+    def resolve(record):
+        file = record["file"].replace('\\', '/').lstrip('/')
+        if file in keys: return file
+        candidates = by_name.get(file.rpartition('/')[2]) or by_stem.get(record.get("stem") or "") or []
+        return candidates[0] if len(candidates) == 1 else None
+    return resolve
+
+def convert_records(records, resolve, class_map, sizes=None):
+    # 返り値: ({画像キー: YOLO 行}, スキップ理由の Counter, 対応の無いクラス名の Counter)
+    labels, skipped, unmapped = {}, Counter(), Counter()
+    for record in records:
+        key = resolve(record)
+        if key is None: skipped["missing_image"] += 1; continue
+        w, h = record["width"], record["height"]
+        if not (w and h) and sizes: w, h = sizes.get(key, (None, None))
+        if not (w and h): skipped["no_size"] += 1; continue
+        # 注釈の無い画像だけ空のラベルにする。ボックスが全て除外された画像は取り込まない (注釈済み扱いにしない)
+        if not record["boxes"]: labels.setdefault(key, [])
+        for name, x1, y1, x2, y2 in record["boxes"]:
+            if name not in class_map: unmapped[name] += 1; skipped["unmapped_class"] += 1; continue
+            class_id = class_map[name]
+            if class_id is None: skipped["ignored_class"] += 1; continue
+            # 画像からはみ出した部分は切り取る
+            x1, x2 = max(0.0, min(x1, w)), max(0.0, min(x2, w))
+            y1, y2 = max(0.0, min(y1, h)), max(0.0, min(y2, h))
+            if x2 <= x1 or y2 <= y1: skipped["invalid_bbox"] += 1; continue
+            labels.setdefault(key, []).append((class_id, (x1 + x2) / 2 / w, (y1 + y2) / 2 / h, (x2 - x1) / w, (y2 - y1) / h))
+    return labels, skipped, unmapped
+
+def write_labels(labels_dir, labels, overwrite=False, workers=8, chunk_size=512):
+    # 返り値: ({ステム: バイト数}, 既存のためスキップした件数, エラー)
+    items = sorted(labels.items())
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+    def write_chunk(chunk):
+        written, existing, errors = {}, 0, []
+        for key, rows in chunk:
+            stem = os.path.splitext(key)[0]
+            path = os.path.join(labels_dir, f"{stem}.txt")
+            if not overwrite and os.path.exists(path): existing += 1; continue
+            text = format_yolo_rows(rows)
+            try: written[stem] = write_label_text(path, text)
+            except OSError as e: errors.append(f"{path}: {e}")
+        return written, existing, errors
+
+    written, existing, errors = {}, 0, []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for part, part_existing, part_errors in pool.map(write_chunk, chunks):
+            written.update(part); existing += part_existing; errors += part_errors
+    return written, existing, errors
+
+def import_labels(project_dir, image_dir, labels_dir, source, source_format, lines=(), add_classes=False, overwrite=False,
+                  recursive=True, include_crowd=False, dry_run=False, progress=None):
+    # 返り値: レポート (dict)。written は {ステム: バイト数}、images は取り込んだ画像キー
+    class_names = load_class_names(project_dir)
+    if class_names is None: raise ValueError("classes.yaml を読み込めません")
+    start = time.perf_counter()
+    skipped, errors = Counter(), []
+    if progress: progress("read")
+    records = read_coco(source, skipped, include_crowd) if source_format == "coco" else read_voc(source, skipped, errors=errors)
+    class_map, new_names = build_class_map({name for r in records for name, *_ in r["boxes"]}, class_names, lines, add_classes)
+    resolve = _image_lookup(image_dir, recursive)
+    sizes = None
+    if any(not (r["width"] and r["height"]) for r in records):
+        # サイズの書かれていない画像だけヘッダーから読む (coco_export の索引を使い回す)
+        from coco_export import ImageSizeIndex, size_index_path
+        index = ImageSizeIndex(size_index_path(project_dir, image_dir))
+        sizes = index.sizes(image_dir, [k for k in map(resolve, (r for r in records if not (r["width"] and r["height"]))) if k]); index.save()
+    if progress: progress("convert")
+    labels, convert_skipped, unmapped = convert_records(records, resolve, class_map, sizes)
+    skipped.update(convert_skipped)
+    written, existing = {}, 0
+    if not dry_run:
+        if progress: progress("write")
+        if new_names != class_names:
+            from class_remap import write_class_names
+            write_class_names(project_dir, new_names)
+        written, existing, write_errors = write_labels(labels_dir, labels, overwrite)
+        errors += write_errors
+    else:
+        existing = sum(1 for key in labels if os.path.exists(os.path.join(labels_dir, os.path.splitext(key)[0] + ".txt")))
+    if existing and not overwrite: skipped["existing_label"] += existing
+    return {"format": source_format, "source": source, "dry_run": dry_run, "records": len(records),
+            "images": sorted(key for key in labels if dry_run or os.path.splitext(key)[0] in written),
+            "boxes": sum(len(rows) for rows in labels.values()), "written": written,
+            "class_names": class_names, "new_names": new_names, "class_map": class_map,
+            "skipped": skipped, "unmapped": unmapped, "errors": errors, "seconds": time.perf_counter() - start}
+
+def apply_status(status_map, images, status):
+    # 取り込んだ画像の初期ステータス (既にステータスのある画像はそのまま)
+    changed = 0
+    for key in images:
+        if status_map.get(key) is None: status_map[key] = status; changed += 1
+    return changed
+
+def format_report(report):
+    state = "ドライラン (まだ書き込んでいません)" if report["dry_run"] else "取り込みました"
+    target = len(report["images"]) if report["dry_run"] else len(report["written"])
+    lines = [f"{state}: {report['format'].upper()} {report['records']}件 -> ラベル {target}件 / ボックス {report['boxes']}個 ({report['seconds']:.1f}秒)"]
+    added = report["new_names"][len(report["class_names"]):]
+    if added: lines.append(f"classes.yaml に追加したクラス: {', '.join(added)}")
+    if report["skipped"]:
+        lines += ["", "--- スキップ ---"] + [f"  {SKIP_NAMES.get(code, code)}: {count}件" for code, count in report["skipped"].most_common()]
+    if report["unmapped"]:
+        lines += ["", "--- classes.yaml に無いクラス (--map か --add-classes で指定) ---"] + [f"  {name}: {count}個" for name, count in report["unmapped"].most_common()]
+    if report["errors"]: lines += ["", f"読み書きに失敗: {len(report['errors'])}件"] + report["errors"][:20]
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="COCO JSON / Pascal VOC のラベルを YOLO txt に取り込む")
+    parser.add_argument("project_dir"); parser.add_argument("image_dir")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--coco", help="COCO JSON ファイル"); source.add_argument("--voc", help="Pascal VOC の XML フォルダ")
+    parser.add_argument("--labels-dir", help="省略時は画像フォルダと同じ階層の labels")
+    parser.add_argument("--map", action="append", default=[], help='"取り込み元のクラス -> classes.yaml のクラス" (取り込まない場合は "名前 -> -")')
+    parser.add_argument("--add-classes", action="store_true", help="classes.yaml に無いクラスを末尾に追加する")
+    parser.add_argument("--overwrite", action="store_true", help="既存のラベルを上書きする")
+    parser.add_argument("--include-crowd", action="store_true", help="COCO の iscrowd ボックスも取り込む")
+    parser.add_argument("--status", choices=STATUS_KEYS, help="取り込んだ画像に付ける初期ステータス")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    labels_dir = args.labels_dir or os.path.join(os.path.dirname(os.path.abspath(args.image_dir)), "labels")
+    try:
+        report = import_labels(args.project_dir, args.image_dir, labels_dir, args.coco or args.voc, "coco" if args.coco else "voc",
+                               args.map, args.add_classes, args.overwrite, include_crowd=args.include_crowd, dry_run=args.dry_run)
+    except ValueError as e:
+        print(f"エラー: {e}"); return 1
+    print(format_report(report))
+    if args.status and not args.dry_run:
+        status_map = ShardedApprovalStatus(args.project_dir, os.path.basename(os.path.normpath(args.image_dir)))
+        print(f"ステータス '{args.status}' を設定: {apply_status(status_map, report['images'], args.status)}件")
+        status_map.save()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
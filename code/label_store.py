@@ -0,0 +1,305 @@
+# label_store.py
+import os
+import time
+import shutil
+import sqlite3
+from collections.abc import MutableMapping
+from folder_scanner import iter_tree
+from project_shards import STATUS_KEYS, folder_of
+from io_executor import write_text_atomic
+
+# ラベルの1行 = (class_id, x_center, y_center, width, height)  座標は画像サイズで正規化済み
+
+def format_yolo_rows(rows):
+    return "".join(f"{int(c)} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n" for c, x, y, w, h in rows)
+
+def write_label_text(path, text):
+    # ラベルは OS に関係なく LF で書く (Windows でも \r\n にならず、返すバイト数がファイルサイズと一致する)
+    write_text_atomic(path, text, encoding=None, newline='')
+    return len(text.encode())
+
+def parse_yolo_text(text, strict=True):
+    # strict=False では読めない行 (項目不足・数値でない) を飛ばす (検証で見つかったラベルをエディタで開くため)
+    rows = []
+    for line in text.splitlines():
+        parts = line.split()
+        if not parts: continue
+        if strict:
+            if len(parts) < 5: raise ValueError(f"too few values: {line}")
+            rows.append((int(parts[0]), *map(float, parts[1:5]))); continue
+        try:
+            if len(parts) >= 5: rows.append((int(float(parts[0])), *map(float, parts[1:5])))
+        except ValueError:
+            continue
+    return rows
+
+def _remove_file(path):
+    try: os.remove(path)
+    except FileNotFoundError: pass
+
+class TxtLabelStore:
+    # 従来通り 1画像 = 1つの YOLO txt
+    kind = "txt"
+
+    def __init__(self, labels_dir, submit=None):
+        self.labels_dir = labels_dir
+        # submit(path, fn, on_done) があれば書き込みはバックグラウンドで行い、完了までは pending の内容を返す
+        self.submit = submit
+        self.pending = {}
+
+    def path(self, stem):
+        return os.path.join(self.labels_dir, f"{stem}.txt")
+
+    def exists(self, stem):
+        return stem in self.pending or os.path.exists(self.path(stem))
+
+    def read(self, stem, strict=True):
+        if stem in self.pending: return list(self.pending[stem])
+        try:
+            with open(self.path(stem), 'r') as f: return parse_yolo_text(f.read(), strict)
+        except FileNotFoundError:
+            return None
+
+    def write(self, stem, rows):
+        path, text = self.path(stem), format_yolo_rows(rows)
+        if self.submit is None: return write_label_text(path, text)
+        rows = list(rows); self.pending[stem] = rows
+        self.submit(path, lambda: write_label_text(path, text), lambda result, error: self._written(stem, rows, error))
+        return len(text.encode())
+
+    def _written(self, stem, rows, error):
+        # 書き込みに失敗した場合は pending に残し、作業内容を失わないようにする
+        if error is None and self.pending.get(stem) is rows: del self.pending[stem]
+
+    def delete(self, stem):
+        self.pending.pop(stem, None)
+        path = self.path(stem)
+        if self.submit: self.submit(path, lambda: _remove_file(path))
+        else: _remove_file(path)
+
+    def copy(self, src_stem, dst_stem):
+        return self.write(dst_stem, self.read(src_stem) or [])
+
+    def export_txt(self, stem, dest_path):
+        if stem in self.pending: write_label_text(dest_path, format_yolo_rows(self.pending[stem]))
+        else: shutil.copy2(self.path(stem), dest_path)
+
+    def close(self): pass
+
+class SqliteLabelStore:
+    # ボックス・承認ステータス・更新時刻を1つのSQLite (WAL) にまとめて保持する
+    kind = "sqlite"
+
+    def __init__(self, db_path, labels_dir, check_same_thread=True):
+        # check_same_thread=False は呼び出し側で排他する場合のみ (レビューサーバー)
+        self.db_path, self.labels_dir = db_path, labels_dir
+        self.conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS labels (stem TEXT PRIMARY KEY, box_count INTEGER NOT NULL, size INTEGER NOT NULL, updated_at REAL NOT NULL);
+                CREATE TABLE IF NOT EXISTS boxes (stem TEXT NOT NULL, idx INTEGER NOT NULL, class_id INTEGER NOT NULL,
+                                                  cx REAL NOT NULL, cy REAL NOT NULL, w REAL NOT NULL, h REAL NOT NULL, PRIMARY KEY (stem, idx)) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS status (image TEXT PRIMARY KEY, status TEXT NOT NULL, updated_at REAL NOT NULL);
+                CREATE INDEX IF NOT EXISTS status_by_status ON status (status);
+                CREATE INDEX IF NOT EXISTS labels_by_updated ON labels (updated_at);
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """)
+
+    def path(self, stem):
+        return os.path.join(self.labels_dir, f"{stem}.txt")
+
+    def exists(self, stem):
+        return self.conn.execute("SELECT 1 FROM labels WHERE stem = ?", (stem,)).fetchone() is not None
+
+    def read(self, stem, strict=True):
+        if not self.exists(stem): return None
+        return [tuple(r) for r in self.conn.execute("SELECT class_id, cx, cy, w, h FROM boxes WHERE stem = ? ORDER BY idx", (stem,))]
+
+    def _write(self, stem, rows, updated_at):
+        size = len(format_yolo_rows(rows).encode())
+        self.conn.execute("DELETE FROM boxes WHERE stem = ?", (stem,))
+        # txtと同じ精度 (小数6桁) で保持し、相互変換しても値が変わらないようにする
+        self.conn.executemany("INSERT INTO boxes VALUES (?, ?, ?, ?, ?, ?, ?)", ((stem, i, int(r[0]), round(r[1], 6), round(r[2], 6), round(r[3], 6), round(r[4], 6)) for i, r in enumerate(rows)))
+        self.conn.execute("INSERT OR REPLACE INTO labels VALUES (?, ?, ?, ?)", (stem, len(rows), size, updated_at))
+        return size
+
+    def write(self, stem, rows):
+        with self.conn: return self._write(stem, rows, time.time())
+
+    def write_many(self, items):
+        # items: [(stem, rows, updated_at), ...] を1トランザクションで書き込む
+        with self.conn:
+            return sum(self._write(stem, rows, updated_at) for stem, rows, updated_at in items)
+
+    def delete(self, stem):
+        with self.conn:
+            self.conn.execute("DELETE FROM boxes WHERE stem = ?", (stem,))
+            self.conn.execute("DELETE FROM labels WHERE stem = ?", (stem,))
+
+    def copy(self, src_stem, dst_stem):
+        return self.write(dst_stem, self.read(src_stem) or [])
+
+    def export_txt(self, stem, dest_path):
+        write_label_text(dest_path, format_yolo_rows(self.read(stem) or []))
+
+    def label_sizes(self):
+        return dict(self.conn.execute("SELECT stem, size FROM labels"))
+
+    def close(self):
+        self.conn.close()
+
+    def class_counts(self):
+        return dict(self.conn.execute("SELECT class_id, COUNT(*) FROM boxes GROUP BY class_id"))
+
+    def remap_classes(self, id_map):
+        # クラスIDの付け替え・削除 (id_map[旧ID] = 新ID, 削除は -1) を1トランザクションで適用する
+        changed = {old for old, new in enumerate(id_map) if new != old}
+        if not changed: return 0
+        stems = sorted({stem for stem, class_id in self.conn.execute("SELECT stem, class_id FROM boxes") if class_id in changed})
+        now, items = time.time(), []
+        for stem in stems:
+            rows = [(id_map[r[0]] if 0 <= r[0] < len(id_map) else r[0],) + r[1:] for r in self.read(stem)]
+            items.append((stem, [r for r in rows if r[0] >= 0], now))
+        self.write_many(items)
+        return len(stems)
+
+    # --- YOLO txt との同期 ---
+    def _meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, str(value)))
+
+    def import_txt(self, stem):
+        # 外部で変更された txt を1件取り込む。内容が同じ (自分で書き出したもの) なら何もしない
+        path = self.path(stem)
+        with open(path, 'r') as f: rows = parse_yolo_text(f.read())
+        if self.read(stem) == rows: return None
+        with self.conn:
+            size = self._write(stem, rows, os.path.getmtime(path))
+        return size
+
+    def import_from_txt(self, recursive=False, batch_size=5000):
+        # DBより新しい txt (外部ツールで作成・更新されたもの) だけを取り込む
+        known = dict(self.conn.execute("SELECT stem, updated_at FROM labels"))
+        batch, imported, skipped = [], 0, 0
+        for rel, files in iter_tree(self.labels_dir, recursive) if os.path.isdir(self.labels_dir) else ():
+            prefix = f"{rel}/" if rel else ""
+            for entry in files:
+                if not entry.name.endswith(".txt"): continue
+                stem = prefix + entry.name[:-4]
+                try:
+                    mtime = entry.stat().st_mtime
+                    if stem in known and known[stem] >= mtime: continue
+                    with open(entry.path, 'r') as f: batch.append((stem, parse_yolo_text(f.read()), mtime))
+                except (OSError, ValueError, IndexError):
+                    skipped += 1; continue
+                if len(batch) >= batch_size:
+                    self.write_many(batch); imported += len(batch); batch = []
+        if batch: self.write_many(batch); imported += len(batch)
+        return imported, skipped
+
+    def export_to_txt(self):
+        # 前回の書き出し以降に更新されたラベルだけを txt に書き出す (学習ツールは従来の形式をそのまま読める)
+        since = float(self._meta("last_txt_export", 0))
+        now = time.time()
+        stems = [r[0] for r in self.conn.execute("SELECT stem FROM labels WHERE updated_at > ?", (since,))]
+        for stem in stems:
+            path = self.path(stem)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.export_txt(stem, path)
+            # 書き出した txt の mtime をDBの更新時刻に合わせ、次回の取り込みで再読込されないようにする
+            updated_at = self.conn.execute("SELECT updated_at FROM labels WHERE stem = ?", (stem,)).fetchone()[0]
+            os.utime(path, (updated_at, updated_at))
+        with self.conn: self._set_meta("last_txt_export", now)
+        return len(stems)
+
+    def status_view(self):
+        return SqliteApprovalStatus(self.conn, self.db_path)
+
+class SqliteApprovalStatus(MutableMapping):
+    # ShardedApprovalStatus と同じインターフェース (counts / folders_with / save) を SQLite 上で提供する
+    def __init__(self, conn, db_path=None):
+        self.conn, self.db_path = conn, db_path
+        self.pending = {}
+        self.legacy_path = ""
+
+    def __getitem__(self, key):
+        if key in self.pending:
+            if self.pending[key] is None: raise KeyError(key)
+            return self.pending[key]
+        row = self.conn.execute("SELECT status FROM status WHERE image = ?", (key,)).fetchone()
+        if row is None: raise KeyError(key)
+        return row[0]
+
+    def __setitem__(self, key, value): self.pending[key] = value
+
+    def __delitem__(self, key):
+        self[key]; self.pending[key] = None
+
+    def _merged(self):
+        merged = dict(self.conn.execute("SELECT image, status FROM status"))
+        for key, value in self.pending.items():
+            if value is None: merged.pop(key, None)
+            else: merged[key] = value
+        return merged
+
+    def __iter__(self): return iter(self._merged())
+    def __len__(self): return len(self._merged())
+
+    def counts(self):
+        totals = dict.fromkeys(STATUS_KEYS, 0)
+        for status, count in self.conn.execute("SELECT status, COUNT(*) FROM status GROUP BY status"):
+            if status in totals: totals[status] += count
+        for key, value in self.pending.items():
+            row = self.conn.execute("SELECT status FROM status WHERE image = ?", (key,)).fetchone()
+            if row and row[0] in totals: totals[row[0]] -= 1
+            if value in totals: totals[value] += 1
+        return totals
+
+    def folders_with(self, status):
+        folders = {folder_of(r[0]) for r in self.conn.execute("SELECT image FROM status WHERE status = ?", (status,))}
+        folders.update(folder_of(k) for k, v in self.pending.items() if v == status)
+        return folders
+
+    def keys_with(self, status):
+        keys = {r[0] for r in self.conn.execute("SELECT image FROM status WHERE status = ?", (status,))}
+        for key, value in self.pending.items():
+            if value == status: keys.add(key)
+            else: keys.discard(key)
+        return iter(sorted(keys))
+
+    def reader(self):
+        # ワーカースレッド用: 別接続で読む (WALなので書き込み中でも読める)。未保存の変更だけをここで写しておく
+        db_path, overlay = self.db_path, dict(self.pending)
+
+        def read():
+            conn = sqlite3.connect(db_path)
+            try: statuses = dict(conn.execute("SELECT image, status FROM status"))
+            finally: conn.close()
+            for key, value in overlay.items():
+                if value is None: statuses.pop(key, None)
+                else: statuses[key] = value
+            return statuses
+        return read
+
+    def save(self):
+        if not self.pending: return
+        now = time.time()
+        with self.conn:
+            self.conn.executemany("DELETE FROM status WHERE image = ?", ((k,) for k, v in self.pending.items() if v is None))
+            self.conn.executemany("INSERT OR REPLACE INTO status VALUES (?, ?, ?)", ((k, v, now) for k, v in self.pending.items() if v is not None))
+        self.pending.clear()
+
+def load_label_columns(db_path):
+    # 分析用: 別接続 (WALなので書き込み中でも読める) で全ボックスを列として読み出す
+    conn = sqlite3.connect(db_path)
+    try:
+        labels = conn.execute("SELECT stem, box_count, size, updated_at FROM labels ORDER BY stem").fetchall()
+        boxes = conn.execute("SELECT class_id, cx, cy, w, h FROM boxes ORDER BY stem, idx").fetchall()
+    finally:
+        conn.close()
+    return labels, boxes
@@ -4,6 +4,7 @@ from app_ui import AnnotationApp
 # --- 設定 ---
 # 自動アノテーションに使うYOLOv8転移学習モデルのパス
 # オリジナルのモデルを使わない場合は 'yolov8n.pt' のままでOK
+# (起動時のモデル。ほかの重みはオプション設定の「モデルを追加...」から登録し、作業中に切り替えられる)
 # YOUR_MODEL_PATH = "best.pt" 
 YOUR_MODEL_PATH = "yolov8n.pt" 
 
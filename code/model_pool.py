@@ -0,0 +1,118 @@
+# model_pool.py
+import os
+import gc
+import json
+import threading
+from collections import OrderedDict
+
+def _measure_bytes(model, path):
+    # 重みとバッファの実サイズ (読み込み後のテンソル)。取れなければ重みファイルの大きさで代用する
+    try:
+        module = model.model
+        return sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+    except Exception:
+        try: return os.path.getsize(path)
+        except OSError: return 0
+
+def model_label(path):
+    # 拠点ごとの重みは同じファイル名 (best.pt) が多いので、親フォルダ名も付けて表示する
+    parent = os.path.basename(os.path.dirname(path))
+    return f"{parent}/{os.path.basename(path)}" if parent else os.path.basename(path)
+
+def _load_yolo(path):
+    from ultralytics import YOLO
+    return YOLO(path)
+
+class ModelPool:
+    # 複数の推論モデルを読み込んだまま保持し、実行中に切り替える
+    # 件数 (max_models) と合計サイズ (max_bytes) の上限を超えたら、使っていない期間が長いものから解放する (使用中のモデルは残す)
+    def __init__(self, max_models=3, max_bytes=2 * 1024 ** 3, loader=_load_yolo):
+        self.max_models, self.max_bytes, self.loader = max_models, max_bytes, loader
+        self.models = OrderedDict()  # パス -> (モデル, バイト数)。末尾ほど最近使ったもの
+        self.loading = {}  # パス -> 読み込み完了の Event
+        self.errors = {}  # パス -> 読み込みエラー
+        self.active = None
+        self.lock = threading.Lock()
+
+    def _load(self, path):
+        with self.lock:
+            if path in self.models: return
+            event = self.loading.get(path)
+            owner = event is None
+            if owner: event = self.loading[path] = threading.Event()
+        if not owner: event.wait(); return
+        try:
+            model = self.loader(path)
+            with self.lock:
+                self.models[path] = (model, _measure_bytes(model, path)); self.errors.pop(path, None)
+                self._evict(keep=path)
+        except Exception as e:
+            with self.lock: self.errors[path] = e
+        finally:
+            with self.lock: self.loading.pop(path, None)
+            event.set()
+
+    def _evict(self, keep=None):
+        # 使用中のモデルと読み込んだばかりのモデル (keep) は解放しない。それだけで上限を超える場合は超えたまま保持する
+        evicted = False
+        while len(self.models) > 1 and (len(self.models) > self.max_models or self.total_bytes() > self.max_bytes):
+            victim = next((p for p in self.models if p != self.active and p != keep), None)
+            if victim is None: break
+            del self.models[victim]; evicted = True
+        if evicted:
+            gc.collect()
+            try:
+                import torch
+                if torch.cuda.is_available(): torch.cuda.empty_cache()
+            except ImportError:
+                pass
+
+    def total_bytes(self):
+        return sum(size for _, size in self.models.values())
+
+    def is_loaded(self, path):
+        with self.lock: return path in self.models
+
+    def warm(self, path):
+        # バックグラウンドで読み込んでおく (読み込み済み・読み込み中なら何もしない)
+        with self.lock:
+            if path in self.models or path in self.loading: return
+        threading.Thread(target=self._load, args=(path,), name="ModelWarmup", daemon=True).start()
+
+    def activate(self, path):
+        # 読み込み済みならすぐに切り替わる。未読み込みなら読み込みが終わるまで待つ
+        self._load(path)
+        with self.lock:
+            if path not in self.models: raise self.errors.get(path) or RuntimeError(f"model not loaded: {path}")
+            self.active = path
+            self.models.move_to_end(path)
+            self._evict(keep=path)
+
+    def get(self):
+        with self.lock:
+            if self.active is None or self.active not in self.models: return None
+            self.models.move_to_end(self.active)
+            return self.models[self.active][0]
+
+    def loaded(self):
+        with self.lock: return [(path, size) for path, (_, size) in reversed(self.models.items())]
+
+class ModelRegistry:
+    # プロジェクトで使う重みファイルの一覧と、最後に使ったモデル (.model_registry.json)
+    def __init__(self, project_dir):
+        self.path = os.path.join(project_dir, ".model_registry.json")
+        self.models, self.active = [], None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f: data = json.load(f)
+            self.models = [p for p in data.get("models", []) if os.path.exists(p)]
+            self.active = data.get("active") if data.get("active") in self.models else None
+        except (OSError, ValueError):
+            pass
+
+    def add(self, path):
+        path = os.path.abspath(path)
+        if path not in self.models: self.models.append(path)
+        return path
+
+    def to_json(self):
+        return json.dumps({"models": self.models, "active": self.active}, ensure_ascii=False, indent=2)
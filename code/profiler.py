@@ -0,0 +1,120 @@
+# profiler.py
+import time
+import json
+import csv
+import threading
+from collections import deque
+
+# 計測無効時に返す共有の空コンテキスト (生成コストを発生させない)
+class _NullSpan:
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler; self.name = name; self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter())
+        return False
+
+def _percentile(sorted_values, p):
+    if not sorted_values: return 0.0
+    k = (len(sorted_values) - 1) * p / 100.0
+    f = int(k); c = min(f + 1, len(sorted_values) - 1)
+    return sorted_values[f] + (sorted_values[c] - sorted_values[f]) * (k - f)
+
+class StageProfiler:
+    def __init__(self, window=200, max_events=100000):
+        self.enabled = False
+        self.window = window
+        self.max_events = max_events
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.origin = time.perf_counter()
+            self.recent = {}      # name -> 直近window件の所要時間(秒)
+            self.totals = {}      # name -> [count, total, max]
+            self.events = deque(maxlen=self.max_events)  # Chrome trace用 (name, start, dur, tid)
+
+    def span(self, name):
+        if not self.enabled: return _NULL_SPAN
+        return _Span(self, name)
+
+    def record(self, name, start, end):
+        dur = end - start
+        with self.lock:
+            if name not in self.recent:
+                self.recent[name] = deque(maxlen=self.window)
+                self.totals[name] = [0, 0.0, 0.0]
+            self.recent[name].append(dur)
+            t = self.totals[name]
+            t[0] += 1; t[1] += dur
+            if dur > t[2]: t[2] = dur
+            self.events.append((name, start - self.origin, dur, threading.get_ident()))
+
+    def rolling_stats(self):
+        # {name: (p50_ms, p95_ms, 件数)} を直近window件から計算
+        with self.lock:
+            snapshot = {name: sorted(values) for name, values in self.recent.items()}
+        return {name: (_percentile(v, 50) * 1000, _percentile(v, 95) * 1000, len(v)) for name, v in snapshot.items()}
+
+    def percentiles(self, ps=(50, 95, 99)):
+        # {name: (件数, [各パーセンタイルの ms], 最大 ms)} を保持しているすべての計測から計算
+        with self.lock:
+            durations = {}
+            for name, _, dur, _ in self.events: durations.setdefault(name, []).append(dur)
+        result = {}
+        for name, values in durations.items():
+            values.sort()
+            result[name] = (len(values), [_percentile(values, p) * 1000 for p in ps], values[-1] * 1000)
+        return result
+
+    def overlay_text(self):
+        stats = self.rolling_stats()
+        if not stats: return "計測データなし"
+        lines = [f"{'stage':<14}{'p50':>8}{'p95':>8}"]
+        for name, (p50, p95, _) in sorted(stats.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name[:14]:<14}{p50:>7.1f}m{p95:>7.1f}m")
+        return "\n".join(lines)
+
+    def export_chrome_trace(self, path):
+        with self.lock: events = list(self.events)
+        pid = 1
+        trace = {"traceEvents": [{"name": name, "cat": "stage", "ph": "X", "ts": round(start * 1e6, 1), "dur": round(dur * 1e6, 1), "pid": pid, "tid": tid} for name, start, dur, tid in events],
+                 "displayTimeUnit": "ms"}
+        with open(path, 'w', encoding='utf-8') as f: json.dump(trace, f)
+        return len(events)
+
+    def export_csv(self, path):
+        with self.lock:
+            totals = {name: list(t) for name, t in self.totals.items()}
+            durations = {}
+            for name, _, dur, _ in self.events: durations.setdefault(name, []).append(dur)
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(["stage", "count", "total_ms", "mean_ms", "p50_ms", "p95_ms", "max_ms"])
+            for name, (count, total, max_dur) in sorted(totals.items()):
+                values = sorted(durations.get(name, []))
+                writer.writerow([name, count, f"{total*1000:.3f}", f"{total/count*1000:.3f}" if count else "0",
+                                 f"{_percentile(values, 50)*1000:.3f}", f"{_percentile(values, 95)*1000:.3f}", f"{max_dur*1000:.3f}"])
+        return len(totals)
+
+    def export_session(self, log_file_path):
+        # セッションログと同じ名前で trace.json / timing.csv を書き出す
+        if not log_file_path or not self.totals: return None
+        base = log_file_path[:-4] if log_file_path.endswith(".log") else log_file_path
+        trace_path, csv_path = f"{base}_trace.json", f"{base}_timing.csv"
+        self.export_chrome_trace(trace_path); self.export_csv(csv_path)
+        return trace_path, csv_path
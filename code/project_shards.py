@@ -0,0 +1,191 @@
+# project_shards.py
+import os
+import json
+from urllib.parse import quote, unquote
+from collections.abc import MutableMapping
+from filelock import FileLock
+
+STATUS_KEYS = ("approved", "rejected", "fixed")
+
+def split_image_key(key):
+    # "sub/dir/a.jpg" -> ("sub/dir", "a.jpg")。直下の画像は ("", "a.jpg")
+    folder, _, name = key.rpartition('/')
+    return folder, name
+
+def folder_of(key):
+    return key.rpartition('/')[0]
+
+def _write_json_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f: return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _merge_shard(path, changes, summary_path, folder, lock_path):
+    # ディスク上の最新のシャードに、このインスタンスで変更した画像だけを反映する (画像単位のマージ)
+    with FileLock(lock_path, timeout=30):
+        shard = _read_json(path)
+        for name, value in changes.items():
+            if value is None: shard.pop(name, None)
+            else: shard[name] = value
+        _write_json_atomic(path, shard)
+        summary = _read_json(summary_path)
+        summary[folder] = _count_statuses(shard)
+        _write_json_atomic(summary_path, summary)
+    return shard
+
+def _count_statuses(shard):
+    counts = dict.fromkeys(STATUS_KEYS, 0)
+    for status in shard.values():
+        if status in counts: counts[status] += 1
+    return counts
+
+class ShardedApprovalStatus(MutableMapping):
+    # 承認ステータスをフォルダ単位のファイルに分割して保持し、必要になったシャードだけ読み込む
+    # 直下フォルダのシャードは従来通り .{image_dir_name}_approval.json (キーはファイル名のみ)
+    def __init__(self, project_dir, image_dir_name):
+        self.legacy_path = os.path.join(project_dir, f".{image_dir_name}_approval.json")
+        self.shard_dir = os.path.join(project_dir, f".{image_dir_name}_approval")
+        self.summary_path = os.path.join(self.shard_dir, "_summary.json")
+        self.lock_path = self.legacy_path + ".lock"
+        self.shards = {}
+        self.mtimes = {}  # folder -> 読み込んだときのシャードファイルの mtime
+        self.dirty = set()
+        self.changes = {}    # folder -> {name: status (削除は None)}  未保存の変更
+        self.unwritten = {}  # save() 済みでまだディスクに反映されていない変更
+        self.summary = self._load_summary()
+        # submit(path, fn, on_done) を設定すると書き込みをバックグラウンドに回す
+        # 同じパスの未実行の書き込みはまとめられるので、毎回それまでの未反映分をすべて渡す
+        self.submit = None
+
+    def _shard_path(self, folder):
+        if not folder: return self.legacy_path
+        return os.path.join(self.shard_dir, quote(folder, safe='') + ".json")
+
+    def _load_summary(self):
+        try:
+            with open(self.summary_path, 'r', encoding='utf-8') as f: return json.load(f)
+        except (OSError, ValueError):
+            pass
+        # サマリがない (旧形式のプロジェクト) 場合は既存シャードから再構築
+        summary = {}
+        if os.path.exists(self.legacy_path): summary[""] = _count_statuses(self._load(""))
+        if os.path.isdir(self.shard_dir):
+            for name in os.listdir(self.shard_dir):
+                if name.endswith(".json") and not name.startswith("_"):
+                    folder = unquote(name[:-5]); summary[folder] = _count_statuses(self._load(folder))
+        return summary
+
+    def _load(self, folder):
+        shard = self.shards.get(folder)
+        if shard is None:
+            try:
+                with open(self._shard_path(folder), 'r', encoding='utf-8') as f:
+                    self.mtimes[folder] = os.fstat(f.fileno()).st_mtime_ns; shard = json.load(f)
+            except (OSError, ValueError):
+                shard = {}
+            self.shards[folder] = shard
+        return shard
+
+    def refresh(self, key):
+        # key のフォルダのシャードを他のインスタンスが書き換えていたら読み直す (未保存の変更があるフォルダはそのまま)
+        folder, _ = split_image_key(key)
+        if folder in self.dirty or self.unwritten.get(folder): return
+        try: mtime = os.stat(self._shard_path(folder)).st_mtime_ns
+        except OSError: return
+        if folder in self.shards and self.mtimes.get(folder) == mtime: return
+        self.shards.pop(folder, None)
+        self.summary[folder] = _count_statuses(self._load(folder))
+
+    def __getitem__(self, key):
+        folder, name = split_image_key(key)
+        if folder not in self.shards and folder not in self.summary: raise KeyError(key)
+        return self._load(folder)[name]
+
+    def __setitem__(self, key, value):
+        folder, name = split_image_key(key)
+        self._load(folder)[name] = value; self.dirty.add(folder)
+        self.changes.setdefault(folder, {})[name] = value
+
+    def __delitem__(self, key):
+        folder, name = split_image_key(key)
+        del self._load(folder)[name]; self.dirty.add(folder)
+        self.changes.setdefault(folder, {})[name] = None
+
+    def reload(self):
+        # 他のインスタンスの変更を取り込む (未保存の変更がある場合は何もしない)
+        if self.dirty or any(self.unwritten.values()): return
+        self.shards = {}
+        self.summary = self._load_summary()
+
+    def _folders(self):
+        return set(self.summary) | set(self.shards)
+
+    def __iter__(self):
+        for folder in sorted(self._folders()):
+            for name in list(self._load(folder)):
+                yield f"{folder}/{name}" if folder else name
+
+    def __len__(self):
+        return sum(len(self._load(folder)) for folder in self._folders())
+
+    def counts(self):
+        # 読み込み済みで未保存のシャードだけ再集計し、それ以外はサマリを使う
+        totals = dict.fromkeys(STATUS_KEYS, 0)
+        for folder in self._folders():
+            counts = _count_statuses(self.shards[folder]) if folder in self.dirty else self.summary.get(folder, {})
+            for key in STATUS_KEYS: totals[key] += counts.get(key, 0)
+        return totals
+
+    def folders_with(self, status):
+        return {folder for folder in self._folders()
+                if (_count_statuses(self.shards[folder]) if folder in self.dirty else self.summary.get(folder, {})).get(status, 0) > 0}
+
+    def keys_with(self, status):
+        # status の画像があるフォルダのシャードだけを読み込む
+        for folder in sorted(self.folders_with(status)):
+            for name, value in list(self._load(folder).items()):
+                if value == status: yield f"{folder}/{name}" if folder else name
+
+    def reader(self):
+        # ワーカースレッド用: {画像キー: ステータス} を返す関数。シャードはスレッド側でファイルから読み、
+        # ディスクにまだ反映されていない変更だけをここで写しておく
+        paths = {folder: self._shard_path(folder) for folder in self._folders()}
+        overlay = {}
+        for pending in (self.unwritten, self.changes):
+            for folder, names in pending.items(): overlay.setdefault(folder, {}).update(names)
+
+        def read():
+            statuses = {}
+            for folder, path in sorted(paths.items()):
+                shard = _read_json(path); shard.update(overlay.get(folder, {}))
+                statuses.update((f"{folder}/{name}" if folder else name, value) for name, value in shard.items() if value is not None)
+            return statuses
+        return read
+
+    def save(self):
+        # 複数のインスタンスが同じフォルダを扱っても上書きし合わないよう、変更した画像だけをファイルロック下でマージする
+        if not self.dirty: return
+        for folder in sorted(self.dirty):
+            pending = self.unwritten.setdefault(folder, {})
+            pending.update(self.changes.pop(folder, {}))
+            path, snapshot = self._shard_path(folder), dict(pending)
+            args = (path, snapshot, self.summary_path, folder, self.lock_path)
+            if self.submit:
+                self.submit(path, lambda args=args: _merge_shard(*args), lambda result, error, folder=folder, snapshot=snapshot: self._written(folder, snapshot, error))
+            else:
+                _merge_shard(*args); self._written(folder, snapshot, None)
+            self.summary[folder] = _count_statuses(self.shards[folder])
+        self.dirty.clear()
+
+    def _written(self, folder, snapshot, error):
+        if error is not None: return  # 次回の save() で再度マージする
+        pending = self.unwritten.get(folder, {})
+        for name, value in snapshot.items():
+            if name in pending and pending[name] == value: del pending[name]
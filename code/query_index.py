@@ -0,0 +1,228 @@
+# query_index.py
+# 画像ごとの属性 (ステータス・クラス・ボックス数・推論の確信度・最終編集時刻) を列で保持し、簡単なクエリで作業キューを作る
+#   status:rejected class:bicycle         却下された画像のうち bicycle を含むもの (空白区切りは AND)
+#   boxes>30 or unlabeled                  or で区切ったまとまりのどれかに当てはまるもの
+#   edited>=monday -status:approved        月曜以降に編集され、承認済みでないもの (- は否定)
+#   conf<0.5 model:best.pt folder:cam1     自動アノテーションの平均確信度・モデル・フォルダ
+import os
+import re
+import json
+import shlex
+import datetime
+import numpy as np
+
+INDEX_VERSION = 1
+STATUS_CODES = {None: 0, "approved": 1, "rejected": 2, "fixed": 3}
+STATUS_ALIASES = {"none": 0, "unreviewed": 0, "未確認": 0, "approved": 1, "rejected": 2, "fixed": 3}
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+_COMPARISON = re.compile(r"^(boxes|conf|minconf|edited)(>=|<=|!=|>|<|=|:)(.+)$")
+_OPERATORS = {">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal, "=": np.equal, ":": np.equal, "!=": np.not_equal}
+
+def parse_time(text, now=None):
+    # today / yesterday / monday〜sunday (直近のその曜日の0時) / 7d・12h (今からさかのぼる) / 2026-10-12 (ISO形式)
+    now = now or datetime.datetime.now()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    text = text.lower()
+    if text == "today": return midnight.timestamp()
+    if text == "yesterday": return (midnight - datetime.timedelta(days=1)).timestamp()
+    if text in WEEKDAYS: return (midnight - datetime.timedelta(days=(now.weekday() - WEEKDAYS.index(text)) % 7)).timestamp()
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([dh])", text)
+    if match: return (now - datetime.timedelta(**{"days" if match[2] == "d" else "hours": float(match[1])})).timestamp()
+    try: return datetime.datetime.fromisoformat(text).timestamp()
+    except ValueError: raise ValueError(f"日時を解釈できません: {text}") from None
+
+class QueryIndex:
+    # 画像1枚 = 1行。keys の順 (all_image_files の並び) のまま結果を返す
+    def __init__(self, keys):
+        self.keys = list(keys)
+        n = len(self.keys)
+        self.position = {key: i for i, key in enumerate(self.keys)}
+        # 画像キーは必ず拡張子付きなので splitext より速い rpartition で十分
+        self.stem_position = {key.rpartition('.')[0]: i for i, key in enumerate(self.keys)}
+        self.status = np.zeros(n, np.int8)
+        self.labeled = np.zeros(n, bool)
+        self.box_count = np.zeros(n, np.int32)
+        self.edited = np.full(n, np.nan)
+        self.conf_mean = np.full(n, np.nan, np.float32)
+        self.conf_min = np.full(n, np.nan, np.float32)
+        self.model = np.full(n, -1, np.int16)
+        self.model_names = []
+        # クラスの有無は1クラス1ビットで持つ (100万枚 x 80クラスで約10MB)
+        self.class_bits = np.zeros((n, 1), np.uint8)
+        folders = {}
+        self.folder = np.array([folders.setdefault(key.rpartition('/')[0], len(folders)) for key in self.keys], np.int32)
+        self.folder_names = list(folders)
+        self.preannotation_offset = 0
+
+    def _ensure_class_width(self, class_id):
+        width = class_id // 8 + 1
+        if width > self.class_bits.shape[1]: self.class_bits = np.pad(self.class_bits, ((0, 0), (0, width - self.class_bits.shape[1])))
+
+    def load_table(self, table):
+        # analytics.LabelTable (txt の差分解析キャッシュ・SQLite の列) から、ラベルのある画像の列をまとめて埋める
+        rows = np.fromiter((self.stem_position.get(stem, -1) for stem in table.stems.tolist()), np.int64, count=len(table.stems))
+        found = rows >= 0
+        self.labeled[rows[found]] = True
+        self.box_count[rows[found]] = table.counts[found]
+        self.edited[rows[found]] = table.mtimes[found] / 1e9
+        if not len(table): return
+        image_rows = rows[table.image]
+        valid = (image_rows >= 0) & (table.cls >= 0)
+        image_rows, cls = image_rows[valid], table.cls[valid]
+        if not len(cls): return
+        # 重複を除く unique は遅いので、一度 bool の行列に立ててからビットに詰める
+        present = np.zeros((len(self.keys), (int(cls.max()) // 8 + 1) * 8), bool)
+        present[image_rows, cls] = True
+        self.class_bits = np.packbits(present, axis=1)
+
+    def load_statuses(self, status_map):
+        for key, status in status_map.items():
+            i = self.position.get(key)
+            if i is not None: self.status[i] = STATUS_CODES.get(status, 0)
+
+    def load_preannotations(self, path):
+        # 自動アノテーションの記録 (.<フォルダ名>_preannotations.jsonl) は前回読んだ位置から続きだけを読む
+        try:
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < self.preannotation_offset: self.preannotation_offset = 0
+                f.seek(self.preannotation_offset)
+                for line in f:
+                    if not line.endswith(b"\n"): break  # 書き込み途中の行は次回に読む
+                    self.preannotation_offset += len(line)
+                    try: record = json.loads(line)
+                    except ValueError: continue
+                    self.record_preannotation(record.get("image"), record.get("model"), record.get("conf"))
+        except OSError:
+            pass
+
+    def record_preannotation(self, key, model, confidences):
+        i = self.position.get(key)
+        if i is None: return
+        if model:
+            name = os.path.basename(model)
+            if name not in self.model_names: self.model_names.append(name)
+            self.model[i] = self.model_names.index(name)
+        if confidences: self.conf_mean[i], self.conf_min[i] = float(np.mean(confidences)), float(np.min(confidences))
+        else: self.conf_mean[i] = self.conf_min[i] = np.nan
+
+    def update_labels(self, stem, rows, mtime=None):
+        # 保存直後の1枚分をその場で反映する (rows が None ならラベル削除)
+        i = self.stem_position.get(stem)
+        if i is None: return
+        self.class_bits[i] = 0
+        if rows is None:
+            self.labeled[i], self.box_count[i], self.edited[i] = False, 0, np.nan; return
+        self.labeled[i], self.box_count[i] = True, len(rows)
+        self.edited[i] = mtime if mtime is not None else datetime.datetime.now().timestamp()
+        for class_id in {int(row[0]) for row in rows}:
+            if class_id < 0: continue
+            self._ensure_class_width(class_id)
+            self.class_bits[i, class_id >> 3] |= 1 << (7 - (class_id & 7))
+
+    def set_status(self, key, status):
+        i = self.position.get(key)
+        if i is not None: self.status[i] = STATUS_CODES.get(status, 0)
+
+    def _has_class(self, class_id):
+        if class_id >> 3 >= self.class_bits.shape[1]: return np.zeros(len(self.keys), bool)
+        return (self.class_bits[:, class_id >> 3] & (1 << (7 - (class_id & 7)))) != 0
+
+    def _term(self, term, class_names):
+        if term in ("labeled", "unlabeled"): return self.labeled if term == "labeled" else ~self.labeled
+        field, _, value = term.partition(":")
+        if field == "status" and value:
+            if value.lower() not in STATUS_ALIASES: raise ValueError(f"不明なステータス: {value}")
+            return self.status == STATUS_ALIASES[value.lower()]
+        if field == "class" and value:
+            if value in class_names: return self._has_class(class_names.index(value))
+            if value.isdigit(): return self._has_class(int(value))
+            lowered = [name.lower() for name in class_names]
+            if value.lower() in lowered: return self._has_class(lowered.index(value.lower()))
+            raise ValueError(f"classes.yaml に無いクラス: {value}")
+        if field == "model" and value:
+            return np.isin(self.model, [i for i, name in enumerate(self.model_names) if value.lower() in name.lower()])
+        if field == "folder":
+            return np.isin(self.folder, [i for i, name in enumerate(self.folder_names) if name == value.strip('/') or name.startswith(value.strip('/') + '/')])
+        match = _COMPARISON.match(term)
+        if not match: raise ValueError(f"解釈できない条件: {term}")
+        field, op, value = match.groups()
+        if field == "edited": column, target = self.edited, parse_time(value)
+        else:
+            column = {"boxes": self.box_count, "conf": self.conf_mean, "minconf": self.conf_min}[field]
+            try: target = float(value)
+            except ValueError: raise ValueError(f"数値ではありません: {term}") from None
+        # 値の無い画像 (未編集・自動アノテーションなし) は != も含めてどの比較にも当てはまらない
+        with np.errstate(invalid='ignore'): result = _OPERATORS[op](column, target)
+        return result & ~np.isnan(column) if column.dtype.kind == 'f' else result
+
+    def mask(self, text, class_names):
+        # 空白区切りの条件は AND、"or" で区切ったまとまりは OR。先頭の "-" は否定
+        try: tokens = shlex.split(text)
+        except ValueError as e: raise ValueError(f"クエリを解釈できません: {e}") from None
+        groups, current = [], []
+        for token in tokens + ["or"]:
+            if token.lower() == "or":
+                if current: groups.append(current)
+                current = []; continue
+            current.append(token)
+        result = np.zeros(len(self.keys), bool) if groups else np.ones(len(self.keys), bool)
+        for group in groups:
+            group_mask = np.ones(len(self.keys), bool)
+            for token in group:
+                negate = token.startswith("-") and len(token) > 1
+                term_mask = self._term(token[1:] if negate else token, class_names)
+                group_mask &= ~term_mask if negate else term_mask
+            result |= group_mask
+        return result
+
+    def query(self, text, class_names, exclude=None):
+        mask = self.mask(text, class_names)
+        if exclude is not None: mask &= ~exclude
+        keys = self.keys
+        return [keys[i] for i in np.flatnonzero(mask).tolist()]
+
+    def exclusion_mask(self, excluded):
+        mask = np.zeros(len(self.keys), bool)
+        rows = [self.position[key] for key in excluded if key in self.position]
+        mask[rows] = True
+        return mask
+
+    def save(self, path):
+        # 確信度・モデルだけを保存する (ラベル由来の列は analytics のテーブルキャッシュ、ステータスはシャード/SQLite が正)
+        has = ~np.isnan(self.conf_mean) | (self.model >= 0)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, version=INDEX_VERSION, keys=np.array(self.keys, dtype=str)[has] if has.any() else np.array([], dtype=str),
+                     conf_mean=self.conf_mean[has], conf_min=self.conf_min[has], model=self.model[has],
+                     model_names=np.array(self.model_names, dtype=str), offset=self.preannotation_offset)
+        os.replace(tmp_path, path)
+
+    def load_saved(self, path):
+        try:
+            with np.load(path) as data:
+                if int(data["version"]) != INDEX_VERSION: return False
+                self.model_names = data["model_names"].tolist()
+                for key, mean, low, model in zip(data["keys"].tolist(), data["conf_mean"], data["conf_min"], data["model"]):
+                    i = self.position.get(key)
+                    if i is not None: self.conf_mean[i], self.conf_min[i], self.model[i] = mean, low, model
+                self.preannotation_offset = int(data["offset"])
+                return True
+        except (OSError, KeyError, ValueError):
+            return False
+
+def build_query_index(keys, table, status_map, preannotation_path, saved_path=None):
+    index = QueryIndex(keys)
+    index.load_table(table)
+    index.load_statuses(status_map)
+    if saved_path: index.load_saved(saved_path)
+    before = index.preannotation_offset
+    index.load_preannotations(preannotation_path)
+    if saved_path and index.preannotation_offset != before:
+        try: index.save(saved_path)
+        except Exception as e: print(f"Query index writing error: {e}")
+    return index
+
+def index_paths(project_dir, image_dir):
+    image_dir_name = os.path.basename(os.path.normpath(image_dir))
+    return (os.path.join(project_dir, f".{image_dir_name}_label_table.npz"), os.path.join(project_dir, f".{image_dir_name}_preannotations.jsonl"),
+            os.path.join(project_dir, f".{image_dir_name}_query_index.npz"))
@@ -0,0 +1,262 @@
+# remote_source.py
+# fsspec の URL (s3://bucket/data/images, file:///mnt/nas/images, memory://... など) を画像フォルダとして扱う
+# 画像は容量上限付きのローカルキャッシュに読み込み (キューの先の画像は並列に先読み)、ラベルはローカルに複製して変更分をまとめて書き戻す
+# アプリの他の部分はキャッシュ側のローカルパス (image_dir / labels_dir) をそのまま使う
+import os
+import json
+import queue
+import hashlib
+import posixpath
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import fsspec
+from utils import IMAGE_EXTENSIONS
+from io_executor import write_text_atomic
+
+def is_remote_url(path):
+    return "://" in path
+
+def cache_dir_for(project_dir, url):
+    # URL ごとに別のキャッシュフォルダ (同じ名前のフォルダが別のバケットにあっても混ざらないように)
+    url = url.rstrip('/')
+    digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:10]
+    return os.path.join(project_dir, ".remote_cache", f"{posixpath.basename(url)}_{digest}")
+
+def _version(info):
+    # ファイルの版を表す値 (ファイルシステムによって更新時刻のキー名が違う)
+    for key in ("ETag", "etag", "mtime", "LastModified", "last_modified", "updated", "created"):
+        if info.get(key) is not None: return f"{info.get('size')}:{info[key]}"
+    return f"{info.get('size')}:"
+
+class RemoteSource:
+    def __init__(self, url, cache_dir, max_bytes=10 * 1024 ** 3, workers=8):
+        self.url = url.rstrip('/')
+        self.fs, self.root = fsspec.core.url_to_fs(self.url)
+        self.root = self.root.rstrip('/')
+        # ローカルと同じく、ラベルは画像フォルダと同じ階層の labels に置く
+        self.labels_root = posixpath.join(posixpath.dirname(self.root), "labels")
+        # キャッシュ側の画像フォルダ名はリモートと同じにする (プロジェクトのステータスファイル名が変わらないように)
+        self.cache_dir = cache_dir
+        self.image_dir = os.path.join(cache_dir, posixpath.basename(self.root))
+        self.labels_dir = os.path.join(cache_dir, "labels")
+        self.manifest_path = os.path.join(cache_dir, "labels_manifest.json")
+        self.max_bytes = max_bytes
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="RemoteFetch")
+        self.lock = threading.Lock()
+        self.cached = OrderedDict()  # 画像キー -> バイト数 (末尾ほど最近使ったもの)
+        self.total_bytes = 0
+        self.fetching = {}  # 画像キー -> Future
+        self.pinned = set()  # 表示中・先読み中で消してはいけない画像
+        self.dirty = set()  # リモートへの書き戻し待ちのラベル (ステム)
+        self.hits = self.misses = self.evicted = 0
+        self.manifest = {}
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f: self.manifest = json.load(f)
+        except (OSError, ValueError):
+            pass
+        self._load_cached()
+
+    def _load_cached(self):
+        # 前回までにキャッシュした画像を、更新時刻の古い順に LRU へ並べる (途中で止まった .part は消す)
+        found = []
+        for dirpath, _, files in os.walk(self.image_dir):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                if name.endswith(".part"):
+                    try: os.remove(path)
+                    except OSError: pass
+                    continue
+                st = os.stat(path)
+                found.append((st.st_mtime, os.path.relpath(path, self.image_dir).replace(os.sep, '/'), st.st_size))
+        for _, key, size in sorted(found):
+            self.cached[key] = size; self.total_bytes += size
+
+    def local_path(self, key):
+        return os.path.join(self.image_dir, key)
+
+    def _remote(self, root, rel):
+        return posixpath.join(root, rel)
+
+    def list_images(self, recursive=False):
+        # 返り値: [(画像キー, バイト数)]。動画はフレームへの展開にファイル全体が必要なので対象外
+        entries = self.fs.find(self.root, detail=True) if recursive else {e["name"]: e for e in self.fs.ls(self.root, detail=True)}
+        prefix = self.root + "/"
+        images = []
+        for name, info in entries.items():
+            if info.get("type") != "file" or not name.lower().endswith(IMAGE_EXTENSIONS): continue
+            name = name.rstrip('/')
+            images.append((name[len(prefix):] if name.startswith(prefix) else posixpath.basename(name), info.get("size") or 0))
+        return sorted(images)
+
+    # --- 画像の読み込み ---
+
+    def fetch(self, key):
+        # キャッシュ済みならすぐに完了した Future、未取得ならダウンロードを投入した Future を返す
+        with self.lock:
+            if key in self.cached:
+                self.cached.move_to_end(key); self.hits += 1
+                future = Future(); future.set_result(self.local_path(key))
+                return future
+            future = self.fetching.get(key)
+            if future is None:
+                self.misses += 1
+                future = self.fetching[key] = self.pool.submit(self._download, key)
+            return future
+
+    def _download(self, key):
+        path = self.local_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".part"
+            self.fs.get_file(self._remote(self.root, key), tmp_path)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+            with self.lock:
+                self.cached[key] = size; self.total_bytes += size
+                self._evict()
+            return path
+        finally:
+            with self.lock: self.fetching.pop(key, None)
+
+    def _evict(self):
+        # 上限を超えたら、表示中・先読み中でない画像を使っていない期間が長いものから消す
+        while self.total_bytes > self.max_bytes:
+            victim = next((k for k in self.cached if k not in self.pinned), None)
+            if victim is None: break
+            self.total_bytes -= self.cached.pop(victim); self.evicted += 1
+            try: os.remove(self.local_path(victim))
+            except OSError: pass
+
+    def ensure(self, key):
+        # 表示する画像 (取得が終わるまで待つ)
+        return self.fetch(key).result()
+
+    def prefetch(self, keys):
+        # キューの先の画像を並列に取得しておく。取得中・表示中の画像はキャッシュから消さない
+        keys = list(keys)
+        with self.lock: self.pinned = set(keys)
+        for key in keys: self.fetch(key)
+
+    def fetch_many(self, keys, progress=None):
+        # 一括処理 (エクスポートなど) 用。返り値: 取得できなかった画像キー
+        futures = [(key, self.fetch(key)) for key in keys]
+        failed = []
+        for n, (key, future) in enumerate(futures, 1):
+            try: future.result()
+            except Exception: failed.append(key)
+            if progress: progress(n, len(futures))
+        return failed
+
+    # --- ラベル ---
+
+    def sync_labels(self, cancel=None):
+        # リモートのラベルのうち、前回から変わったものだけをローカルへ取得する (書き戻し待ちのものは上書きしない)
+        # 返り値: [(ステム, バイト数)] (ローカルにあるすべてのラベル)
+        remote = self.fs.find(self.labels_root, detail=True) if self.fs.exists(self.labels_root) else {}
+        prefix = self.labels_root + "/"
+        wanted = []
+        for name, info in remote.items():
+            if info.get("type") != "file" or not name.endswith(".txt") or not name.startswith(prefix): continue
+            stem, version = name[len(prefix):-4], _version(info)
+            with self.lock:
+                if stem in self.dirty: continue
+            local = os.path.join(self.labels_dir, f"{stem}.txt")
+            known = self.manifest.get(stem)
+            # 自分で書き戻したファイル (版が未記録) はサイズが同じならそのまま版だけ記録する
+            if known == version and os.path.exists(local): continue
+            if known is None and stem in self.manifest and os.path.exists(local) and os.path.getsize(local) == info.get("size"):
+                self.manifest[stem] = version; continue
+            wanted.append((stem, name, version))
+
+        def download(item):
+            stem, name, version = item
+            if cancel is not None and cancel.is_set(): return None
+            data = self.fs.cat_file(name)
+            path = os.path.join(self.labels_dir, f"{stem}.txt")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'wb') as f: f.write(data)
+            os.replace(tmp_path, path)
+            return stem, version
+
+        for result in self.pool.map(download, wanted):
+            if result: self.manifest[result[0]] = result[1]
+        write_text_atomic(self.manifest_path, json.dumps(self.manifest, ensure_ascii=False))
+        labels = []
+        for dirpath, _, files in os.walk(self.labels_dir):
+            for name in files:
+                if name.endswith(".txt"):
+                    path = os.path.join(dirpath, name)
+                    labels.append((os.path.relpath(path, self.labels_dir)[:-4].replace(os.sep, '/'), os.path.getsize(path)))
+        return labels
+
+    def mark_dirty(self, stem):
+        with self.lock: self.dirty.add(stem)
+
+    def take_dirty(self):
+        # 書き戻すラベルを取り出す。呼び出した時点までにローカルへの書き込みを投入済みのものが対象
+        with self.lock:
+            batch, self.dirty = self.dirty, set()
+        return batch
+
+    def upload(self, stems):
+        # ローカルのラベルをまとめてリモートへ書き戻す (ローカルに無いものはリモートからも消す)。失敗した分は次回に回す
+        puts, removes = [], []
+        for stem in sorted(stems):
+            local = os.path.join(self.labels_dir, f"{stem}.txt")
+            (puts if os.path.exists(local) else removes).append((stem, local, self._remote(self.labels_root, f"{stem}.txt")))
+        try:
+            if puts:
+                self.fs.makedirs(self.labels_root, exist_ok=True)
+                self.fs.put([local for _, local, _ in puts], [rpath for _, _, rpath in puts])
+            for _, _, rpath in removes:
+                if self.fs.exists(rpath): self.fs.rm(rpath)
+        except Exception:
+            with self.lock: self.dirty.update(stems)
+            raise
+        for stem, _, _ in puts: self.manifest[stem] = None
+        for stem, _, _ in removes: self.manifest.pop(stem, None)
+        write_text_atomic(self.manifest_path, json.dumps(self.manifest, ensure_ascii=False))
+        return len(puts) + len(removes)
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+class RemoteScanner:
+    # FolderScanner と同じメッセージを出す (アプリ側の走査処理をそのまま使う)
+    def __init__(self, source, recursive=False, batch_size=2000):
+        self.source, self.recursive, self.batch_size = source, recursive, batch_size
+        self.messages = queue.Queue()
+        self._cancel = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="RemoteScanner", daemon=True).start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def drain(self, limit=100):
+        items = []
+        try:
+            while len(items) < limit: items.append(self.messages.get_nowait())
+        except queue.Empty:
+            pass
+        return items
+
+    def _run(self):
+        try:
+            labels = self.source.sync_labels(self._cancel)
+            if self._cancel.is_set(): return
+            self.messages.put(("label_names", [stem for stem, _ in labels]))
+            images = self.source.list_images(self.recursive)
+            for i in range(0, len(images), self.batch_size): self.messages.put(("images", images[i:i + self.batch_size]))
+            self.messages.put(("label_sizes", labels))
+            self.messages.put(("dirs", ([], [])))
+            self.messages.put(("done", None))
+        except Exception as e:
+            self.messages.put(("error", str(e)))
@@ -0,0 +1,250 @@
+# review_server.py
+# 複数人がブラウザから承認・却下できるローカルレビューサーバー (標準ライブラリのみ)
+#   python review_server.py <プロジェクトフォルダ> <画像フォルダ> [--port 8765] [--recursive]
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from utils import load_class_names, IMAGE_EXTENSIONS
+from folder_scanner import iter_tree
+from project_shards import ShardedApprovalStatus
+from label_store import TxtLabelStore, SqliteLabelStore
+from video_source import is_video, probe_frame_count, expand_video, open_source_image, split_frame_key, VideoFrameCache
+
+LEASE_SECONDS = 600
+RESCAN_SECONDS = 60
+
+class ResizedImageCache:
+    # 縮小済み JPEG を全レビュアーで共有する。キーに mtime・サイズを含めるので画像が更新されれば作り直される
+    def __init__(self, cache_dir, frame_cache, max_side=1280):
+        self.cache_dir, self.frame_cache, self.max_side = cache_dir, frame_cache, max_side
+        self.locks, self.locks_guard = {}, threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, image_path):
+        frame = split_frame_key(image_path)
+        st = os.stat(frame[0] if frame else image_path)
+        digest = hashlib.sha1(f"{image_path}:{st.st_mtime_ns}:{st.st_size}:{self.max_side}".encode('utf-8')).hexdigest()
+        path = os.path.join(self.cache_dir, digest + ".jpg")
+        if os.path.exists(path): return path
+        # 同じ画像への同時リクエストではデコードを1回だけにする
+        with self.locks_guard: lock = self.locks.setdefault(digest, threading.Lock())
+        with lock:
+            if not os.path.exists(path):
+                source = open_source_image(image_path, self.frame_cache)
+                source.draft('RGB', (self.max_side, self.max_side))
+                image = source.convert('RGB') if source.mode != 'RGB' else source.copy()
+                if not frame: source.close()
+                image.thumbnail((self.max_side, self.max_side))
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                image.save(tmp_path, "JPEG", quality=85)
+                os.replace(tmp_path, path)
+        with self.locks_guard: self.locks.pop(digest, None)
+        return path
+
+class ReviewState:
+    # 承認ストアへの書き込みとキューの払い出しはすべて self.lock で直列化する
+    def __init__(self, project_dir, image_dir, recursive=False):
+        self.project_dir, self.image_dir, self.recursive = project_dir, image_dir, recursive
+        self.labels_dir = os.path.join(os.path.dirname(os.path.abspath(image_dir)), "labels")
+        image_dir_name = os.path.basename(os.path.normpath(image_dir))
+        self.class_names = load_class_names(project_dir) or []
+        db_path = os.path.join(project_dir, f".{image_dir_name}_labels.sqlite")
+        if os.path.exists(db_path):
+            self.store = SqliteLabelStore(db_path, self.labels_dir, check_same_thread=False)
+            self.status = self.store.status_view()
+        else:
+            self.store = TxtLabelStore(self.labels_dir)
+            self.status = ShardedApprovalStatus(project_dir, image_dir_name)
+        self.frame_cache = VideoFrameCache()
+        self.images = ResizedImageCache(os.path.join(project_dir, f".{image_dir_name}_web_cache"), self.frame_cache)
+        self.lock = threading.Lock()
+        self.leases = {}            # 画像 -> (client, 期限)
+        self.candidates = deque()
+        self.known = set()
+        self.last_scan = 0
+        self.scanning = False
+        self.decided = 0
+
+    def _labeled_stems(self):
+        # ロックの外 (rescan) から呼ぶ。SQLite の接続は他のスレッドと共有しているので、クエリだけはロック下で行う
+        if self.store.kind == "sqlite":
+            with self.lock: return set(self.store.label_sizes())
+        stems = set()
+        for rel, files in iter_tree(self.labels_dir, self.recursive) if os.path.isdir(self.labels_dir) else ():
+            prefix = f"{rel}/" if rel else ""
+            stems.update(prefix + e.name[:-4] for e in files if e.name.endswith(".txt"))
+        return stems
+
+    def _refresh(self, key):
+        # Tk アプリなど他のインスタンスが付けたステータスを取り込む (SQLite は常に DB を読むので不要)
+        if hasattr(self.status, "refresh"): self.status.refresh(key)
+
+    def rescan(self):
+        # 未判定 (ステータスなし / 修正済み) かつラベルありの画像を候補に追加する
+        # フォルダの走査はロックの外で行い、他のクライアントの判定・払い出しを止めない
+        labeled, found = self._labeled_stems(), []
+        for rel, files in iter_tree(self.image_dir, self.recursive):
+            prefix = f"{rel}/" if rel else ""
+            for entry in files:
+                name = entry.name.lower()
+                if is_video(name): found += [k for k, _ in expand_video(prefix + entry.name, 0, probe_frame_count(entry.path))]
+                elif name.endswith(IMAGE_EXTENSIONS): found.append(prefix + entry.name)
+        with self.lock:
+            for key in sorted(found):
+                if key in self.known or os.path.splitext(key)[0] not in labeled: continue
+                self._refresh(key)
+                if self.status.get(key) in (None, "fixed"): self.candidates.append(key); self.known.add(key)
+            self.last_scan = time.time()
+
+    def lease(self, client, count):
+        now = time.time()
+        with self.lock:
+            mine = [k for k, (c, expires) in self.leases.items() if c == client and expires > now]
+            scan = len(mine) < count and (not self.candidates or now - self.last_scan > RESCAN_SECONDS) and not self.scanning
+            if scan: self.scanning = True
+        if scan:
+            try: self.rescan()
+            finally:
+                with self.lock: self.scanning = False
+        with self.lock:
+            mine = [k for k, (c, expires) in self.leases.items() if c == client and expires > now]
+            checked = 0
+            # 期限切れのリースは候補に戻し、他のクライアントが持っている画像は渡さない
+            while len(mine) < count and self.candidates and checked < len(self.candidates) + 1:
+                key = self.candidates.popleft(); checked += 1
+                self._refresh(key)
+                if self.status.get(key) not in (None, "fixed"): self.known.discard(key); continue
+                holder = self.leases.get(key)
+                if key in mine or (holder and holder[0] != client and holder[1] > now): self.candidates.append(key); continue
+                self.leases[key] = (client, now + LEASE_SECONDS); mine.append(key)
+                self.candidates.append(key)  # 判定されずに期限が切れたら再び払い出せるよう末尾に残す
+            for key in mine: self.leases[key] = (client, now + LEASE_SECONDS)
+            return [self.describe(key) for key in mine]
+
+    def describe(self, key):
+        rows = self.store.read(os.path.splitext(key)[0]) or []
+        names = self.class_names
+        return {"image": key, "status": self.status.get(key),
+                "boxes": [{"class_id": int(c), "name": names[int(c)] if int(c) < len(names) else str(int(c)), "cx": x, "cy": y, "w": w, "h": h} for c, x, y, w, h in rows]}
+
+    def set_status(self, client, key, status):
+        # 返り値: None (成功) またはエラー (HTTP ステータス, メッセージ)
+        with self.lock:
+            if key not in self.known: return 404, "unknown image"
+            holder = self.leases.get(key)
+            if holder and holder[0] != client and holder[1] > time.time(): return 409, "leased by another reviewer"
+            # 払い出した後に Tk アプリなどで判定済みになった画像は上書きしない
+            self._refresh(key)
+            if self.status.get(key) not in (None, "fixed"): self.leases.pop(key, None); self.known.discard(key); return 409, "already decided"
+            self.status[key] = status
+            self.status.save()
+            self.leases.pop(key, None); self.decided += 1
+            return None
+
+    def stats(self):
+        with self.lock:
+            now = time.time()
+            return {"counts": self.status.counts(), "queued": len(self.candidates), "decided_this_session": self.decided,
+                    "reviewers": len({c for c, expires in self.leases.values() if expires > now})}
+
+class ReviewHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def log_message(self, format, *args): pass
+
+    def _send(self, code, body, content_type="application/json; charset=utf-8", headers=()):
+        if isinstance(body, (dict, list)): body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        elif isinstance(body, str): body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header("Content-Type", content_type); self.send_header("Content-Length", str(len(body)))
+        for key, value in headers: self.send_header(key, value)
+        self.end_headers(); self.wfile.write(body)
+
+    def _image_path(self, key):
+        # フォルダ外へのアクセス ("../") を防ぐ
+        path = os.path.normpath(os.path.join(self.state.image_dir, key))
+        if not path.startswith(os.path.normpath(self.state.image_dir) + os.sep): return None
+        return os.path.join(self.state.image_dir, key)
+
+    def do_GET(self):
+        url = urlparse(self.path); query = parse_qs(url.query)
+        if url.path == "/": return self._send(200, REVIEW_PAGE, "text/html; charset=utf-8")
+        if url.path == "/api/next":
+            client = query.get("client", [""])[0]
+            if not client: return self._send(400, {"error": "client is required"})
+            try: count = int(query.get("count", ["5"])[0])
+            except ValueError: return self._send(400, {"error": "count must be an integer"})
+            return self._send(200, self.state.lease(client, max(1, min(count, 50))))
+        if url.path == "/api/stats": return self._send(200, self.state.stats())
+        if url.path == "/api/image":
+            path = self._image_path(query.get("name", [""])[0])
+            if path is None: return self._send(400, {"error": "bad name"})
+            try: cached = self.state.images.get(path)
+            except OSError as e: return self._send(404, {"error": str(e)})
+            with open(cached, 'rb') as f: data = f.read()
+            return self._send(200, data, "image/jpeg", [("Cache-Control", "private, max-age=3600")])
+        self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/api/status": return self._send(404, {"error": "not found"})
+        try: payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError: return self._send(400, {"error": "invalid json"})
+        client, key, status = payload.get("client"), payload.get("image"), payload.get("status")
+        if not client or not key or status not in ("approved", "rejected"): return self._send(400, {"error": "client, image, status are required"})
+        error = self.state.set_status(client, key, status)
+        if error: return self._send(error[0], {"error": error[1]})
+        self._send(200, {"ok": True})
+
+REVIEW_PAGE = """<!doctype html>
+<html lang="ja"><head><meta charset="utf-8"><title>レビュー</title>
+<style>
+body{background:#222;color:#eee;font-family:sans-serif;margin:0;text-align:center}
+#bar{padding:8px}button{font-size:16px;margin:0 6px;padding:6px 18px}
+#wrap{position:relative;display:inline-block}#img{max-width:96vw;max-height:80vh;display:block}
+svg{position:absolute;left:0;top:0;width:100%;height:100%}
+</style></head><body>
+<div id="bar"><span id="name"></span> <button onclick="decide('approved')">承認 [A]</button><button onclick="decide('rejected')">却下 [R]</button><span id="stats"></span></div>
+<div id="wrap"><img id="img"><svg id="boxes" viewBox="0 0 1 1" preserveAspectRatio="none"></svg></div>
+<script>
+const client = localStorage.client || (localStorage.client = Math.random().toString(36).slice(2));
+const colors = ["#FF3838","#00C2FF","#FF9D97","#FF701F","#FFB21D","#CFD231","#48F90A","#92CC17","#3DDB86","#1A9334"];
+let queue = [], current = null;
+async function refill(){ if(queue.length < 2){ const items = await (await fetch(`/api/next?client=${client}&count=5`)).json();
+  for(const it of items){ if(!queue.some(q => q.image == it.image) && (!current || current.image != it.image)){ queue.push(it); new Image().src = imgUrl(it); } } } }
+function imgUrl(it){ return `/api/image?name=${encodeURIComponent(it.image)}`; }
+async function show(){ await refill(); current = queue.shift();
+  if(!current){ document.getElementById('name').textContent = '未判定の画像はありません'; document.getElementById('img').removeAttribute('src'); document.getElementById('boxes').innerHTML = ''; return; }
+  document.getElementById('name').textContent = current.image; document.getElementById('img').src = imgUrl(current);
+  document.getElementById('boxes').innerHTML = current.boxes.map(b => `<rect x="${b.cx-b.w/2}" y="${b.cy-b.h/2}" width="${b.w}" height="${b.h}" fill="none" stroke="${colors[b.class_id%colors.length]}" stroke-width="0.004"><title>${b.name}</title></rect>`).join('');
+  refill(); }
+async function decide(status){ if(!current) return;
+  await fetch('/api/status', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify({client, image: current.image, status})}); show(); }
+async function stats(){ const s = await (await fetch('/api/stats')).json(); document.getElementById('stats').textContent = ` 承認 ${s.counts.approved} / 却下 ${s.counts.rejected} / レビュアー ${s.reviewers}`; }
+document.addEventListener('keydown', e => { if(e.key == 'a') decide('approved'); if(e.key == 'r') decide('rejected'); });
+show(); stats(); setInterval(stats, 5000);
+</script></body></html>"""
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカルレビューサーバー")
+    parser.add_argument("project_dir"); parser.add_argument("image_dir")
+    parser.add_argument("--host", default="0.0.0.0"); parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--recursive", action="store_true")
+    args = parser.parse_args()
+    ReviewHandler.state = ReviewState(args.project_dir, args.image_dir, args.recursive)
+    server = ThreadingHTTPServer((args.host, args.port), ReviewHandler)
+    print(f"レビューサーバーを起動しました: http://{args.host}:{args.port}/  (Ctrl+C で終了)")
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally:
+        server.server_close()
+        with ReviewHandler.state.lock: ReviewHandler.state.status.save()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# roi_detect.py
+# 指定した領域だけを切り出して高い解像度で推論し、結果を画像座標に戻して既存のボックスと NMS で統合する
+# 全体推論では入力サイズ (640px) に縮小されて消える小さな物体向け。入力が小さいので CPU でも全体推論より軽い
+import numpy as np
+from PIL import Image
+
+ROI_IMGSZ = 640  # 切り出した領域の推論サイズの上限
+MAX_UPSCALE = 3.0  # 小さな領域を拡大するときの最大倍率
+MIN_REGION = 8  # これより小さい領域 (画素) は推論しない
+STRIDE = 32
+
+def prepare_crop(image, region, imgsz=ROI_IMGSZ, max_upscale=MAX_UPSCALE):
+    # 返り値: (切り出した画像, 倍率, (x方向のずれ, y方向のずれ), 推論サイズ)。領域が小さすぎれば None
+    x1, y1, x2, y2 = (int(round(v)) for v in region)
+    x1, y1, x2, y2 = max(0, min(x1, x2)), max(0, min(y1, y2)), min(image.width, max(x1, x2)), min(image.height, max(y1, y2))
+    if x2 - x1 < MIN_REGION or y2 - y1 < MIN_REGION: return None
+    crop = image.crop((x1, y1, x2, y2))
+    if crop.mode != "RGB": crop = crop.convert("RGB")
+    # 元の解像度のまま (小さければ拡大して) 推論する。長辺が上限を超えるときだけ縮小する
+    scale = min(max_upscale, imgsz / max(crop.size))
+    if abs(scale - 1.0) > 1e-3:
+        crop = crop.resize((max(1, int(round(crop.width * scale))), max(1, int(round(crop.height * scale)))), Image.Resampling.BICUBIC)
+    infer_size = min(imgsz, -(-max(crop.size) // STRIDE) * STRIDE)
+    return crop, scale, (x1, y1), infer_size
+
+def detect_region(model, image, region, class_count, imgsz=ROI_IMGSZ, max_upscale=MAX_UPSCALE):
+    # 返り値: [(画像座標の [x1, y1, x2, y2], クラスID, 確信度)]
+    prepared = prepare_crop(image, region, imgsz, max_upscale)
+    if prepared is None: return []
+    crop, scale, (ox, oy), infer_size = prepared
+    detections = []
+    for result in model(crop, imgsz=infer_size, verbose=False):
+        for box in result.boxes:
+            class_id = int(box.cls[0])
+            if class_id >= class_count: continue
+            # 領域の外へはみ出した分は切り詰める (見えていない範囲のボックスは作らない)
+            bx1, by1, bx2, by2 = (float(v) / scale for v in box.xyxy[0])
+            bx1, bx2 = max(0.0, bx1), min(crop.width / scale, bx2)
+            by1, by2 = max(0.0, by1), min(crop.height / scale, by2)
+            coords = [int(round(ox + bx1)), int(round(oy + by1)), int(round(ox + bx2)), int(round(oy + by2))]
+            if coords[2] > coords[0] and coords[3] > coords[1]: detections.append((coords, class_id, float(box.conf[0])))
+    return detections
+
+def _overlaps(box, boxes):
+    # box と boxes の各行の (IoU, box のうち boxes に覆われている割合)
+    ix1, iy1 = np.maximum(box[0], boxes[:, 0]), np.maximum(box[1], boxes[:, 1])
+    ix2, iy2 = np.minimum(box[2], boxes[:, 2]), np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union = area + areas - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0), inter / max(area, 1e-9)
+
+def nms(detections, iou_threshold=0.5):
+    # クラスごとに確信度の高い順に残す。返り値: 残した detections (確信度の高い順)
+    order = sorted(range(len(detections)), key=lambda i: -detections[i][2])
+    kept = []
+    for i in order:
+        coords, class_id, _ = detections[i]
+        same = [detections[k][0] for k in kept if detections[k][1] == class_id]
+        if same and _overlaps(np.array(coords, float), np.array(same, float))[0].max() >= iou_threshold: continue
+        kept.append(i)
+    return [detections[i] for i in kept]
+
+def merge_detections(existing, detections, iou_threshold=0.5, cover_threshold=0.8):
+    # existing: [(coords, class_id)] 既にあるボックス (作業者が確認したものを優先してそのまま残す)
+    # 既存のボックスと重なる検出はクラスに関係なく捨て、同じクラスのボックスにほぼ覆われる検出 (領域の端で切れた物体) も捨てる
+    # 大きなボックスの中にある別クラスの小さな物体は残す。返り値: 追加する [(coords, class_id, 確信度)]
+    detections = nms(detections, iou_threshold)
+    if not existing: return detections
+    boxes = np.array([coords for coords, _ in existing], float)
+    classes = np.array([class_id for _, class_id in existing])
+    added = []
+    for det in detections:
+        overlap, covered = _overlaps(np.array(det[0], float), boxes)
+        if overlap.max() >= iou_threshold or (covered[classes == det[1]] >= cover_threshold).any(): continue
+        added.append(det)
+    return added
@@ -0,0 +1,61 @@
+# test_remote_source.py
+# RemoteSource を fsspec の memory:// で確認する (python -m pytest test_remote_source.py)
+import os
+import uuid
+import fsspec
+import pytest
+from remote_source import RemoteSource
+
+@pytest.fixture
+def remote(tmp_path):
+    # memory:// はプロセス内で共有されるので、テストごとに別のルートを使う
+    root = f"/bucket_{uuid.uuid4().hex}"
+    fs = fsspec.filesystem("memory")
+    fs.pipe({f"{root}/images/a.jpg": b"a" * 100, f"{root}/images/b.png": b"b" * 100, f"{root}/images/notes.txt": b"x",
+             f"{root}/images/sub/c.jpg": b"c" * 100, f"{root}/labels/a.txt": b"0 0.5 0.5 0.1 0.1\n"})
+    source = RemoteSource(f"memory://{root}/images", str(tmp_path / "cache"), max_bytes=250, workers=2)
+    yield source, fs, root
+    source.close(); fs.rm(root, recursive=True)
+
+def test_list_images(remote):
+    source, _, _ = remote
+    assert source.list_images() == [("a.jpg", 100), ("b.png", 100)]
+    assert source.list_images(recursive=True) == [("a.jpg", 100), ("b.png", 100), ("sub/c.jpg", 100)]
+
+def test_fetch_and_evict(remote):
+    source, _, _ = remote
+    path = source.ensure("a.jpg")
+    assert open(path, 'rb').read() == b"a" * 100
+    assert source.ensure("a.jpg") == path and (source.hits, source.misses) == (1, 1)
+    # 上限 250 バイトに 3枚目が入ると、先読み対象 (pinned) でない最も古い画像を消す
+    source.prefetch(["a.jpg"])
+    source.ensure("b.png"); source.ensure("sub/c.jpg")
+    assert list(source.cached) == ["a.jpg", "sub/c.jpg"] and source.total_bytes == 200 and source.evicted == 1
+    assert not os.path.exists(source.local_path("b.png"))
+
+def test_sync_labels(remote):
+    source, fs, root = remote
+    assert source.sync_labels() == [("a", 18)]
+    assert open(os.path.join(source.labels_dir, "a.txt")).read() == "0 0.5 0.5 0.1 0.1\n"
+    # リモートで更新されたラベルは取り直すが、書き戻し待ちのラベルは上書きしない
+    fs.pipe(f"{root}/labels/a.txt", b"1 0.5 0.5 0.2 0.2\n")
+    fs.pipe(f"{root}/labels/sub/c.txt", b"")
+    source.mark_dirty("a")
+    assert sorted(source.sync_labels()) == [("a", 18), ("sub/c", 0)]
+    assert open(os.path.join(source.labels_dir, "a.txt")).read() == "0 0.5 0.5 0.1 0.1\n"
+    source.take_dirty()
+    source.sync_labels()
+    assert open(os.path.join(source.labels_dir, "a.txt")).read() == "1 0.5 0.5 0.2 0.2\n"
+
+def test_upload(remote):
+    source, fs, root = remote
+    source.sync_labels()
+    with open(os.path.join(source.labels_dir, "b.txt"), 'w') as f: f.write("2 0.5 0.5 0.3 0.3\n")
+    os.remove(os.path.join(source.labels_dir, "a.txt"))
+    source.mark_dirty("a"); source.mark_dirty("b")
+    assert source.upload(source.take_dirty()) == 2
+    assert fs.cat_file(f"{root}/labels/b.txt") == b"2 0.5 0.5 0.3 0.3\n"
+    assert not fs.exists(f"{root}/labels/a.txt")
+    assert source.take_dirty() == set() and "a" not in source.manifest
+    # 自分で書き戻したラベルは次の同期で取り直さない
+    assert source.sync_labels() == [("b", 18)] and source.manifest["b"] is not None
@@ -0,0 +1,80 @@
+# thumbnail_cache.py
+import os
+import json
+import zlib
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageDraw
+from video_source import open_source_image, split_frame_key
+
+THUMB_INDEX_VERSION = 1
+
+class ThumbnailCache:
+    # ボックスを描き込んだサムネイルを JPEG で保存しておく
+    # 画像 (動画フレームは動画ファイル) の mtime・サイズとラベル内容が変わったものだけ作り直す
+    def __init__(self, cache_dir, size=(220, 165)):
+        self.cache_dir, self.size = cache_dir, tuple(size)
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.entries = {}  # 画像キー -> シグネチャ
+        self.lock = threading.Lock()
+        self.generated = 0
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f: data = json.load(f)
+            if data.get("version") == THUMB_INDEX_VERSION and tuple(data.get("size", ())) == self.size: self.entries = data.get("entries", {})
+        except (OSError, ValueError):
+            pass
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + ".jpg")
+
+    def signature(self, image_path, rows):
+        frame = split_frame_key(image_path)
+        st = os.stat(frame[0] if frame else image_path)
+        return f"{st.st_mtime_ns}:{st.st_size}:{zlib.crc32(repr(rows).encode()):08x}"
+
+    def _render(self, image_path, rows, frame_cache, colors):
+        source = open_source_image(image_path, frame_cache)
+        source.draft(None, (self.size[0] * 2, self.size[1] * 2))  # JPEGは縮小デコードで高速化
+        # 動画フレームはキャッシュ上の画像なので、必ずコピーしてから縮小する
+        image = source.convert('RGB') if source.mode != 'RGB' else source.copy()
+        if not split_frame_key(image_path): source.close()
+        image.thumbnail(self.size, Image.Resampling.BILINEAR)
+        draw = ImageDraw.Draw(image); w, h = image.size
+        for class_id, cx, cy, bw, bh in rows or ():
+            draw.rectangle([(cx - bw / 2) * w, (cy - bh / 2) * h, (cx + bw / 2) * w, (cy + bh / 2) * h], outline=colors(int(class_id)), width=2)
+        return image
+
+    def _build(self, key, image_path, rows, frame_cache, colors):
+        sig = self.signature(image_path, rows)
+        path = self.path(key)
+        with self.lock: cached = self.entries.get(key) == sig
+        if cached and os.path.exists(path): return path
+        image = self._render(image_path, rows, frame_cache, colors)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"  # 先読みと表示で同じ画像を同時に作ることがある
+        image.save(tmp_path, "JPEG", quality=85)
+        os.replace(tmp_path, path)
+        with self.lock: self.entries[key] = sig; self.generated += 1
+        return path
+
+    def generate(self, jobs, frame_cache, colors, workers=4, cancel_event=None, on_ready=None):
+        # jobs: [(画像キー, 画像パス, ラベル行 or None), ...]。でき上がった順ではなく jobs の順に on_ready(key, path or None) を呼ぶ
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        def build(job):
+            if cancel_event is not None and cancel_event.is_set(): return job[0], None
+            try: return job[0], self._build(*job, frame_cache, colors)
+            except Exception as e:
+                print(f"Thumbnail error ({job[0]}): {e}"); return job[0], None
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for key, path in pool.map(build, jobs):
+                if on_ready: on_ready(key, path)
+
+    def save(self):
+        with self.lock:
+            data = {"version": THUMB_INDEX_VERSION, "size": list(self.size), "entries": dict(self.entries)}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, self.index_path)
@@ -3,6 +3,9 @@ import os
 import yaml
 import json
 
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
 def format_bytes(size):
     if size == 0: return "0 B"
     power, n = 1024, 0
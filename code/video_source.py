@@ -0,0 +1,106 @@
+# video_source.py
+import os
+import threading
+from collections import OrderedDict
+import cv2
+from PIL import Image
+from utils import VIDEO_EXTENSIONS
+
+# 動画は1フレーム = 1画像として扱う。キーは "sub/clip.mp4/000123.jpg" (ラベルは labels/sub/clip.mp4/000123.txt)
+FRAME_SUFFIX = ".jpg"
+
+def is_video(name):
+    return name.lower().endswith(VIDEO_EXTENSIONS)
+
+def frame_key(video_rel, index):
+    return f"{video_rel}/{index:06d}{FRAME_SUFFIX}"
+
+def split_frame_key(path):
+    # "…/clip.mp4/000123.jpg" -> ("…/clip.mp4", 123)。動画フレームでなければ None
+    video, _, name = path.rpartition('/')
+    if not is_video(video): return None
+    try: return video, int(os.path.splitext(name)[0])
+    except ValueError: return None
+
+def probe_frame_count(path):
+    cap = cv2.VideoCapture(path)
+    try: return max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0) if cap.isOpened() else 0
+    finally: cap.release()
+
+def probe_frame_size(path):
+    cap = cv2.VideoCapture(path)
+    try: return (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))) if cap.isOpened() else (0, 0)
+    finally: cap.release()
+
+def expand_video(video_rel, size, frame_count):
+    # 動画1本をフレームのキーに展開する (容量はフレーム数で按分)
+    per_frame = size // frame_count if frame_count else 0
+    return [(frame_key(video_rel, i), per_frame) for i in range(frame_count)]
+
+def open_source_image(path, frame_cache):
+    # 画像ファイルは遅延読み込みのまま返す。動画フレームはキャッシュ上のデコード済み画像を返す
+    parsed = split_frame_key(path)
+    if parsed: return frame_cache.get(*parsed)
+    return Image.open(path)
+
+class VideoFrameCache:
+    # 動画ごとに VideoCapture を開いたままにし、カーソル周辺のデコード済みフレームを LRU で保持する
+    def __init__(self, capacity=64, readahead=4, max_skip=90, max_open=4):
+        self.capacity, self.readahead, self.max_skip, self.max_open = capacity, readahead, max_skip, max_open
+        self.frames = OrderedDict()    # (video_path, index) -> PIL.Image
+        self.captures = OrderedDict()  # video_path -> [VideoCapture, 次に読むフレーム番号]
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.seeks = 0
+
+    def _capture(self, path):
+        entry = self.captures.get(path)
+        if entry is not None:
+            self.captures.move_to_end(path); return entry
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened(): raise OSError(f"動画を開けません: {path}")
+        entry = self.captures[path] = [cap, 0]
+        while len(self.captures) > self.max_open:
+            _, (old, _) = self.captures.popitem(last=False); old.release()
+        return entry
+
+    def _store(self, path, index, frame):
+        image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        self.frames[(path, index)] = image; self.frames.move_to_end((path, index))
+        while len(self.frames) > self.capacity: self.frames.popitem(last=False)
+        return image
+
+    def get(self, path, index):
+        with self.lock:
+            image = self.frames.get((path, index))
+            if image is not None:
+                self.hits += 1; self.frames.move_to_end((path, index)); return image
+            self.misses += 1
+            entry = self._capture(path); cap = entry[0]
+            # 少し先のフレームは grab() で読み進める (色変換なしで安価)。
+            # 戻る・大きく飛ぶ場合だけシークする (OpenCVは直前のキーフレームからデコードし直す)
+            if not entry[1] <= index <= entry[1] + self.max_skip:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, index); entry[1] = index; self.seeks += 1
+            while entry[1] < index and cap.grab(): entry[1] += 1
+            # 次の画像へ進む操作に備えて数フレーム先まで一緒にデコードしておく
+            for i in range(index, index + 1 + self.readahead) if entry[1] == index else ():
+                ok, frame = cap.read()
+                if not ok: break
+                entry[1] = i + 1
+                stored = self._store(path, i, frame)
+                if i == index: image = stored
+            if image is None:
+                self.captures.pop(path)[0].release()  # 読み取り位置が不定になるので開き直させる
+                raise OSError(f"フレームを読み込めません: {path} #{index}")
+            return image
+
+    def invalidate(self, path):
+        with self.lock:
+            for key in [k for k in self.frames if k[0] == path]: del self.frames[key]
+            entry = self.captures.pop(path, None)
+            if entry: entry[0].release()
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            for cap, _ in self.captures.values(): cap.release()
+            self.captures.clear()
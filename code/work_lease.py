@@ -0,0 +1,65 @@
+# work_lease.py
+import os
+import json
+import time
+import uuid
+import socket
+import getpass
+from filelock import FileLock
+
+class WorkLease:
+    # 同じフォルダを複数のインスタンスで分担するための作業予約
+    # .{image_dir_name}_leases.json に {所有者ID: {"user", "host", "expires", "images"}} を保存し、FileLock で排他する
+    def __init__(self, project_dir, image_dir_name, ttl=120, block_size=200):
+        self.path = os.path.join(project_dir, f".{image_dir_name}_leases.json")
+        self.lock = FileLock(self.path + ".lock", timeout=10)
+        self.ttl, self.block_size = ttl, block_size
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        try: self.user = getpass.getuser()
+        except Exception: self.user = "unknown"
+        self.images = []
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f: leases = json.load(f)
+        except (OSError, ValueError):
+            leases = {}
+        # 期限切れ (異常終了したインスタンス) の予約は破棄する
+        now = time.time()
+        return {owner: lease for owner, lease in leases.items() if lease.get("expires", 0) > now}
+
+    def _save(self, leases):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(leases, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _put(self, leases):
+        leases[self.owner] = {"user": self.user, "host": socket.gethostname(), "expires": time.time() + self.ttl, "images": self.images}
+        self._save(leases)
+
+    def claim(self, candidates, count=None):
+        # 他のインスタンスが予約していない候補から count 枚 (既定 block_size) を追加で予約し、追加分を返す
+        with self.lock:
+            leases = self._load()
+            taken = {image for owner, lease in leases.items() if owner != self.owner for image in lease["images"]}
+            mine = set(self.images); added = []
+            for image in candidates:
+                if len(added) >= (count or self.block_size): break
+                if image not in taken and image not in mine: added.append(image); mine.add(image)
+            self.images = self.images + added
+            self._put(leases)
+        return added
+
+    def others(self):
+        with self.lock: leases = self._load()
+        return [(lease["user"], lease["host"], len(lease["images"])) for owner, lease in leases.items() if owner != self.owner]
+
+    def heartbeat(self):
+        with self.lock: self._put(self._load())
+
+    def release(self):
+        with self.lock:
+            leases = self._load()
+            leases.pop(self.owner, None)
+            self._save(leases)
+        self.images = []